@@ -1,14 +1,7 @@
-import pickle as pkl
-
 from prism_tracker import config
-from prism_tracker.preprocessing.annotation import (
-    load_annotations_dict, load_clap_times, load_classes_dict, load_processed,
-)
-from prism_tracker.preprocessing.audio import preprocess_audio
-from prism_tracker.preprocessing.feature_extraction import (
-    build_audio_only_model, build_motion_only_model, create_feature_pkl,
-)
-from prism_tracker.preprocessing.motion import preprocess_motion
+from prism_tracker.preprocessing.catalog import Catalog
+from prism_tracker.preprocessing.manifest import Manifest
+from prism_tracker.preprocessing.pipeline import PretrainedModels, build_participant
 
 task_name = 'cooking'
 half = {
@@ -19,53 +12,36 @@ root_path = config.datadrive / 'tasks' / task_name
 dataset_dir = root_path / 'dataset'
 preprocessed_dir = root_path / 'preprocessed'
 preprocessed_dir.mkdir(exist_ok=True, parents=True)
+cache_dir = root_path / 'cache'
 
-# load the data
-annotations = load_annotations_dict(dataset_dir)
-classes_dict = load_classes_dict(dataset_dir)
-clap_dict = load_clap_times(dataset_dir)
+# load the annotations, clap times and classes (parsed once, then loaded from cache/catalog.npz until they change)
+catalog = Catalog.open(dataset_dir, cache_dir / 'catalog.npz')
+classes_dict = catalog.classes
+clap_dict = catalog.clap_times
 
-# check if we've already processed these participants -> returns a list of
-# participants that are done
-done = load_processed(preprocessed_dir)
-# done = done[2:]
-#done = []
-print('done file: ', done)
+# the manifest records which inputs and parameters each stage of each participant was built from,
+# so that only the stages whose inputs changed are recomputed
+manifest = Manifest(cache_dir / 'manifest.json')
+# set to 'float16' or 'int8' to embed with the quantized TFLite encoders (see prism_tracker/preprocessing/encoders.py)
+models = PretrainedModels(quantization=None)
 
 processed = []
-raw_audio_dir = dataset_dir / 'audio' / 'raw'
-
-for fpath in raw_audio_dir.iterdir():
 
-    if not fpath.is_file():
-        continue
-    print(f'\n-----preprocess {fpath.name}-----')
-    participant_name = fpath.stem
-    if (participant_name not in annotations):
+for participant_name in catalog.recordings['raw_audio']:
+    print(f'\n-----preprocess {participant_name}-----')
+    if (participant_name not in catalog):
         print(f'{participant_name} not in csv file')
         continue
-    if (participant_name in done):
-        print(f'{participant_name} already done')
-        continue
     if (participant_name not in clap_dict):
         print(f'Skipping {participant_name}, cannot find clap time')
         continue
 
-    preprocess_audio(participant_name, dataset_dir, clap_dict)
-    preprocess_motion(participant_name, dataset_dir, clap_dict)
-    processed.append(participant_name)
+    rebuilt = build_participant(participant_name, dataset_dir, preprocessed_dir, cache_dir, manifest,
+                                catalog, classes_dict, clap_dict, models, half=half)
+    if len(rebuilt) == 0:
+        print(f'{participant_name} already up to date')
+    else:
+        print(f'{participant_name} rebuilt stages: {rebuilt}')
+        processed.append(participant_name)
 
 print('newly preprocessed: ', processed)
-audio_model = build_audio_only_model()
-imu_model = build_motion_only_model()
-
-for pid in processed:
-    dataset = create_feature_pkl(
-            pid,
-            annotations,
-            dataset_dir,
-            classes_dict,
-            audio_model,
-            imu_model, half=half)
-    with open(preprocessed_dir / f'{pid}.pkl', 'wb') as f:
-        pkl.dump(dataset, f)
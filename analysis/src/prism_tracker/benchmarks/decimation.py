@@ -0,0 +1,104 @@
+"""
+Accuracy and speed of frame-decimated tracking.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.decimation
+
+Synthetic sessions are drawn from a procedure graph with durations of tens of seconds (in 0.21 s frames), and noisy
+classifier outputs are drawn around the true steps. Each session is tracked at full rate and with every decimation
+factor; the report gives the frame accuracy of the final path, its agreement with the full-rate path, the mean
+distance between the true and the tracked step changes, and the tracking time.
+"""
+import json
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..tracker.decimation import DecimatedTracker
+from ..tracker.viterbi import ViterbiTracker
+from .generators import estimate_confusion_matrix, make_graph, make_session
+
+FACTORS = [1, 2, 4, 8]
+NUM_SESSIONS = 5
+
+
+def change_error(truth: np.ndarray, path: np.ndarray) -> float:
+    """
+    The mean distance in frames from each true step change to the nearest tracked step change.
+    """
+    true_changes = np.nonzero(truth[1:] != truth[:-1])[0]
+    changes = np.nonzero(path[1:] != path[:-1])[0]
+    if len(true_changes) == 0 or len(changes) == 0:
+        return float('nan')
+    return float(np.abs(true_changes[:, np.newaxis] - changes[np.newaxis]).min(axis=1).mean())
+
+
+def track(tracker: ViterbiTracker, observations: np.ndarray, cm: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Returns:
+    * path (np.ndarray): the last path returned by the tracker.
+    * seconds (float): the time it took to track the session.
+    """
+    start = time.perf_counter()
+    for _, path in tracker.predict(observations.T, cm):
+        pass
+    return np.array(path), time.perf_counter() - start
+
+
+def run(factors: List[int] = FACTORS, num_sessions: int = NUM_SESSIONS, history_window: int = 64,
+        seed: int = 0) -> Dict:
+    """
+    Track the same sessions at full rate and with every decimation factor. The paths are taken from trackers that
+    keep the full history, and the times from trackers that keep `history_window` frames, as in real time.
+
+    Returns:
+    * result (Dict): per factor, the mean frame accuracy, agreement with the full-rate path, step-change error
+      (frames) and tracking seconds over the sessions, and the speedup over the full rate.
+    """
+    rng = np.random.default_rng(seed)
+    graph = make_graph(rng)
+    cm = estimate_confusion_matrix(graph, rng)
+    sessions = [make_session(graph, rng) for _ in range(num_sessions)]
+
+    full_paths, full_seconds = [], 0.0
+    for _, observations in sessions:
+        full_paths.append(track(ViterbiTracker(graph, start_step_indices=[0]), observations, cm)[0])
+        full_seconds += track(ViterbiTracker(graph, start_step_indices=[0], history_window=history_window),
+                              observations, cm)[1]
+
+    results = {}
+    for factor in factors:
+        accuracy, agreement, errors, seconds = [], [], [], 0.0
+        for (truth, observations), full_path in zip(sessions, full_paths):
+            path, _ = track(DecimatedTracker(graph, factor, start_step_indices=[0]), observations, cm)
+            seconds += track(DecimatedTracker(graph, factor, start_step_indices=[0], history_window=history_window),
+                             observations, cm)[1]
+            accuracy.append(np.mean(path == truth))
+            agreement.append(np.mean(path == full_path))
+            errors.append(change_error(truth, path))
+        results[factor] = {
+            'accuracy': float(np.mean(accuracy)),
+            'agreement_with_full_rate': float(np.mean(agreement)),
+            'change_error_frames': float(np.nanmean(errors)),
+            'seconds': seconds,
+            'speedup': full_seconds / seconds,
+        }
+    return {
+        'num_frames': int(sum(len(truth) for truth, _ in sessions)),
+        'full_rate': {
+            'accuracy': float(np.mean([np.mean(path == truth) for (truth, _), path in zip(sessions, full_paths)])),
+            'change_error_frames': float(np.nanmean([change_error(truth, path)
+                                                     for (truth, _), path in zip(sessions, full_paths)])),
+            'seconds': full_seconds,
+        },
+        'factors': results,
+    }
+
+
+def main():
+    print(json.dumps(run(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Load time and latency of the pretrained encoders: Keras against the exported TFLite models.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.encoders [--quantization float16 int8]
+
+Each encoder is loaded, then timed on a single example (as in streaming) and on a batch (as in preprocessing), with
+random inputs of the encoder's input shape. The TFLite models must be exported first (see preprocessing/encoders.py).
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from ..preprocessing.encoders import ENCODERS, QUANTIZATIONS, TFLiteEncoder, parity_report, tflite_model_path
+from .observation import median_seconds
+
+BATCH_SIZES = [1, 64]
+
+
+def timed_load(load: Callable):
+    start = time.perf_counter()
+    model = load()
+    return model, time.perf_counter() - start
+
+
+def time_encoder(encoder, examples: np.ndarray, batch_sizes: List[int] = BATCH_SIZES) -> Dict:
+    """
+    Returns:
+    * result (Dict): the median seconds per example for each batch size.
+    """
+    return {batch_size: median_seconds(lambda: encoder([examples[:batch_size]]),
+                                       repeat=max(3, 100 // batch_size)) / batch_size
+            for batch_size in batch_sizes}
+
+
+def run(keras_models: Dict, keras_load_s: Dict, quantizations: List[str], batch_sizes: List[int] = BATCH_SIZES,
+        seed: int = 0) -> Dict:
+    """
+    Time the Keras encoders and the TFLite encoders of each quantization whose files exist.
+
+    Args:
+    * keras_models (Dict): encoder name -> Keras model.
+    * keras_load_s (Dict): encoder name -> seconds it took to load the Keras model.
+    * quantizations (List[str]): the TFLite variants to compare.
+
+    Returns:
+    * result (Dict): per encoder and variant, the load seconds, the seconds per example for each batch size, and the
+      parity against Keras for the TFLite variants.
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    for encoder_name in ENCODERS:
+        keras_model = keras_models[encoder_name]
+        examples = rng.normal(size=[max(batch_sizes)] + list(keras_model.inputs[0].shape[1:])).astype(np.float32)
+
+        results[encoder_name] = {'keras': {'load_s': keras_load_s[encoder_name],
+                                           'per_example_s': time_encoder(keras_model, examples, batch_sizes)}}
+        for quantization in quantizations:
+            path = tflite_model_path(encoder_name, quantization)
+            if not path.exists():
+                continue
+            encoder, load_s = timed_load(lambda: TFLiteEncoder(path))
+            results[encoder_name][quantization] = {
+                'load_s': load_s,
+                'size_bytes': path.stat().st_size,
+                'per_example_s': time_encoder(encoder, examples, batch_sizes),
+                'parity': parity_report(keras_model, encoder, examples),
+            }
+    return results
+
+
+def main():
+    from ..preprocessing.feature_extraction import build_audio_only_model, build_motion_only_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quantization', nargs='+', choices=QUANTIZATIONS, default=QUANTIZATIONS)
+    args = parser.parse_args()
+
+    keras_models, keras_load_s = {}, {}
+    keras_models['audio'], keras_load_s['audio'] = timed_load(build_audio_only_model)
+    keras_models['motion'], keras_load_s['motion'] = timed_load(build_motion_only_model)
+    print(json.dumps(run(keras_models, keras_load_s, args.quantization), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Seeded generators of synthetic procedures, observations and sensor recordings, so that every stage of the pipeline
+can be benchmarked without the real dataset.
+
+Every generator takes a np.random.Generator, so the same seed always gives the same data. The files follow the layout
+of the datadrive described in the README (see make_datadrive()).
+"""
+import pathlib
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..tracker.collections import Graph, Step
+
+NUM_STEPS = 12
+CLASSIFIER_ACCURACY = 0.6  # the probability that a frame's observation peaks on the true step
+SKIP_PROBABILITY = 0.2  # the probability of leaving a step to another step than the next one
+
+RAW_AUDIO_SAMPLE_RATE = 44100
+IMU_SAMPLE_RATE = 50
+NUM_IMU_COLUMNS = 21  # see preprocessing.motion.utils.SENSOR_COLUMNS
+CLAP_MS = 1000.0
+FRAME_SECONDS = 0.21  # see preprocessing.params.EXAMPLE_HOP_SECONDS
+
+
+def make_graph(rng: np.random.Generator, num_steps: int = NUM_STEPS, branching: int = 1,
+               mean_range: Tuple[float, float] = (60, 300), std_ratio: Tuple[float, float] = (0.1, 0.3)) -> Graph:
+    """
+    A mostly linear procedure: each step goes on to the next one, and sometimes skips ahead.
+
+    Args:
+    * rng (np.random.Generator): the random generator.
+    * num_steps (int): the number of steps.
+    * branching (int): the number of steps that can be skipped at once (0 gives a linear procedure).
+    * mean_range (Tuple[float, float]): the range of the mean durations of the steps, in frames.
+    * std_ratio (Tuple[float, float]): the range of the standard deviation of a duration relative to its mean.
+
+    Returns:
+    * graph (Graph): the graph, starting at step 0 and ending at step num_steps - 1.
+    """
+    steps = [Step(i, float(rng.uniform(*mean_range)), 0.0) for i in range(num_steps)]
+    for step in steps:
+        step.std_time = float(step.mean_time * rng.uniform(*std_ratio))
+
+    edges = {}
+    for i, step in enumerate(steps[:-1]):
+        skipped = steps[i + 2:min(i + 2 + branching, num_steps)]
+        edges[step] = {steps[i + 1]: 1.0 - SKIP_PROBABILITY if len(skipped) > 0 else 1.0}
+        for dest_step in skipped:
+            edges[step][dest_step] = SKIP_PROBABILITY / len(skipped)
+    return Graph(steps, edges)
+
+
+def make_session(graph: Graph, rng: np.random.Generator,
+                 accuracy: float = CLASSIFIER_ACCURACY) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Walk the graph from its first step, and draw the classifier probabilities of each frame.
+
+    Returns:
+    * truth (np.ndarray): the true step index of each frame.
+    * observations (np.ndarray): the probabilities with shape (num_frames, num_steps).
+    """
+    step, truth = graph.start, []
+    while True:
+        duration = max(int(round(rng.normal(step.mean_time, step.std_time))), 1)
+        truth += [step.index] * duration
+        if step not in graph.edges:
+            break
+        dest_steps = list(graph.edges[step])
+        step = dest_steps[rng.choice(len(dest_steps), p=[graph.edges[step][dest_step] for dest_step in dest_steps])]
+    truth = np.array(truth)
+    return truth, make_observations(truth, len(graph.steps), rng, accuracy)
+
+
+def make_observations(truth: np.ndarray, num_steps: int, rng: np.random.Generator,
+                      accuracy: float = CLASSIFIER_ACCURACY) -> np.ndarray:
+    """
+    Draw noisy classifier probabilities around the true steps: each frame peaks on its true step with probability
+    `accuracy`, and on a random step otherwise.
+    """
+    peaks = np.where(rng.random(len(truth)) < accuracy, truth, rng.integers(0, num_steps, len(truth)))
+    observations = rng.dirichlet(np.full(num_steps, 0.5), size=len(truth))
+    observations[np.arange(len(truth)), peaks] += 1.0
+    return observations / observations.sum(axis=1, keepdims=True)
+
+
+def make_confusion_matrix(num_steps: int, rng: np.random.Generator,
+                          accuracy: float = CLASSIFIER_ACCURACY) -> np.ndarray:
+    """
+    A confusion matrix whose rows put `accuracy` on the true step and spread the rest at random.
+    """
+    confusion = rng.dirichlet(np.ones(num_steps), size=num_steps) * (1 - accuracy)
+    confusion[np.arange(num_steps), np.arange(num_steps)] += accuracy
+    return confusion / confusion.sum(axis=1, keepdims=True)
+
+
+def estimate_confusion_matrix(graph: Graph, rng: np.random.Generator, num_sessions: int = 3,
+                              accuracy: float = CLASSIFIER_ACCURACY) -> np.ndarray:
+    """
+    The confusion probabilities of the synthetic classifier, estimated on held-out sessions as in evaluation.py.
+    """
+    num_steps = len(graph.steps)
+    cm = np.zeros((num_steps, num_steps))
+    for _ in range(num_sessions):
+        truth, observations = make_session(graph, rng, accuracy)
+        np.add.at(cm, (truth, observations.argmax(axis=1)), 1)
+    return cm / np.maximum(cm.sum(axis=1, keepdims=True), 1)
+
+
+def make_step_names(num_steps: int) -> List[str]:
+    """
+    The step list of a synthetic task (as in steps.txt), with the 'begin' and 'end' steps of build_graph().
+    """
+    return ['begin'] + [f'step{i}' for i in range(num_steps)] + ['end']
+
+
+def make_feature_pkls(directory: pathlib.Path, graph: Graph, steps: List[str], num_participants: int,
+                      rng: np.random.Generator, num_features: int = 16) -> List[pathlib.Path]:
+    """
+    Write the feature pickles of synthetic participants (see create_feature_pkl()), for build_graph() and
+    perform_loo(). The labels follow sessions of the graph, whose step i is steps[i + 1], and the features are noisy
+    one-hot encodings of the labels.
+
+    Returns:
+    * pickle_files (List[pathlib.Path]): the pickle file of each participant.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(exist_ok=True, parents=True)
+    pickle_files = []
+    for participant in range(num_participants):
+        truth, _ = make_session(graph, rng)
+        labels = [steps[step_index + 1] for step_index in truth]
+        label_ids = truth + 1
+        features = rng.normal(size=(len(labels), num_features))
+        features[np.arange(len(labels)), label_ids % num_features] += 1.5
+        data = {
+            'IMU': features[:, :num_features // 2],
+            'audio': features[:, num_features // 2:],
+            'labels': labels,
+            'timestamp': list(np.arange(len(labels)) * FRAME_SECONDS * 1000),
+        }
+        pickle_file = directory / f'P{participant}.pkl'
+        with open(pickle_file, 'wb') as fp:
+            pickle.dump(data, fp)
+        pickle_files.append(pickle_file)
+    return pickle_files
+
+
+def make_wav(path: pathlib.Path, seconds: float, rng: np.random.Generator,
+             sample_rate: int = RAW_AUDIO_SAMPLE_RATE) -> pathlib.Path:
+    """
+    Write a 16-bit mono WAV file of noise with a few tones, like a kitchen recording.
+    """
+    from scipy.io import wavfile
+
+    times = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = 0.1 * rng.normal(size=len(times))
+    for frequency in rng.uniform(200, 4000, size=3):
+        audio += 0.2 * np.sin(2 * np.pi * frequency * times) * (rng.random() < 0.8)
+    audio = np.clip(audio, -1, 1)
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    wavfile.write(path, sample_rate, (audio * 32767).astype(np.int16))
+    return path
+
+
+def make_imu_log(path: pathlib.Path, seconds: float, rng: np.random.Generator, start_time: float = 1.6e9,
+                 sample_rate: int = IMU_SAMPLE_RATE) -> pathlib.Path:
+    """
+    Write a raw SensorLogger motion log: NUM_IMU_COLUMNS whitespace-separated values per line, starting with the unix
+    time and ending with the sensor time in seconds (see preprocessing.motion.utils.read_raw_motion()).
+    """
+    num_samples = int(seconds * sample_rate)
+    log = rng.normal(size=(num_samples, NUM_IMU_COLUMNS))
+    log[:, 0] = start_time + np.arange(num_samples) / sample_rate
+    log[:, -1] = np.arange(num_samples) / sample_rate
+
+    path = pathlib.Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    np.savetxt(path, log)
+    return path
+
+
+def make_annotation(steps: List[str], seconds: float, rng: np.random.Generator) -> List[Tuple[float, str]]:
+    """
+    The annotated (time in ms, task) rows of a recording: the header, the clap, and the steps in order with random
+    durations that fill the recording after the clap.
+    """
+    step_names = [step for step in steps if step not in ('begin', 'end')]
+    durations = rng.dirichlet(np.ones(len(step_names))) * (seconds * 1000 - 2 * CLAP_MS)
+    times = CLAP_MS + np.concatenate([[0], np.cumsum(durations)])
+    rows = [(0.0, 'header'), (CLAP_MS, 'clap')]
+    rows += [(float(time), step) for time, step in zip(times[:-1], step_names)]
+    rows.append((float(times[-1]), 'end'))
+    return rows
+
+
+def make_dataset(dataset_dir: pathlib.Path, steps: List[str], participants: List[str], seconds: float,
+                 rng: np.random.Generator) -> pathlib.Path:
+    """
+    Write the raw dataset of a synthetic task: annotation.csv, classes.txt, clap_times.csv, and the raw audio and
+    motion recordings of each participant, each lasting `seconds`.
+    """
+    dataset_dir = pathlib.Path(dataset_dir)
+    dataset_dir.mkdir(exist_ok=True, parents=True)
+
+    annotation_lines = ['Participant,Timestamp,Task']
+    for participant in participants:
+        for i, (time, task) in enumerate(make_annotation(steps, seconds, rng)):
+            annotation_lines.append(f'{participant if i == 0 else ""},{time},{task}')
+        make_wav(dataset_dir / 'audio' / 'raw' / f'{participant}.wav', seconds, rng)
+        make_imu_log(dataset_dir / 'motion' / 'raw' / f'{participant}.txt', seconds, rng)
+
+    (dataset_dir / 'annotation.csv').write_text('\n'.join(annotation_lines) + '\n')
+    classes = [step for step in steps if step not in ('begin', 'end')]
+    (dataset_dir / 'classes.txt').write_text('\n'.join(classes) + '\n')
+    (dataset_dir / 'clap_times.csv').write_text(
+        'pid,time\n' + ''.join(f'{participant}, {CLAP_MS}\n' for participant in participants))
+    return dataset_dir
+
+
+class ProjectionEncoder:
+    def __init__(self, example_shape: Tuple[int, ...], rng: np.random.Generator, embedding_size: int = 128):
+        """
+        A random linear encoder that is called like the pretrained ones: encoder([examples]) -> embeddings.
+        It stands in for the Keras models when benchmarking the rest of the preprocessing (the encoders themselves are
+        timed by benchmarks/encoders.py).
+        """
+        self.weights = rng.normal(size=(int(np.prod(example_shape)), embedding_size)).astype(np.float32)
+
+    def __call__(self, inputs) -> np.ndarray:
+        examples = np.asarray(inputs[0], dtype=np.float32)
+        return examples.reshape(len(examples), -1) @ self.weights
+
+
+def make_datadrive(root: pathlib.Path, rng: np.random.Generator, task: str = 'synthetic',
+                   participants: Optional[List[str]] = None, seconds: float = 60.0,
+                   num_steps: int = 5) -> Dict[str, pathlib.Path]:
+    """
+    Write a datadrive with one synthetic task and the motion normalization parameters, to point PRISM_DATADRIVE
+    (or config.datadrive) at. The pretrained encoders are not included.
+
+    Returns:
+    * paths (Dict[str, pathlib.Path]): the 'datadrive', 'dataset', 'preprocessed' and 'cache' directories.
+    """
+    root = pathlib.Path(root)
+    participants = ['P1', 'P2'] if participants is None else participants
+
+    model_dir = root / 'pretrained_models'
+    model_dir.mkdir(exist_ok=True, parents=True)
+    norm_params = {'max': np.full(3, 10.0), 'min': np.full(3, -10.0), 'mean': np.zeros(3), 'std': np.ones(3)}
+    with open(model_dir / 'motion_norm_params.pkl', 'wb') as fp:
+        pickle.dump(norm_params, fp)
+    (root / 'model_caches').mkdir(exist_ok=True)
+
+    task_dir = root / 'tasks' / task
+    dataset_dir = make_dataset(task_dir / 'dataset', make_step_names(num_steps), participants, seconds, rng)
+    return {'datadrive': root, 'dataset': dataset_dir, 'preprocessed': task_dir / 'preprocessed',
+            'cache': task_dir / 'cache'}
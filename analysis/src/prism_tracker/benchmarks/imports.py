@@ -0,0 +1,97 @@
+"""
+Import-time and RSS regression benchmark.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.imports
+
+Each module is imported in a fresh interpreter. The run fails if a lightweight module pulls in a heavy dependency
+or exceeds its time or memory budget.
+"""
+import json
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+# heavy third-party packages that must only be loaded on first use
+HEAVY_MODULES = ['tensorflow', 'keras', 'sklearn', 'matplotlib', 'pandas', 'librosa', 'soundfile', 'scipy.stats']
+
+# module -> (max import seconds, max additional RSS in MB over a bare numpy import)
+BUDGETS = {
+    'prism_tracker.tracker.viterbi': (0.2, 10.0),
+    'prism_tracker.scripts.evaluation': (0.5, 30.0),
+    'prism_tracker.scripts.metrics': (0.5, 30.0),
+    'prism_tracker.preprocessing.feature_extraction': (0.5, 30.0),
+}
+
+_PROBE = '''
+import json, resource, sys, time
+import numpy
+baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': seconds, 'rss_kb': rss, 'baseline_rss_kb': baseline_rss,
+                  'modules': sorted(sys.modules)}}))
+'''
+
+
+def measure_import(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter and measure its import time and peak RSS.
+
+    Args:
+    * module (str): the dotted name of the module to import.
+
+    Returns:
+    * result (Dict): the import time in seconds, the peak RSS and the RSS added over numpy in MB,
+      and the heavy modules that were loaded.
+    """
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                            check=True, capture_output=True, text=True).stdout
+    probe = json.loads(output.strip().splitlines()[-1])
+    loaded = set(probe['modules'])
+    return {
+        'module': module,
+        'seconds': probe['seconds'],
+        'rss_mb': probe['rss_kb'] / 1024,
+        'added_rss_mb': (probe['rss_kb'] - probe['baseline_rss_kb']) / 1024,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def check_budgets(budgets: Optional[Dict] = None, repeat: int = 3) -> List[Dict]:
+    """
+    Measure every module in the budgets and report violations.
+    The fastest of `repeat` runs is kept to reduce noise from a cold disk cache.
+
+    Returns:
+    * results (List[Dict]): the measurements, each with a list of budget violations.
+    """
+    budgets = BUDGETS if budgets is None else budgets
+    results = []
+
+    for module, (max_seconds, max_added_rss_mb) in budgets.items():
+        result = min((measure_import(module) for _ in range(repeat)), key=lambda r: r['seconds'])
+        violations = []
+        if len(result['heavy_modules']) > 0:
+            violations.append(f'loads heavy modules: {result["heavy_modules"]}')
+        if result['seconds'] > max_seconds:
+            violations.append(f'import takes {result["seconds"]:.3f}s > {max_seconds}s')
+        if result['added_rss_mb'] > max_added_rss_mb:
+            violations.append(f'import adds {result["added_rss_mb"]:.1f}MB RSS > {max_added_rss_mb}MB')
+        result['violations'] = violations
+        results.append(result)
+
+    return results
+
+
+def main():
+    results = check_budgets()
+    print(json.dumps(results, indent=2))
+    if any(len(result['violations']) > 0 for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
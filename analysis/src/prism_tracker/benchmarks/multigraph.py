@@ -0,0 +1,71 @@
+"""
+Cost of tracking several candidate procedures at once.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.multigraph
+
+Synthetic procedures are drawn from benchmarks/generators.py, and a session of the first one is tracked on every
+candidate: the other procedures see the outputs of classifiers that know nothing about the session. The report gives,
+per number of candidates, the time of one ViterbiTracker per procedure, of MultiGraphTracker without pruning and with
+the default beam, and whether the true procedure was reported.
+"""
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from ..tracker.multigraph import MultiGraphTracker
+from ..tracker.viterbi import ViterbiTracker
+from .generators import estimate_confusion_matrix, make_graph, make_session
+
+NUM_PROCEDURES = [1, 2, 4, 8]
+
+
+def run(num_procedures: List[int] = NUM_PROCEDURES, seed: int = 0) -> Dict:
+    """
+    Returns:
+    * result (Dict): per number of candidates, the tracking seconds of each approach and the reported procedure.
+    """
+    rng = np.random.default_rng(seed)
+    graphs = {f'procedure_{i}': make_graph(rng, num_steps=int(rng.integers(8, 16))) for i in range(max(num_procedures))}
+    confusion_matrices = {name: estimate_confusion_matrix(graph, rng) for name, graph in graphs.items()}
+    _, session = make_session(graphs['procedure_0'], rng)
+    observations = {name: session if name == 'procedure_0' else
+                    rng.dirichlet(np.full(len(graph.steps), 0.5), size=len(session))
+                    for name, graph in graphs.items()}
+
+    results = {}
+    for num in num_procedures:
+        names = list(graphs)[:num]
+        trackers = {name: ViterbiTracker(graphs[name], start_step_indices=[0], history_window=1) for name in names}
+        start = time.perf_counter()
+        for name, tracker in trackers.items():
+            try:
+                for _ in tracker.predict(observations[name].T, confusion_matrices[name]):
+                    pass
+            except ValueError:  # the session outlasts every path of the procedure
+                pass
+        separate_seconds = time.perf_counter() - start
+
+        result = {'separate_seconds': separate_seconds}
+        for key, beam in [('stacked', np.inf), ('pruned', None)]:
+            kwargs = {} if beam is None else {'beam': beam}
+            tracker = MultiGraphTracker({name: graphs[name] for name in names},
+                                        {name: confusion_matrices[name] for name in names},
+                                        {name: [0] for name in names}, history_window=1, **kwargs)
+            start = time.perf_counter()
+            for procedure, _, _ in tracker.predict({name: observations[name].T for name in names}):
+                pass
+            result[f'{key}_seconds'] = time.perf_counter() - start
+            result[f'{key}_procedure'] = procedure
+        results[num] = result
+    return {'num_frames': len(session), 'num_procedures': results}
+
+
+def main():
+    print(json.dumps(run(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
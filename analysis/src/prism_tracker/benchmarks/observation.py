@@ -0,0 +1,114 @@
+"""
+Latency benchmark of the observation-model backends.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.observation
+
+A random forest is trained on synthetic frames and scored by every backend, one frame at a time and in batches.
+The run fails if a backend's probabilities are not identical to scikit-learn on any single frame or batch, if the
+compiled backend misses its single-frame budget, or if it is slower than scikit-learn on the small batches of
+streaming.
+"""
+import json
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from ..scripts.classifier import OBSERVATION_BACKENDS, as_observation_model
+
+NUM_FEATURES = 256  # IMU and audio embeddings
+NUM_CLASSES = 20
+NUM_TRAIN_FRAMES = 5000
+BATCH_SIZES = [1, 4, 16, 64, 256, 2048]
+
+# backend -> max seconds to score a single frame
+SINGLE_FRAME_BUDGETS = {
+    'compiled': 0.002,
+}
+# backend -> largest batch size on which it must not be slower than scikit-learn
+FASTER_THAN_SKLEARN_UP_TO = {
+    'compiled': 64,
+}
+
+
+def make_forest(num_frames: int = NUM_TRAIN_FRAMES, num_features: int = NUM_FEATURES,
+                num_classes: int = NUM_CLASSES, seed: int = 0):
+    """
+    Train a default RandomForestClassifier (as train_classifier() does) on separable synthetic frames.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, num_classes, num_frames)
+    X = rng.normal(size=(num_frames, num_features))
+    X[np.arange(num_frames), y] += 2.0
+    return RandomForestClassifier(random_state=seed).fit(X, y)
+
+
+def median_seconds(func: Callable, repeat: int) -> float:
+    func()  # warm up
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return float(np.median(seconds))
+
+
+def run(batch_sizes: List[int] = BATCH_SIZES, seed: int = 0) -> Dict:
+    """
+    Time every backend on single frames and on batches.
+
+    Returns:
+    * result (Dict): per backend, whether its probabilities are identical to scikit-learn, the median seconds of
+      predict_one(), and the median seconds per batch of predict_proba() for each batch size.
+    """
+    forest = make_forest(seed=seed)
+    X = np.random.default_rng(seed + 1).normal(size=(max(batch_sizes), NUM_FEATURES))
+    expected = forest.predict_proba(X)
+
+    results = {}
+    for backend in OBSERVATION_BACKENDS:
+        model = as_observation_model(forest, backend)
+        identical = all(np.array_equal(model.predict_proba(X[:batch_size]), expected[:batch_size])
+                        for batch_size in batch_sizes) and \
+            all(np.array_equal(model.predict_one(X[i]), expected[i]) for i in range(len(X)))
+        results[backend] = {
+            'identical': bool(identical),
+            'single_frame_s': median_seconds(lambda: model.predict_one(X[0]), repeat=50),
+            'batch_s': {batch_size: median_seconds(lambda: model.predict_proba(X[:batch_size]),
+                                                   repeat=max(3, 200 // batch_size))
+                        for batch_size in batch_sizes},
+        }
+    return results
+
+
+def check(results: Dict) -> List[str]:
+    violations = []
+    for backend, result in results.items():
+        if not result['identical']:
+            violations.append(f'{backend}: probabilities differ from scikit-learn')
+        budget = SINGLE_FRAME_BUDGETS.get(backend)
+        if budget is not None and result['single_frame_s'] > budget:
+            violations.append(f'{backend}: a single frame takes {result["single_frame_s"] * 1000:.2f}ms > '
+                              f'{budget * 1000:.2f}ms')
+        largest = FASTER_THAN_SKLEARN_UP_TO.get(backend)
+        if largest is not None and 'sklearn' in results:
+            for batch_size, seconds in result['batch_s'].items():
+                if batch_size <= largest and seconds > results['sklearn']['batch_s'][batch_size]:
+                    violations.append(f'{backend}: a batch of {batch_size} frames is slower than scikit-learn')
+    return violations
+
+
+def main():
+    results = run()
+    violations = check(results)
+    print(json.dumps({'results': results, 'violations': violations}, indent=2))
+    if len(violations) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
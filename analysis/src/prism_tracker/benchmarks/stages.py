@@ -0,0 +1,263 @@
+"""
+Time and peak-memory benchmark of each stage of the pipeline, on synthetic data.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.stages --output before.json
+    $ python -m prism_tracker.benchmarks.stages --compare before.json
+
+Each stage runs in a fresh interpreter on data drawn by benchmarks/generators.py with a fixed seed, in a temporary
+datadrive, so the results of two commits can be compared. The reported time is the median of `repeat` runs, and the
+peak memory is measured with tracemalloc over one more run (allocations of the stage only, excluding its inputs).
+With --compare, the run fails if a stage got slower or bigger than the baseline beyond the tolerance.
+"""
+import argparse
+import json
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import generators
+
+# the size of the inputs of each stage at scale 1
+NUM_TRACKED_STEPS = 12  # the steps of the tracked procedure (sessions of about 2000 frames)
+RECORDING_SECONDS = 120.0
+NUM_PARTICIPANTS = 6
+TOLERANCE = 0.2  # the relative increase over the baseline reported as a regression
+
+
+def setup_viterbi(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from ..tracker.viterbi import ViterbiTracker
+
+    graph = generators.make_graph(rng, NUM_TRACKED_STEPS, mean_range=(60 * scale, 300 * scale))
+    cm = generators.estimate_confusion_matrix(graph, rng)
+    _, observations = generators.make_session(graph, rng)
+    tracker = ViterbiTracker(graph, start_step_indices=[0])
+
+    def run():
+        for _ in tracker.predict(observations.T, cm):
+            pass
+    return run, {'num_frames': len(observations), 'num_steps': NUM_TRACKED_STEPS}
+
+
+def setup_mel_features(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from ..preprocessing import params
+    from ..preprocessing.audio import get_audio_log_mel
+
+    seconds = RECORDING_SECONDS * scale
+    path = generators.make_wav(workdir / 'audio.wav', seconds, rng, sample_rate=params.SAMPLE_RATE)
+    return lambda: get_audio_log_mel(path), {'seconds': seconds}
+
+
+def setup_datadrive(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Dict[str, pathlib.Path]:
+    from .. import config
+
+    paths = generators.make_datadrive(workdir / 'datadrive', rng, participants=['P1'],
+                                      seconds=RECORDING_SECONDS * scale)
+    config.datadrive = paths['datadrive']
+    return paths
+
+
+def setup_preprocess_audio(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from ..preprocessing.annotation import load_clap_times
+    from ..preprocessing.audio import preprocess_audio
+
+    paths = setup_datadrive(workdir, rng, scale)
+    clap_dict = load_clap_times(paths['dataset'])
+    return lambda: preprocess_audio('P1', paths['dataset'], clap_dict), {'seconds': RECORDING_SECONDS * scale}
+
+
+def setup_preprocess_motion(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from ..preprocessing.annotation import load_clap_times
+    from ..preprocessing.motion import preprocess_motion
+
+    paths = setup_datadrive(workdir, rng, scale)
+    clap_dict = load_clap_times(paths['dataset'])
+    return lambda: preprocess_motion('P1', paths['dataset'], clap_dict), {'seconds': RECORDING_SECONDS * scale}
+
+
+def setup_create_feature_pkl(workdir: pathlib.Path, rng: np.random.Generator,
+                             scale: float) -> Tuple[Callable, Dict]:
+    from ..preprocessing import params
+    from ..preprocessing.annotation import load_annotations_dict, load_clap_times, load_classes_dict
+    from ..preprocessing.audio import preprocess_audio
+    from ..preprocessing.feature_extraction import create_feature_pkl
+    from ..preprocessing.motion import preprocess_motion
+
+    paths = setup_datadrive(workdir, rng, scale)
+    dataset_dir = paths['dataset']
+    clap_dict = load_clap_times(dataset_dir)
+    preprocess_audio('P1', dataset_dir, clap_dict)
+    preprocess_motion('P1', dataset_dir, clap_dict)
+    annotations = load_annotations_dict(dataset_dir)
+    class_dict = load_classes_dict(dataset_dir)
+
+    audio_model = generators.ProjectionEncoder((96, params.NUM_MEL_BINS), rng)
+    motion_model = generators.ProjectionEncoder((params.WINDOW_LENGTH_IMU, 3), rng)
+    return (lambda: create_feature_pkl('P1', annotations, dataset_dir, class_dict, audio_model, motion_model),
+            {'seconds': RECORDING_SECONDS * scale})
+
+
+def setup_feature_pkls(workdir: pathlib.Path, rng: np.random.Generator, scale: float):
+    graph = generators.make_graph(rng, num_steps=8, mean_range=(30 * scale, 150 * scale))
+    steps = generators.make_step_names(len(graph.steps))
+    pickle_files = generators.make_feature_pkls(workdir / 'preprocessed', graph, steps, NUM_PARTICIPANTS, rng)
+    return pickle_files, steps
+
+
+def setup_build_graph(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from ..scripts.graph import build_graph
+
+    pickle_files, steps = setup_feature_pkls(workdir, rng, scale)
+    return lambda: build_graph(pickle_files, steps), {'num_participants': len(pickle_files)}
+
+
+def setup_perform_loo(workdir: pathlib.Path, rng: np.random.Generator, scale: float) -> Tuple[Callable, Dict]:
+    from .. import config
+    from ..scripts.evaluation import perform_loo
+    from ..scripts.graph import build_graph
+
+    # without a model_caches directory, every run trains its classifiers
+    config.datadrive = workdir / 'datadrive'
+    pickle_files, steps = setup_feature_pkls(workdir, rng, scale)
+    graph = build_graph(pickle_files, steps)
+    return (lambda: perform_loo(graph, pickle_files, steps, start_step_indices=[1], num_processes=2),
+            {'num_participants': len(pickle_files), 'num_processes': 2})
+
+
+STAGES = {
+    'viterbi': setup_viterbi,
+    'mel_features': setup_mel_features,
+    'preprocess_audio': setup_preprocess_audio,
+    'preprocess_motion': setup_preprocess_motion,
+    'create_feature_pkl': setup_create_feature_pkl,
+    'build_graph': setup_build_graph,
+    'perform_loo': setup_perform_loo,
+}
+
+
+def measure_stage(stage: str, seed: int = 0, scale: float = 1.0, repeat: int = 3) -> Dict:
+    """
+    Set up a stage in this process and measure it.
+
+    Returns:
+    * result (Dict): the stage parameters, the median and minimum seconds, the peak memory allocated by the stage
+      (MB), and the peak RSS of the process and of its child processes (MB).
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        run, stage_params = STAGES[stage](pathlib.Path(workdir), np.random.default_rng(seed), scale)
+
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'params': stage_params,
+        'seconds': float(np.median(seconds)),
+        'min_seconds': float(np.min(seconds)),
+        'peak_mb': peak / 2 ** 20,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'children_max_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run_stage(stage: str, seed: int = 0, scale: float = 1.0, repeat: int = 3) -> Dict:
+    """
+    Measure a stage in a fresh interpreter (see measure_stage()), so that stages do not share caches or memory.
+    """
+    output = subprocess.run([sys.executable, '-m', 'prism_tracker.benchmarks.stages', '--measure', stage,
+                             '--seed', str(seed), '--scale', str(scale), '--repeat', str(repeat)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True, text=True,
+                              cwd=pathlib.Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(stages: Optional[List[str]] = None, seed: int = 0, scale: float = 1.0, repeat: int = 3) -> Dict:
+    """
+    Returns:
+    * report (Dict): the commit, the environment, the settings, and the measurements of each stage.
+    """
+    stages = list(STAGES) if stages is None else stages
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': seed,
+        'scale': scale,
+        'repeat': repeat,
+        'stages': {stage: run_stage(stage, seed, scale, repeat) for stage in stages},
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float = TOLERANCE) -> Dict:
+    """
+    Compare the stages of a report against a baseline report taken with the same seed and scale.
+
+    Returns:
+    * comparison (Dict): per stage, the ratios of the fastest run and of the peak memory over the baseline, and the
+      regressions beyond `tolerance`.
+    """
+    if (report['seed'], report['scale']) != (baseline['seed'], baseline['scale']):
+        raise ValueError('the baseline was measured with another seed or scale')
+
+    comparison = {}
+    for stage, result in report['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        base = baseline['stages'][stage]
+        ratios = {key: result[key] / base[key] if base[key] > 0 else float('nan')
+                  for key in ('min_seconds', 'peak_mb')}
+        comparison[stage] = dict(ratios, regressions=[key for key, ratio in ratios.items() if ratio > 1 + tolerance])
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the size of the synthetic inputs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', type=pathlib.Path, default=None, help='also write the report to this file')
+    parser.add_argument('--compare', type=pathlib.Path, default=None, help='a report of another commit')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--measure', choices=list(STAGES), default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:  # the child process of run_stage()
+        print(json.dumps(measure_stage(args.measure, args.seed, args.scale, args.repeat)))
+        return
+
+    report = run(args.stages, args.seed, args.scale, args.repeat)
+    if args.compare is not None:
+        report['comparison'] = compare(report, json.loads(args.compare.read_text()), args.tolerance)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+
+    if any(len(result['regressions']) > 0 for result in report.get('comparison', {}).values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
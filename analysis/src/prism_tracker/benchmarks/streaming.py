@@ -0,0 +1,142 @@
+"""
+Check that the streaming feature extractor reproduces the offline preprocessing of a recorded session.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.streaming
+    $ python -m prism_tracker.benchmarks.streaming --audio path/to/preprocessed.wav --motion path/to/preprocessed.npy
+
+A synthetic session (benchmarks/generators.py) or a preprocessed recording is pushed to StreamingFeatureExtractor in
+random interleaved chunks of audio and IMU, for several seeds. The frames emitted must be those of
+wavfile_to_examples(), get_motion_examples() and align_examples() on the whole recording: the same frame indices,
+relative times and IMU windows exactly, and log-mel examples within LOG_MEL_TOLERANCE. The run fails if not.
+"""
+import argparse
+import json
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from ..preprocessing import params
+from ..preprocessing.audio import get_audio_examples
+from ..preprocessing.feature_extraction import align_examples, normalize_motion
+from ..preprocessing.motion import get_motion_examples
+from ..preprocessing.streaming import IMU_SAMPLE_RATE, StreamingFeatureExtractor
+from . import generators
+
+RECORDING_SECONDS = 60.0
+NUM_SEEDS = 5
+MAX_CHUNK_SECONDS = 0.5
+LOG_MEL_TOLERANCE = 1e-9
+
+
+def make_norm_params(rng: np.random.Generator) -> Dict:
+    """
+    Motion normalization parameters in the format of get_normalization_params().
+    """
+    return {'max': rng.uniform(1, 2, 3), 'min': rng.uniform(-2, -1, 3), 'mean': rng.normal(size=3) * 0.1,
+            'std': rng.uniform(0.5, 1.5, 3)}
+
+
+def stream(extractor: StreamingFeatureExtractor, audio: np.ndarray, motion: np.ndarray,
+           rng: np.random.Generator) -> list:
+    """
+    Push the recording in chunks of random sizes, usually to the stream that is behind in time, sometimes to the
+    other one, as a phone sending both sensors would.
+    """
+    frames = []
+    audio_position, motion_position = 0, 0
+    while audio_position < len(audio) or motion_position < len(motion):
+        audio_behind = audio_position / params.SAMPLE_RATE <= motion_position / IMU_SAMPLE_RATE
+        push_audio = motion_position >= len(motion) or \
+            (audio_position < len(audio) and audio_behind == (rng.random() < 0.8))
+        seconds = rng.uniform(0, MAX_CHUNK_SECONDS)
+        if push_audio:
+            size = max(int(seconds * params.SAMPLE_RATE), 1)
+            frames += extractor.push_audio(audio[audio_position:audio_position + size])
+            audio_position += size
+        else:
+            size = max(int(seconds * IMU_SAMPLE_RATE), 1)
+            frames += extractor.push_motion(motion[motion_position:motion_position + size])
+            motion_position += size
+    return frames
+
+
+def run(audio_path: Optional[pathlib.Path] = None, motion_path: Optional[pathlib.Path] = None,
+        num_seeds: int = NUM_SEEDS, seed: int = 0) -> Dict:
+    """
+    Returns:
+    * result (Dict): the number of frames, the largest log-mel difference, the seconds of both paths and the
+      violations.
+    """
+    from scipy.io import wavfile
+
+    rng = np.random.default_rng(seed)
+    norm_params = make_norm_params(rng)
+    with tempfile.TemporaryDirectory() as workdir:
+        if audio_path is None:
+            audio_path = generators.make_wav(pathlib.Path(workdir) / 'audio.wav', RECORDING_SECONDS, rng,
+                                             sample_rate=params.SAMPLE_RATE)
+        if motion_path is None:
+            num_samples = int(RECORDING_SECONDS * IMU_SAMPLE_RATE)
+            motion_arr = np.column_stack([np.arange(num_samples) * 1000 / IMU_SAMPLE_RATE,
+                                          rng.normal(size=(num_samples, 3))])
+        else:
+            motion_arr = np.load(motion_path)
+
+        start = time.perf_counter()
+        audio_examples = get_audio_examples(audio_path)
+        imu_examples = get_motion_examples(normalize_motion(motion_arr[:, 1:], norm_params))
+        audio_indices, imu_indices, relative_times, _ = align_examples(
+            len(audio_examples), len(imu_examples), motion_arr[:, 0])
+        offline_seconds = time.perf_counter() - start
+        _, audio = wavfile.read(audio_path)
+
+    violations, max_difference, streaming_seconds = [], 0.0, []
+    for trial in range(num_seeds):
+        extractor = StreamingFeatureExtractor(norm_params)
+        start = time.perf_counter()
+        frames = stream(extractor, audio, motion_arr[:, 1:], np.random.default_rng([seed, trial]))
+        streaming_seconds.append(time.perf_counter() - start)
+
+        if extractor.num_dropped_frames > 0:
+            violations.append(f'seed {trial}: {extractor.num_dropped_frames} frames were dropped')
+        if [frame.index for frame in frames] != audio_indices.tolist():
+            violations.append(f'seed {trial}: {len(frames)} frames instead of {len(audio_indices)}, or other indices')
+            continue
+        if [frame.relative_time for frame in frames] != relative_times:
+            violations.append(f'seed {trial}: the relative times differ')
+        if not np.array_equal(np.stack([frame.imu for frame in frames]), imu_examples[imu_indices]):
+            violations.append(f'seed {trial}: the IMU windows differ')
+        difference = float(np.abs(np.stack([frame.audio for frame in frames]) - audio_examples[audio_indices]).max())
+        max_difference = max(max_difference, difference)
+        if difference > LOG_MEL_TOLERANCE:
+            violations.append(f'seed {trial}: the log-mel examples differ by {difference}')
+
+    return {
+        'num_frames': len(audio_indices),
+        'max_log_mel_difference': max_difference,
+        'offline_seconds': offline_seconds,
+        'streaming_seconds': float(np.median(streaming_seconds)),
+        'violations': violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', type=pathlib.Path, help='a preprocessed 16kHz recording; synthetic if not given')
+    parser.add_argument('--motion', type=pathlib.Path, help='the preprocessed motion (.npy) of the same session')
+    parser.add_argument('--seeds', type=int, default=NUM_SEEDS)
+    args = parser.parse_args()
+
+    result = run(args.audio, args.motion, args.seeds)
+    print(json.dumps(result, indent=2))
+    if len(result['violations']) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
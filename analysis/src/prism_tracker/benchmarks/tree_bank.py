@@ -0,0 +1,89 @@
+"""
+Classifier quality and training time of the leave-one-out folds, trained per fold or assembled from a tree bank.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.tree_bank
+
+Synthetic participants are drawn from benchmarks/generators.py. For every cohort size, each participant is held out in
+turn, and its classifier is either trained on the other participants (as perform_loo() does by default) or assembled
+from the groups of trees trained once per participant (see TreeBank). The report gives the total time to build the
+classifiers of all folds, and the mean frame accuracy and log loss on the held-out participants. Everything runs in
+one process, so the times compare the training work and not the parallelism.
+"""
+import json
+import pathlib
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from .. import config
+from ..scripts.classifier import TREES_PER_GROUP, TreeBank, train_classifier
+from ..scripts.evaluation import load_imu_and_audio_data, train_tree_group
+from .generators import make_feature_pkls, make_graph, make_step_names
+
+NUM_PARTICIPANTS = [4, 8, 16]
+
+
+def score(clf, X: np.ndarray, y: List[int]) -> Dict:
+    probabilities = clf.predict_proba(X)
+    true_probabilities = np.clip(probabilities[np.arange(len(y)), y], 1e-12, None)
+    return {'accuracy': float(np.mean(probabilities.argmax(axis=1) == y)),
+            'log_loss': float(-np.mean(np.log(true_probabilities)))}
+
+
+def run(num_participants: List[int] = NUM_PARTICIPANTS, trees_per_group: int = TREES_PER_GROUP,
+        seed: int = 0) -> Dict:
+    """
+    Returns:
+    * result (Dict): per cohort size, the seconds to build the classifiers of all folds and their mean scores, for
+      per-fold training and for the tree bank.
+    """
+    rng = np.random.default_rng(seed)
+    graph = make_graph(rng, num_steps=8, mean_range=(30, 150))
+    steps = make_step_names(len(graph.steps))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        config.datadrive = pathlib.Path(workdir)  # without a model_caches directory, nothing is cached
+        for num in num_participants:
+            pickle_files = make_feature_pkls(pathlib.Path(workdir) / str(num), graph, steps, num, rng)
+            test_data = [load_imu_and_audio_data([pickle_file], steps) for pickle_file in pickle_files]
+
+            start = time.perf_counter()
+            bank = TreeBank({str(pickle_file): train_tree_group(pickle_file, steps, trees_per_group)
+                             for pickle_file in pickle_files})
+            bank_seconds = time.perf_counter() - start
+
+            fold_seconds, fold_scores, bank_scores = 0.0, [], []
+            for i, (X_test, y_test) in enumerate(test_data):
+                train_files = pickle_files[:i] + pickle_files[i + 1:]
+
+                start = time.perf_counter()
+                X_train, y_train = load_imu_and_audio_data(train_files, steps)
+                clf = train_classifier(X_train, y_train, num_classes=len(steps), random_state=seed)
+                fold_seconds += time.perf_counter() - start
+                fold_scores.append(score(clf, X_test, y_test))
+
+                start = time.perf_counter()
+                clf = bank.assemble(list(map(str, train_files)))
+                bank_seconds += time.perf_counter() - start
+                bank_scores.append(score(clf, X_test, y_test))
+
+            results[num] = {
+                'per_fold': dict({key: float(np.mean([s[key] for s in fold_scores])) for key in fold_scores[0]},
+                                 seconds=fold_seconds),
+                'tree_bank': dict({key: float(np.mean([s[key] for s in bank_scores])) for key in bank_scores[0]},
+                                  seconds=bank_seconds, num_trees=trees_per_group * (num - 1)),
+                'speedup': fold_seconds / bank_seconds,
+            }
+    return {'trees_per_group': trees_per_group, 'num_participants': results}
+
+
+def main():
+    print(json.dumps(run(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+End-to-end check of the work queue on one machine, with no other services.
+
+Usage:
+    $ python -m prism_tracker.benchmarks.workqueue
+
+The folds of perform_loo() on synthetic participants are submitted to a queue in a temporary directory, and run by
+worker processes started as on other nodes (`python -m prism_tracker.scripts.workqueue`). The first worker is killed
+while it runs a fold, so its lease expires and the fold is claimed again by the workers started afterwards. The
+report checks that the predictions are those of the multiprocessing.Pool run, that the killed fold was claimed twice,
+that the fold function (with the graph and the tree bank) was stored once rather than in every task, and that
+submitting the folds again returns the stored results without running anything. The run fails if not.
+"""
+import json
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+
+from .. import config
+from ..scripts import workqueue
+from ..scripts.evaluation import perform_loo
+from ..scripts.graph import build_graph
+from .generators import make_feature_pkls, make_graph, make_step_names
+
+LEASE_SECONDS = 2.0
+NUM_PARTICIPANTS = 6
+
+
+def start_worker(queue_path: pathlib.Path, datadrive: pathlib.Path, processes: int = 1) -> subprocess.Popen:
+    env = dict(os.environ, PRISM_DATADRIVE=str(datadrive),
+               PYTHONPATH=os.pathsep.join([str(pathlib.Path(__file__).parents[2])] + sys.path))
+    return subprocess.Popen([sys.executable, '-m', 'prism_tracker.scripts.workqueue', str(queue_path),
+                             '--processes', str(processes), '--lease', str(LEASE_SECONDS)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def wait_for_status(queue: workqueue.WorkQueue, submitter: threading.Thread, status: str):
+    while queue.status().get(status, 0) == 0:
+        if not submitter.is_alive():
+            raise RuntimeError(f'perform_loo() stopped before any fold was {status}')
+        time.sleep(0.05)
+
+
+def run(num_participants: int = NUM_PARTICIPANTS, seed: int = 0) -> Dict:
+    """
+    Returns:
+    * result (Dict): the seconds of the Pool and queue runs, the claims of each fold, and the violations.
+    """
+    rng = np.random.default_rng(seed)
+    graph = make_graph(rng, num_steps=8, mean_range=(10, 50))
+    steps = make_step_names(len(graph.steps))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = pathlib.Path(workdir)
+        config.datadrive = workdir  # without a model_caches directory, nothing is cached
+        pickle_files = make_feature_pkls(workdir / 'preprocessed', graph, steps, num_participants, rng)
+        graph = build_graph(pickle_files, steps)
+        # the tree bank is seeded, so every run gives the same predictions
+        kwargs = dict(start_step_indices=[1], trees_per_participant=10)
+
+        start = time.perf_counter()
+        expected = perform_loo(graph, pickle_files, steps, num_processes=2, **kwargs)
+        pool_seconds = time.perf_counter() - start
+
+        # the submitter runs no local worker, so every fold goes through the worker processes
+        queue_path = workdir / 'queue.sqlite'
+        queue = workqueue.WorkQueue(queue_path, lease_seconds=LEASE_SECONDS)
+        outputs = {}
+        submitter = threading.Thread(target=lambda: outputs.update(
+            result=perform_loo(graph, pickle_files, steps, num_processes=0, queue_path=queue_path, **kwargs)))
+        start = time.perf_counter()
+        submitter.start()
+
+        # a worker leaves as soon as the queue is finished, so it starts once the folds are submitted
+        wait_for_status(queue, submitter, 'pending')
+        doomed = start_worker(queue_path, workdir)
+        wait_for_status(queue, submitter, 'running')
+        os.killpg(doomed.pid, signal.SIGKILL)  # the worker processes of the node die with it
+        doomed.wait()
+        workers = [start_worker(queue_path, workdir, processes=2)]
+        submitter.join()
+        queue_seconds = time.perf_counter() - start
+        for worker in workers:
+            worker.wait()
+
+        with queue.__transaction__() as connection:
+            attempts = sorted(count for count, in connection.execute('SELECT attempts FROM tasks'))
+            payload_bytes = connection.execute('SELECT MAX(LENGTH(payload)) FROM tasks').fetchone()[0]
+        blob_bytes = [path.stat().st_size for path in queue.blobs_dir.iterdir()]
+
+        # submitting the same folds again only collects their results
+        start = time.perf_counter()
+        again = perform_loo(graph, pickle_files, steps, num_processes=0, queue_path=queue_path, **kwargs)
+        resubmit_seconds = time.perf_counter() - start
+        with queue.__transaction__() as connection:
+            attempts_again = sorted(count for count, in connection.execute('SELECT attempts FROM tasks'))
+
+        violations = []
+        if outputs.get('result') != expected:
+            violations.append('the queue predictions differ from the Pool predictions')
+        if attempts.count(2) != 1 or any(count not in (1, 2) for count in attempts):
+            violations.append(f'the killed fold was not claimed exactly twice: {attempts}')
+        if len(blob_bytes) != 1 or payload_bytes >= blob_bytes[0]:
+            violations.append(f'the fold function was not stored once: {len(blob_bytes)} blobs, tasks of up to '
+                              f'{payload_bytes} bytes')
+        if again != expected or attempts_again != attempts:
+            violations.append('submitting the folds again ran them again')
+        status = queue.status()
+
+    return {
+        'num_folds': len(attempts),
+        'pool_seconds': pool_seconds,
+        'queue_seconds': queue_seconds,
+        'resubmit_seconds': resubmit_seconds,
+        'attempts': attempts,
+        'task_payload_bytes': payload_bytes,
+        'blob_bytes': blob_bytes,
+        'status': status,
+        'violations': violations,
+    }
+
+
+def main():
+    result = run()
+    print(json.dumps(result, indent=2))
+    if len(result['violations']) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
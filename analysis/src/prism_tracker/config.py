@@ -1,4 +1,7 @@
+import os
 from pathlib import Path
 
-datadrive = Path(
-    "/Users/arakawariku/Dropbox/Research/SmashLab/Cleveland/PrISM-Tracker/github/analysis/datadrive")
+# the PRISM_DATADRIVE environment variable overrides the default location, e.g., for a synthetic datadrive
+datadrive = Path(os.environ.get(
+    'PRISM_DATADRIVE',
+    "/Users/arakawariku/Dropbox/Research/SmashLab/Cleveland/PrISM-Tracker/github/analysis/datadrive"))
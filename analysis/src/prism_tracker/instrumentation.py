@@ -0,0 +1,229 @@
+"""
+Lightweight instrumentation of the hot paths: named timers, counters and histograms.
+
+Usage:
+    >>> from prism_tracker import instrumentation
+    >>> with instrumentation.recording() as recorder:
+    ...     perform_loo(...)
+    >>> recorder.dump('profile.json')
+
+or set the PRISM_INSTRUMENTATION environment variable to a path, where the summary of the whole run is written at
+exit.
+
+Instrumentation is disabled by default, and then costs one global lookup per call site: timer() returns a shared
+no-op context manager, and count()/observe() return immediately. Hot loops check `recorder is not None` themselves.
+The recorder of a process is not shared with the worker processes of multiprocessing; perform_loo() records each fold
+in its worker and attaches the summaries to the recorder of the parent (see Recorder.add_fold()).
+"""
+import atexit
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+LATENCY_EDGES = [10.0 ** (exponent / 4) for exponent in range(-28, 9)]  # 1us to 100s, 4 bins per decade
+COUNT_EDGES = [0] + [2 ** exponent for exponent in range(17)]  # 0, 1, 2, 4, ..., 65536
+
+
+class Histogram:
+    def __init__(self, edges: Sequence[float] = LATENCY_EDGES):
+        """
+        A histogram with fixed bins: bins[i] counts the values in [edges[i - 1], edges[i]), bins[0] the values below
+        edges[0] and bins[-1] the values from edges[-1].
+        """
+        self.edges = list(edges)
+        self.bins = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value: float):
+        self.bins[bisect.bisect_right(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'Histogram'):
+        if other.edges != self.edges:
+            raise ValueError('cannot merge histograms with different bins')
+        self.bins = [a + b for a, b in zip(self.bins, other.bins)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """
+        The upper edge of the bin holding the q-quantile (the maximum for the last bin).
+        """
+        if self.count == 0:
+            return float('nan')
+        index = int(np.searchsorted(np.cumsum(self.bins), q * self.count, side='left'))
+        return min(self.edges[index], self.max) if index < len(self.edges) else self.max
+
+    def summary(self) -> Dict:
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count, 'total': self.total, 'mean': self.total / self.count, 'min': self.min,
+            'max': self.max, 'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+            'edges': self.edges, 'bins': self.bins,
+        }
+
+    @classmethod
+    def from_summary(cls, summary: Dict) -> 'Histogram':
+        histogram = cls(summary.get('edges', LATENCY_EDGES))
+        if summary['count'] > 0:
+            histogram.bins = list(summary['bins'])
+            histogram.count, histogram.total = summary['count'], summary['total']
+            histogram.min, histogram.max = summary['min'], summary['max']
+        return histogram
+
+
+class Recorder:
+    def __init__(self):
+        """
+        Collects the timers (total seconds and call counts), the counters and the histograms of a run.
+        """
+        self.timers: Dict[str, List[float]] = {}  # name -> [calls, total seconds, max seconds]
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.folds: List[Dict] = []
+        self.lock = threading.Lock()
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, edges: Sequence[float] = LATENCY_EDGES):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(edges)
+            self.histograms[name].add(value)
+
+    def merge(self, summary: Dict):
+        """
+        Add the summary of another recorder (e.g., of a worker process) to this one.
+        """
+        with self.lock:
+            for name, timer in summary['timers'].items():
+                own = self.timers.setdefault(name, [0, 0.0, 0.0])
+                own[0] += timer['calls']
+                own[1] += timer['seconds']
+                own[2] = max(own[2], timer['max_seconds'])
+            for name, value in summary['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram_summary in summary['histograms'].items():
+                histogram = Histogram.from_summary(histogram_summary)
+                if name in self.histograms:
+                    self.histograms[name].merge(histogram)
+                else:
+                    self.histograms[name] = histogram
+
+    def add_fold(self, fold: Dict, summary: Dict):
+        """
+        Keep the summary of a fold (e.g., of perform_loo()) with its description, and add it to the totals.
+        """
+        self.merge(summary)
+        with self.lock:
+            self.folds.append(dict(fold, summary=summary))
+
+    def summary(self) -> Dict:
+        with self.lock:
+            summary = {
+                'timers': {name: {'calls': int(calls), 'seconds': seconds, 'max_seconds': max_seconds}
+                           for name, (calls, seconds, max_seconds) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            }
+            if len(self.folds) > 0:
+                summary['folds'] = list(self.folds)
+        return summary
+
+    def dump(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.summary(), fp, indent=2)
+
+
+class _Timer:
+    def __init__(self, recorder: Recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+# the recorder of this process, or None when instrumentation is disabled
+recorder: Optional[Recorder] = None
+
+
+def enable(new_recorder: Optional[Recorder] = None) -> Recorder:
+    global recorder
+    recorder = Recorder() if new_recorder is None else new_recorder
+    return recorder
+
+
+def disable() -> Optional[Recorder]:
+    """
+    Stop recording, and return the recorder that was active.
+    """
+    global recorder
+    previous, recorder = recorder, None
+    return previous
+
+
+@contextlib.contextmanager
+def recording(new_recorder: Optional[Recorder] = None) -> Iterator[Recorder]:
+    """
+    Record within a block, then restore the previous recorder (or disabled instrumentation).
+    """
+    global recorder
+    previous = recorder
+    try:
+        yield enable(new_recorder)
+    finally:
+        recorder = previous
+
+
+def timer(name: str):
+    """
+    A context manager that adds the time spent in the block to the timer `name`.
+    """
+    return _NULL_TIMER if recorder is None else _Timer(recorder, name)
+
+
+def count(name: str, value: float = 1):
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def observe(name: str, value: float, edges: Sequence[float] = LATENCY_EDGES):
+    if recorder is not None:
+        recorder.observe(name, value, edges)
+
+
+if os.environ.get('PRISM_INSTRUMENTATION'):
+    atexit.register(enable().dump, os.environ['PRISM_INSTRUMENTATION'])
@@ -1,22 +1,20 @@
-import pandas as pd
+from .segments import Segments
 
 
 def load_annotations_dict(original_dir):
     """
     Load annotations for the task
     """
+    import pandas as pd
+
     df = pd.read_csv(original_dir / 'annotation.csv')
 
     # fill NaNs with last seen values -> results in the participant id being
     # filled
     df.ffill(inplace=True)
 
-    userdfs = {}
-    for user in df['Participant'].unique():
-        userdf = df.loc[df['Participant'] == user]
-        userdf.reset_index(drop=True)
-        userdfs[user] = userdf
-    return userdfs
+    # split the rows by participant in a single pass (see also catalog.py, which caches the result)
+    return {user: userdf for user, userdf in df.groupby('Participant', sort=False)}
 
 
 def load_classes_dict(original_dir):
@@ -84,11 +82,25 @@ def get_times_and_labels(df, half=False):
     return (times, tasks)
 
 
+def lookup_times_and_labels(annotations, pid, half=False):
+    """
+    Get the times and labels of a participant from a Catalog (see catalog.py), or from the dict of
+    load_annotations_dict().
+    """
+    if hasattr(annotations, 'times_and_labels'):
+        return annotations.times_and_labels(pid, half)
+    return get_times_and_labels(annotations[pid], half)
+
+
 def overwrite_other_labels(labels):
     """
     Overwrite 'Other' labels by their previous label.
     Make sure to remove 'Other' in the beginning and ending before applying this function.
+    Segments are relabeled segment by segment.
     """
+    if isinstance(labels, Segments):
+        return labels.absorb('Other')
+
     output = []
     assert labels[0] != 'Other'
     prev = labels[0]
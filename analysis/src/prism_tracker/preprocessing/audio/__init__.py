@@ -1 +1 @@
-from .utils import get_audio_examples, preprocess_audio
+from .utils import get_audio_examples, get_audio_examples_from_log_mel, get_audio_log_mel, preprocess_audio
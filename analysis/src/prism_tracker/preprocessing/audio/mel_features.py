@@ -3,6 +3,8 @@
 
 import numpy as np
 
+from ... import instrumentation
+
 
 # time series vector
 def frame(data, window_length, hop_length):
@@ -89,13 +91,15 @@ def log_mel_spectrogram(data,
     fft_length = 2 ** int(np.ceil(np.log(window_length_samples) / np.log(2.0)))
     # print(window_length_samples, audio_sample_rate * window_length_secs)
 
-    spectrogram = stft_magnitude(
-        data,
-        fft_length=fft_length,
-        hop_length=hop_length_samples,
-        window_length=window_length_samples)
-
-    mel_spectrogram = np.dot(spectrogram, spectrogram_to_mel_matrix(
-        num_spectrogram_bins=spectrogram.shape[1],
-        audio_sample_rate=audio_sample_rate, **kwargs))
+    with instrumentation.timer('preprocessing.stft'):
+        spectrogram = stft_magnitude(
+            data,
+            fft_length=fft_length,
+            hop_length=hop_length_samples,
+            window_length=window_length_samples)
+
+    with instrumentation.timer('preprocessing.mel'):
+        mel_spectrogram = np.dot(spectrogram, spectrogram_to_mel_matrix(
+            num_spectrogram_bins=spectrogram.shape[1],
+            audio_sample_rate=audio_sample_rate, **kwargs))
     return np.log(mel_spectrogram + log_offset)
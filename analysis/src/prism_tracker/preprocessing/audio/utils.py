@@ -1,8 +1,6 @@
-import librosa
-import soundfile
-
+from ... import instrumentation
 from .. import params
-from .vggish_input import wavfile_to_examples
+from .vggish_input import log_mel_to_examples, wavfile_to_examples, wavfile_to_log_mel
 
 
 def get_audio_examples(audio_file_path):
@@ -15,17 +13,38 @@ def get_audio_examples(audio_file_path):
         audio_file_path, lower_edge_hertz=leh, upper_edge_hertz=ueh)
 
 
+def get_audio_log_mel(audio_file_path):
+    """
+    Get the log-mel spectrogram frames that get_audio_examples() windows into examples.
+    """
+    leh = 10
+    ueh = params.SAMPLE_RATE // 2
+    return wavfile_to_log_mel(
+        audio_file_path, lower_edge_hertz=leh, upper_edge_hertz=ueh)
+
+
+def get_audio_examples_from_log_mel(log_mel):
+    """
+    Window log-mel spectrogram frames into audio examples.
+    """
+    return log_mel_to_examples(log_mel)
+
+
 def preprocess_audio(participant_name, original_dir, clap_dict):
     """
     Resample the audio to 16kHz and remove data before clap.
     """
+    import librosa
+    import soundfile
+
     raw_fp = original_dir / 'audio' / 'raw' / f'{participant_name}.wav'
     save_fp = original_dir / 'audio' / 'preprocessed' / f'{participant_name}.wav'
     save_fp.parent.mkdir(exist_ok=True, parents=True)
 
     # load with librosa in order to downsample to params.SAMPLE_RATE (=16000
     # by default)
-    fdata, _ = librosa.load(raw_fp, sr=params.SAMPLE_RATE)
+    with instrumentation.timer('preprocessing.resample_audio'):
+        fdata, _ = librosa.load(raw_fp, sr=params.SAMPLE_RATE)
 
     # use the clap dict to find the clap index
     # clap dict is in ms, so first /1000 to convert to secs
@@ -2,14 +2,15 @@
 # https://github.com/tensorflow/models/tree/master/research/audioset
 
 import numpy as np
-from scipy.io import wavfile
 
 from .. import params
 from . import mel_features
 
 
-def wavfile_to_examples(
+def wavfile_to_log_mel(
         wav_file, lower_edge_hertz=params.MEL_MIN_HZ, upper_edge_hertz=params.MEL_MAX_HZ):
+    from scipy.io import wavfile
+
     sr, wav_data = wavfile.read(wav_file)
     assert wav_data.dtype == np.int16, 'Bad sample type: %r' % wav_data.dtype
 
@@ -32,6 +33,10 @@ def wavfile_to_examples(
                                                upper_edge_hertz=upper_edge_hertz)
     # (16552, 64)   16552 timestamps* 30ms /60/1000 = 8.276 minutes
     # print("log mel shape", log_mel.shape)
+    return log_mel
+
+
+def log_mel_to_examples(log_mel):
     # Frame features into examples.
     features_sample_rate = 1.0 / params.STFT_HOP_LENGTH_SECONDS
     example_window_length = int(round(params.EXAMPLE_WINDOW_SECONDS * features_sample_rate))  # 96
@@ -43,3 +48,9 @@ def wavfile_to_examples(
     #print(len(data), len(log_mel), len(log_mel_examples))
     #print(len(data) / 16000, params.STFT_WINDOW_LENGTH_SECONDS + len(log_mel) * params.STFT_HOP_LENGTH_SECONDS, params.EXAMPLE_WINDOW_SECONDS + len(log_mel_examples) * params.EXAMPLE_HOP_SECONDS)
     return log_mel_examples
+
+
+def wavfile_to_examples(
+        wav_file, lower_edge_hertz=params.MEL_MIN_HZ, upper_edge_hertz=params.MEL_MAX_HZ):
+    log_mel = wavfile_to_log_mel(wav_file, lower_edge_hertz=lower_edge_hertz, upper_edge_hertz=upper_edge_hertz)
+    return log_mel_to_examples(log_mel)
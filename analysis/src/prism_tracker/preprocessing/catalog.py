@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .annotation import load_clap_times, load_classes_dict
+from .manifest import PathLike
+
+CATALOG_VERSION = 1
+SOURCES = ['annotation.csv', 'clap_times.csv', 'classes.txt']
+# the raw recordings listed in the catalog: name -> (directory in the dataset, suffix)
+RECORDINGS = {
+    'raw_audio': ('audio/raw', '.wav'),
+    'raw_motion': ('motion/raw', '.txt'),
+}
+
+
+def file_fingerprint(path: pathlib.Path, previous: Optional[list] = None) -> Optional[list]:
+    """
+    Return [size, mtime_ns, sha1] of a file, or None if it does not exist. The content is only hashed again if the
+    size or the mtime differ from `previous`.
+    """
+    if not path.exists():
+        return None
+    stat = path.stat()
+    if previous is not None and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return previous
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha1.update(chunk)
+    return [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+
+
+def content_hashes(sources: Dict[str, Optional[list]]) -> Dict[str, Optional[str]]:
+    return {name: None if fingerprint is None else fingerprint[2] for name, fingerprint in sources.items()}
+
+
+def list_recordings(dataset_dir: pathlib.Path) -> Dict[str, List[str]]:
+    """
+    The participants with a file in each recording directory (see RECORDINGS).
+    """
+    recordings = {}
+    for name, (directory, suffix) in RECORDINGS.items():
+        directory = dataset_dir / directory
+        recordings[name] = sorted(entry.name[:-len(suffix)] for entry in os.scandir(directory)
+                                  if entry.is_file() and entry.name.endswith(suffix)) if directory.exists() else []
+    return recordings
+
+
+class Catalog:
+    def __init__(self, dataset_dir: PathLike, participants: List[str], offsets: np.ndarray, timestamps: np.ndarray,
+                 tasks: np.ndarray, clap_times: Dict[str, str], classes: Dict[str, str],
+                 recordings: Dict[str, List[str]], sources: Dict[str, Optional[list]]):
+        """
+        The annotations, clap times, classes and recordings of a task dataset, indexed by participant.
+        The annotation rows of the participant `participants[i]` are timestamps[offsets[i]:offsets[i + 1]] and
+        tasks[offsets[i]:offsets[i + 1]], as in annotation.csv (forward-filled). Use Catalog.open() to build one.
+
+        Args:
+        * dataset_dir (PathLike): the dataset directory with annotation.csv, clap_times.csv and classes.txt.
+        * clap_times (Dict[str, str]): the clap time (ms) of each participant, as in load_clap_times().
+        * classes (Dict[str, str]): the class of each task label, as in load_classes_dict().
+        * recordings (Dict[str, List[str]]): the participants with a file in each recording directory.
+        * sources (Dict[str, Optional[list]]): the fingerprint of each source file (see file_fingerprint()).
+        """
+        self.dataset_dir = pathlib.Path(dataset_dir)
+        self.participants = list(participants)
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.tasks = tasks
+        self.clap_times = clap_times
+        self.classes = classes
+        self.recordings = recordings
+        self.sources = sources
+        self.index = {pid: i for i, pid in enumerate(self.participants)}
+        self.recording_sets = {name: set(pids) for name, pids in recordings.items()}
+
+    @classmethod
+    def build(cls, dataset_dir: PathLike) -> 'Catalog':
+        """
+        Parse the sources of the dataset: annotation.csv is split by participant in a single pass.
+        """
+        import pandas as pd
+
+        dataset_dir = pathlib.Path(dataset_dir)
+        sources = {name: file_fingerprint(dataset_dir / name) for name in SOURCES}
+
+        df = pd.read_csv(dataset_dir / 'annotation.csv')
+        df.ffill(inplace=True)  # the participant id is only given on its first row
+        df = df[df['Participant'].notna()]
+        participants, timestamps, tasks, offsets = [], [], [], [0]
+        for pid, rows in df.groupby('Participant', sort=False):
+            participants.append(str(pid))
+            timestamps.append(rows['Timestamp'].to_numpy(dtype=np.float64))
+            tasks.append(rows['Task'].astype(str).to_numpy(dtype=str))
+            offsets.append(offsets[-1] + len(rows))
+
+        return cls(dataset_dir, participants, np.array(offsets, dtype=np.int64),
+                   np.concatenate(timestamps) if len(timestamps) > 0 else np.zeros(0),
+                   np.concatenate(tasks) if len(tasks) > 0 else np.zeros(0, dtype=str),
+                   load_clap_times(dataset_dir), load_classes_dict(dataset_dir), list_recordings(dataset_dir), sources)
+
+    @classmethod
+    def open(cls, dataset_dir: PathLike, cache_path: Optional[PathLike] = None) -> 'Catalog':
+        """
+        Load the catalog from its cache, or build it and save the cache if a source changed since.
+        A source changed if its content hash differs; it is only hashed again when its size or mtime changed.
+
+        Args:
+        * dataset_dir (PathLike): the dataset directory.
+        * cache_path (Optional[PathLike]): the cache file; defaults to cache/catalog.npz next to the dataset.
+        """
+        dataset_dir = pathlib.Path(dataset_dir)
+        cache_path = dataset_dir.parent / 'cache' / 'catalog.npz' if cache_path is None else pathlib.Path(cache_path)
+
+        catalog = cls.load(dataset_dir, cache_path) if cache_path.exists() else None
+        if catalog is not None and catalog.recordings == list_recordings(dataset_dir):
+            sources = {name: file_fingerprint(dataset_dir / name, catalog.sources.get(name)) for name in SOURCES}
+            if sources == catalog.sources:
+                return catalog
+            if content_hashes(sources) == content_hashes(catalog.sources):  # touched, but with the same content
+                catalog.sources = sources
+                catalog.save(cache_path)
+                return catalog
+
+        catalog = cls.build(dataset_dir)
+        catalog.save(cache_path)
+        return catalog
+
+    @classmethod
+    def load(cls, dataset_dir: PathLike, cache_path: PathLike) -> Optional['Catalog']:
+        """
+        Load a saved catalog, or return None if it was saved by another version.
+        """
+        with np.load(cache_path, allow_pickle=False) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata.get('version') != CATALOG_VERSION:
+                return None
+            return cls(dataset_dir, data['participants'].tolist(), data['offsets'], data['timestamps'], data['tasks'],
+                       metadata['clap_times'], metadata['classes'], metadata['recordings'], metadata['sources'])
+
+    def save(self, cache_path: PathLike):
+        cache_path = pathlib.Path(cache_path)
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        metadata = {'version': CATALOG_VERSION, 'clap_times': self.clap_times, 'classes': self.classes,
+                    'recordings': self.recordings, 'sources': self.sources}
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, participants=np.array(self.participants, dtype=str), offsets=self.offsets,
+                     timestamps=self.timestamps, tasks=self.tasks, metadata=np.array(json.dumps(metadata)))
+        os.replace(tmp_path, cache_path)
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self.index
+
+    def annotation(self, pid: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+        * timestamps (np.ndarray): the Timestamp column of the annotation rows of the participant.
+        * tasks (np.ndarray): the Task column of the same rows.
+        """
+        i = self.index[pid]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.timestamps[start:end], self.tasks[start:end]
+
+    def times_and_labels(self, pid: str, half: bool = False) -> Tuple[List[float], List[str]]:
+        """
+        The times relative to the clap and the labels of the participant, as get_times_and_labels() gives for its
+        annotation rows.
+        """
+        timestamps, tasks = self.annotation(pid)
+        times = timestamps[1:] - timestamps[1]  # row 0 is the header, and row 1 the clap
+        if half:
+            times = times / 2  # watched video on half speed
+        return times.tolist(), tasks[1:].tolist()
+
+    def has_recording(self, pid: str, name: str = 'raw_audio') -> bool:
+        return pid in self.recording_sets[name]
+
+    def path(self, pid: str, name: str = 'raw_audio') -> pathlib.Path:
+        """
+        The path of a recording of the participant (see RECORDINGS).
+        """
+        directory, suffix = RECORDINGS[name]
+        return self.dataset_dir / directory / f'{pid}{suffix}'
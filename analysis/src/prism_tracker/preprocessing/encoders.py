@@ -0,0 +1,206 @@
+"""
+Quantized TFLite versions of the pretrained audio and motion encoders, for CPU-only inference.
+
+Usage:
+    $ python -m prism_tracker.preprocessing.encoders --task cooking --participants P1 P2 --quantization float16 int8
+
+The encoders (the Keras models cut at fc2/dense_2, see build_audio_only_model() and build_motion_only_model()) are
+converted with post-training quantization and saved next to the .h5 files as `{audio,motion}_model.{quantization}
+.tflite`. The examples of the given participants calibrate the int8 models, and a parity report compares the
+embeddings of each exported model against Keras on the same examples.
+"""
+import argparse
+import json
+import pathlib
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .. import config
+
+# none: float32, float16: float16 weights, dynamic: int8 weights, int8: int8 weights and activations (calibrated)
+QUANTIZATIONS = ['none', 'float16', 'dynamic', 'int8']
+ENCODERS = ['audio', 'motion']
+NUM_CALIBRATION_EXAMPLES = 500
+
+
+def tflite_model_path(encoder: str, quantization: str) -> pathlib.Path:
+    return config.datadrive / 'pretrained_models' / f'{encoder}_model.{quantization}.tflite'
+
+
+def export_tflite(keras_model, path, quantization: str = 'float16',
+                  calibration_examples: Optional[np.ndarray] = None) -> int:
+    """
+    Convert a Keras model into a TFLite flatbuffer with post-training quantization. The inputs and outputs stay in
+    float32, so the exported model is a drop-in replacement.
+
+    Args:
+    * keras_model: the Keras model to convert.
+    * path (Union[str, pathlib.Path]): the output .tflite path.
+    * quantization (str): one of QUANTIZATIONS.
+    * calibration_examples (Optional[np.ndarray]): representative inputs, required for int8.
+
+    Returns:
+    * size (int): the size of the exported model in bytes.
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f'unknown quantization {quantization}; choose from {QUANTIZATIONS}')
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration_examples is None or len(calibration_examples) == 0:
+            raise ValueError('int8 quantization needs calibration examples')
+        input_shape = [1] + list(keras_model.inputs[0].shape[1:])
+
+        def representative_dataset():
+            for example in calibration_examples[:NUM_CALIBRATION_EXAMPLES]:
+                yield [np.asarray(example, dtype=np.float32).reshape(input_shape)]
+
+        converter.representative_dataset = representative_dataset
+
+    flatbuffer = converter.convert()
+    path = pathlib.Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    path.write_bytes(flatbuffer)
+    return len(flatbuffer)
+
+
+def load_interpreter(path, num_threads: Optional[int] = None):
+    """
+    Load a TFLite model with the lightest runtime installed: LiteRT, tflite-runtime, or TensorFlow itself.
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=str(path), num_threads=num_threads)
+
+
+class TFLiteEncoder:
+    def __init__(self, path, num_threads: Optional[int] = None):
+        """
+        A TFLite encoder that is called like the Keras encoders: encoder([examples]) -> embeddings.
+        Calls are serialized with a lock, as a TFLite interpreter is not thread-safe.
+
+        Args:
+        * path (Union[str, pathlib.Path]): the .tflite model exported by export_tflite().
+        * num_threads (Optional[int]): the number of CPU threads used by the interpreter.
+        """
+        self.path = pathlib.Path(path)
+        self.interpreter = load_interpreter(path, num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.example_shape = tuple(self.input_detail['shape'][1:])
+        self.batch_size = int(self.input_detail['shape'][0])
+        self.lock = threading.Lock()
+
+    def __call__(self, inputs) -> np.ndarray:
+        if isinstance(inputs, (list, tuple)):
+            inputs = inputs[0]
+        examples = np.asarray(inputs, dtype=np.float32)
+        examples = examples.reshape((len(examples),) + self.example_shape)
+
+        with self.lock:
+            if len(examples) != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input_detail['index'], examples.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(examples)
+            self.interpreter.set_tensor(self.input_detail['index'], examples)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_detail['index']).copy()
+
+
+def build_audio_tflite_model(quantization: str = 'float16', num_threads: Optional[int] = None) -> TFLiteEncoder:
+    return TFLiteEncoder(tflite_model_path('audio', quantization), num_threads)
+
+
+def build_motion_tflite_model(quantization: str = 'float16', num_threads: Optional[int] = None) -> TFLiteEncoder:
+    return TFLiteEncoder(tflite_model_path('motion', quantization), num_threads)
+
+
+def parity_report(reference_model, encoder, examples: np.ndarray, batch_size: int = 256) -> Dict:
+    """
+    Compare the embeddings of an encoder against a reference model (e.g., TFLite against Keras).
+
+    Returns:
+    * report (Dict): the maximum/mean absolute error, the maximum error relative to the norm of the reference
+      embedding, and the minimum/mean cosine similarity over the examples.
+    """
+    expected, actual = [], []
+    for start in range(0, len(examples), batch_size):
+        batch = examples[start:start + batch_size]
+        expected.append(np.array(reference_model([batch])))
+        actual.append(np.array(encoder([batch])))
+    expected = np.concatenate(expected).reshape(len(examples), -1).astype(np.float64)
+    actual = np.concatenate(actual).reshape(len(examples), -1).astype(np.float64)
+
+    errors = np.abs(actual - expected)
+    norms = np.linalg.norm(expected, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_errors = np.linalg.norm(actual - expected, axis=1) / norms
+        cosines = np.sum(actual * expected, axis=1) / (np.linalg.norm(actual, axis=1) * norms)
+    return {
+        'num_examples': len(examples),
+        'max_abs_error': float(errors.max()),
+        'mean_abs_error': float(errors.mean()),
+        'max_relative_error': float(np.nanmax(relative_errors)),
+        'min_cosine_similarity': float(np.nanmin(cosines)),
+        'mean_cosine_similarity': float(np.nanmean(cosines)),
+    }
+
+
+def export_pretrained_encoders(quantizations: List[str], audio_examples: np.ndarray,
+                               imu_examples: np.ndarray) -> Dict:
+    """
+    Export both pretrained encoders for each quantization and report their parity against Keras on the examples.
+    """
+    from .feature_extraction import build_audio_only_model, build_motion_only_model
+
+    keras_models = {'audio': build_audio_only_model(), 'motion': build_motion_only_model()}
+    examples = {'audio': audio_examples, 'motion': imu_examples}
+
+    reports = {}
+    for quantization in quantizations:
+        for encoder in ENCODERS:
+            path = tflite_model_path(encoder, quantization)
+            size = export_tflite(keras_models[encoder], path, quantization, examples[encoder])
+            report = parity_report(keras_models[encoder], TFLiteEncoder(path), examples[encoder])
+            reports[f'{encoder}.{quantization}'] = dict(report, path=str(path), size_bytes=size)
+    return reports
+
+
+def main():
+    from .feature_extraction import load_examples
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--task', required=True, help='the task whose dataset provides the examples')
+    parser.add_argument('--participants', nargs='+', required=True)
+    parser.add_argument('--quantization', nargs='+', choices=QUANTIZATIONS, default=['float16', 'int8'])
+    args = parser.parse_args()
+
+    dataset_dir = config.datadrive / 'tasks' / args.task / 'dataset'
+    audio_examples, imu_examples = [], []
+    for participant_name in args.participants:
+        audio, imu, _ = load_examples(participant_name, dataset_dir)
+        audio_examples.append(audio)
+        imu_examples.append(imu)
+
+    reports = export_pretrained_encoders(args.quantization, np.concatenate(audio_examples),
+                                         np.concatenate(imu_examples))
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
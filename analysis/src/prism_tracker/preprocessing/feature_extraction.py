@@ -1,17 +1,18 @@
 import pickle as pkl
 
 import numpy as np
-import pandas as pd
-from tensorflow.keras.models import Model, load_model
 
-from .. import config
+from .. import config, instrumentation
 from . import params
-from .annotation import get_times_and_labels, overwrite_other_labels
+from .annotation import lookup_times_and_labels, overwrite_other_labels
 from .audio import get_audio_examples
-from .motion import get_motion_examples
+from .motion import get_motion_examples, load_preprocessed_motion
+from .segments import Segments
 
 
 def build_audio_only_model():
+    from tensorflow.keras.models import Model, load_model
+
     path_to_model = config.datadrive / 'pretrained_models/audio_model.h5'
     ubicoustics_model = load_model(path_to_model)
     fc2_op = ubicoustics_model.get_layer('fc2').output
@@ -23,6 +24,8 @@ def build_audio_only_model():
 
 
 def build_motion_only_model():
+    from tensorflow.keras.models import Model, load_model
+
     path_to_model = config.datadrive / 'pretrained_models/motion_model.h5'
     motion_model = load_model(path_to_model)
     dense2_op = motion_model.get_layer('dense_2').output
@@ -62,19 +65,15 @@ def normalize_motion(motion, norm_params):
     return motion_normalized
 
 
-def create_feature_pkl(pid, annotations, path_to_original,
-                       class_dict, audio_model, motion_model, half=False):
-    # load data
-    print(f"\n----Create feature pkl for {pid}----")
-    times, tasks = get_times_and_labels(annotations[pid], half)
-
+def load_examples(pid, path_to_original):
+    """
+    Load the log-mel audio examples, the normalized IMU examples and the motion timestamps (ms) of a participant.
+    """
     audio_file_path = path_to_original / \
         'audio' / 'preprocessed' / f'{pid}.wav'
-    motion_file_path = path_to_original / \
-        'motion' / 'preprocessed' / f'{pid}.txt'
 
-    motion_df = pd.read_csv(motion_file_path, delim_whitespace=True, header=0)
-    motion = motion_df.to_numpy()[:, 1:]
+    motion_arr = load_preprocessed_motion(path_to_original, pid)
+    motion = motion_arr[:, 1:]
 
     norm_params = get_normalization_params()
     motion_normalized = normalize_motion(motion, norm_params)
@@ -82,61 +81,116 @@ def create_feature_pkl(pid, annotations, path_to_original,
     # generate examples
     imu_examples = get_motion_examples(motion_normalized)
     audio_examples = get_audio_examples(audio_file_path)
+    return audio_examples, imu_examples, np.asarray(motion_arr[:, 0])
 
-    # align motion and audio
-    windowed_data_audio = []
-    windowed_data_imu = []
-    labels = []
-    relative_times = []
+
+def align_examples(num_audio_examples, num_imu_examples, motion_timestamps):
+    """
+    Align each audio example with the IMU example ending at the same time.
+    Returns the aligned audio and IMU example indices, the relative times (ms) and the motion timestamps (ms).
+    """
+    audio_indices, imu_indices = [], []
+    relative_times, motion_times = [], []
 
     # loop through all the audio examples and
-    for i in range(audio_examples.shape[0]):
+    for i in range(num_audio_examples):
         end_audio_sec = params.EXAMPLE_WINDOW_SECONDS + params.EXAMPLE_HOP_SECONDS * i
         imu_sample_num = 50 * end_audio_sec
         imu_example_index = int((imu_sample_num - params.WINDOW_LENGTH_IMU) / params.HOP_LENGTH_IMU)
 
         # (100, 9)
-        if imu_example_index >= imu_examples.shape[0]:
+        if imu_example_index >= num_imu_examples:
             print(
-                f'out of bounds {imu_example_index=} {imu_examples.shape[0]=} {i=} {audio_examples.shape[0]=}')
+                f'out of bounds {imu_example_index=} {num_imu_examples=} {i=} {num_audio_examples=}')
             break
-        imu = imu_examples[imu_example_index, :, :]
 
         # get the timestamp from the motion data
         last_frame_index_motion_example = int(imu_example_index * params.HOP_LENGTH_IMU + params.WINDOW_LENGTH_IMU)
-        ms = motion_df['timestamp'][last_frame_index_motion_example]
+        motion_times.append(motion_timestamps[last_frame_index_motion_example])
+
+        audio_indices.append(i)
+        imu_indices.append(imu_example_index)
+        relative_times.append(end_audio_sec * 1000)
+
+    return np.array(audio_indices, dtype=int), np.array(imu_indices, dtype=int), relative_times, motion_times
+
+
+def label_examples(motion_times, times, tasks, class_dict):
+    """
+    Label the aligned examples by their motion timestamps.
+    Returns the labels and a mask of the examples kept (examples that cannot be labeled are removed).
+    """
+    labels = []
+    keep = np.zeros(len(motion_times), dtype=bool)
 
+    for i, ms in enumerate(motion_times):
         try:
             label = get_label(ms, times, tasks, class_dict)
             labels.append(label)
-            relative_times.append(end_audio_sec * 1000)
-            windowed_data_imu.append(imu)
-            windowed_data_audio.append(audio_examples[i])
+            keep[i] = True
         except BaseException as e:
             print(e)
             continue  # remove REMOVE class label
 
-    windowed_arr_audio = np.array(windowed_data_audio)
-    windowed_arr_imu = np.array(windowed_data_imu)
+    return labels, keep
+
+
+def compute_embeddings(audio_windows, imu_windows, audio_model, motion_model):
+    """
+    Embed the aligned windows with the pretrained audio and motion models.
+    """
+    audio_feat = np.array(audio_model([audio_windows]))
+    imu_feat = np.array(motion_model([imu_windows]))
+    return audio_feat, imu_feat
+
 
+def build_dataset(audio_feat, imu_feat, labels, relative_times):
+    """
+    Build the dataset dict from the labeled examples.
+    """
     # remove other from the beginning and the end
     audio, imu, strip_labels, new_times = clean_tasks(
-        windowed_arr_audio, windowed_arr_imu, labels, relative_times)
-
-    audio_feat = np.array(audio_model([audio]))
-    imu_feat = np.array(motion_model([imu]))
+        audio_feat, imu_feat, labels, relative_times)
+    segments = overwrite_other_labels(Segments.from_labels(strip_labels))
 
     dataset = {
-        'IMU': imu_feat,
-        'audio': audio_feat,
-        'labels': overwrite_other_labels(strip_labels),
+        'IMU': imu,
+        'audio': audio,
+        'labels': segments.to_labels(),
+        'segments': segments.to_dict(),
         'timestamp': new_times
     }
 
-    # print(f'{imu_feat.shape=}, {audio_feat.shape=}, {len(strip_labels)=}, {len(new_times)=}')
+    # print(f'{imu.shape=}, {audio.shape=}, {len(strip_labels)=}, {len(new_times)=}')
     return dataset
 
 
+def create_feature_pkl(pid, annotations, path_to_original,
+                       class_dict, audio_model, motion_model, half=False):
+    # load data
+    print(f"\n----Create feature pkl for {pid}----")
+    times, tasks = lookup_times_and_labels(annotations, pid, half)
+
+    with instrumentation.timer('preprocessing.load_examples'):
+        audio_examples, imu_examples, motion_timestamps = load_examples(pid, path_to_original)
+
+    # align motion and audio
+    with instrumentation.timer('preprocessing.align'):
+        audio_indices, imu_indices, relative_times, motion_times = align_examples(
+            audio_examples.shape[0], imu_examples.shape[0], motion_timestamps)
+    with instrumentation.timer('preprocessing.labels'):
+        labels, keep = label_examples(motion_times, times, tasks, class_dict)
+    relative_times = [t for t, k in zip(relative_times, keep) if k]
+
+    with instrumentation.timer('preprocessing.embeddings'):
+        audio_feat, imu_feat = compute_embeddings(
+            audio_examples[audio_indices[keep]], imu_examples[imu_indices[keep]], audio_model, motion_model)
+    instrumentation.count('preprocessing.examples', len(labels))
+
+    with instrumentation.timer('preprocessing.build_dataset'):
+        return build_dataset(audio_feat, imu_feat, labels, relative_times)
+
+
 def clean_tasks(windowed_arr_audio, windowed_arr_imu, labels, times):
     """
     Delete beginning and end examples classified as 'Other'.
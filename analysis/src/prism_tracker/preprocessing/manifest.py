@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import pathlib
+from typing import Dict, Iterable, Optional, Union
+
+PathLike = Union[str, pathlib.Path]
+
+
+def digest(*parts) -> str:
+    """
+    Hash a sequence of JSON-serializable parts (strings, numbers, lists, dicts) into a hex digest.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()
+
+
+def params_digest(module) -> str:
+    """
+    Hash the upper-case constants of a params module.
+    """
+    constants = {name: getattr(module, name) for name in dir(module) if name.isupper()}
+    return digest(constants)
+
+
+class Manifest:
+    """
+    A JSON manifest recording, for each (stage, participant), the key of the inputs it was last built from.
+    File contents are hashed once and cached in the manifest by (size, mtime).
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = pathlib.Path(path)
+        self.entries: Dict[str, Dict[str, str]] = {}
+        self.files: Dict[str, list] = {}
+
+        if self.path.exists():
+            with open(self.path, 'r') as fp:
+                data = json.load(fp)
+            self.entries = data.get('entries', {})
+            self.files = data.get('files', {})
+
+    def file_digest(self, path: PathLike) -> Optional[str]:
+        """
+        Return the content hash of a file, or None if it does not exist.
+        """
+        path = pathlib.Path(path)
+        if not path.exists():
+            return None
+
+        stat = path.stat()
+        cached = self.files.get(str(path))
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha1.update(chunk)
+        self.files[str(path)] = [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+        return sha1.hexdigest()
+
+    def is_fresh(self, stage: str, pid: str, key: str, outputs: Iterable[PathLike] = ()) -> bool:
+        """
+        Check whether the stage output of the participant was built from the same key and still exists.
+        """
+        if self.entries.get(stage, {}).get(pid) != key:
+            return False
+        return all(pathlib.Path(output).exists() for output in outputs)
+
+    def record(self, stage: str, pid: str, key: str):
+        """
+        Record that the stage output of the participant was built from the key, and save the manifest.
+        """
+        self.entries.setdefault(stage, {})[pid] = key
+        self.save()
+
+    def invalidate(self, pid: str):
+        """
+        Forget every stage of the participant.
+        """
+        for stage_entries in self.entries.values():
+            stage_entries.pop(pid, None)
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({'entries': self.entries, 'files': self.files}, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
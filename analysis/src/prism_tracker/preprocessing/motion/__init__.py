@@ -1 +1 @@
-from .utils import get_motion_examples, preprocess_motion
+from .utils import get_motion_examples, load_preprocessed_motion, preprocess_motion
@@ -1,8 +1,24 @@
 import numpy as np
-import pandas as pd
 
+from ... import instrumentation
 from .. import params
 
+# columns of the raw SensorLogger motion log (21 whitespace-separated values per line)
+SENSOR_COLUMNS = ['unix_time', 'data.userAcceleration.x', 'data.userAcceleration.y', 'data.userAcceleration.z',
+                  'data.gravity.x', 'data.gravity.y', 'data.gravity.z',
+                  'data.rotationRate.x', 'data.rotationRate.y', 'data.rotationRate.z',
+                  'data.magneticField.field.x', 'data.magneticField.field.y', 'data.magneticField.field.z',
+                  'data.attitude.roll', 'data.attitude.pitch', 'data.attitude.yaw',
+                  'data.attitude.quaternion.x', 'data.attitude.quaternion.y', 'data.attitude.quaternion.z',
+                  'data.attitude.quaternion.w', 'data.time']
+
+# columns we actually need from the raw log
+USED_SENSOR_COLUMNS = ['data.userAcceleration.x', 'data.userAcceleration.y', 'data.userAcceleration.z',
+                       'data.gravity.x', 'data.gravity.y', 'data.gravity.z', 'data.time']
+
+# columns of the preprocessed motion array (column 0 holds the timestamps in ms relative to the clap)
+MOTION_COLUMNS = ['timestamp', 'acc.x', 'acc.y', 'acc.z']
+
 
 def get_motion_examples(motion_data):
     """
@@ -25,51 +41,74 @@ def get_motion_examples(motion_data):
         motion_data, shape=shape, strides=strides)
 
 
-def reset_times_relative_to_clap(df, clap_ms):
+def reset_times_relative_to_clap(timestamps, clap_ms):
     """
-    Reset the timestamps based on the clap_dict.
+    Reset the timestamps (in secs) based on the clap time.
+    Returns the timestamps in ms and a mask of the samples at or after the clap.
     """
-    df['timestamp'] *= 1000  # convert to ms (from secs)
-    df['timestamp'] -= df['timestamp'][0]  # start sensor time at zero
-    df['timestamp'] -= float(clap_ms)  # zero to clap
+    timestamps = timestamps * 1000  # convert to ms (from secs)
+    timestamps -= timestamps[0]  # start sensor time at zero
+    timestamps -= float(clap_ms)  # zero to clap
 
     # now only keep timestamps that are >= 0
-    df = df[df['timestamp'] >= 0]
-    return df
+    return timestamps, timestamps >= 0
+
+
+def read_raw_motion(raw_fp):
+    """
+    Parse a raw motion log, reading only the used columns as float64.
+    Returns an array whose columns follow USED_SENSOR_COLUMNS.
+    """
+    import pandas as pd
+
+    usecols = [SENSOR_COLUMNS.index(column) for column in USED_SENSOR_COLUMNS]
+    df = pd.read_csv(
+        raw_fp,
+        sep=r'\s+',
+        engine='c',
+        header=None,
+        usecols=usecols,
+        dtype=np.float64)
+    return df.to_numpy()
 
 
 def preprocess_motion(participant_name, original_dir, clap_dict):
     """
     Set the proper timestamps and remove data before clap.
+    The result is saved as a memory-mappable .npy array whose columns follow MOTION_COLUMNS.
     """
 
     raw_fp = original_dir / 'motion' / 'raw' / \
         f'{participant_name}.txt'
 
-    sensor_columns = ['unix_time', 'data.userAcceleration.x', 'data.userAcceleration.y', 'data.userAcceleration.z',
-                      'data.gravity.x', 'data.gravity.y', 'data.gravity.z',
-                      'data.rotationRate.x', 'data.rotationRate.y', 'data.rotationRate.z',
-                      'data.magneticField.field.x', 'data.magneticField.field.y', 'data.magneticField.field.z',
-                      'data.attitude.roll', 'data.attitude.pitch', 'data.attitude.yaw',
-                      'data.attitude.quaternion.x', 'data.attitude.quaternion.y', 'data.attitude.quaternion.z',
-                      'data.attitude.quaternion.w', 'data.time']
+    with instrumentation.timer('preprocessing.read_motion'):
+        raw = read_raw_motion(raw_fp)
 
-    df = pd.read_csv(
-        raw_fp,
-        delim_whitespace=True,
-        header=None,
-        names=sensor_columns)
+    save_arr = np.empty((raw.shape[0], len(MOTION_COLUMNS)), dtype=np.float64)
+    save_arr[:, 0] = raw[:, 6]  # use the sensor timestamp
+    save_arr[:, 1:] = - (raw[:, 0:3] + raw[:, 3:6]) * 9.81
 
-    save_df = pd.DataFrame()
-    save_df['timestamp'] = df['data.time']  # use the sensor timestamp
-    save_df['acc.x'] = - (df['data.userAcceleration.x'] + df['data.gravity.x']) * 9.81
-    save_df['acc.y'] = - (df['data.userAcceleration.y'] + df['data.gravity.y']) * 9.81
-    save_df['acc.z'] = - (df['data.userAcceleration.z'] + df['data.gravity.z']) * 9.81
-
-    save_df = reset_times_relative_to_clap(
-        save_df, clap_dict[participant_name])
+    save_arr[:, 0], mask = reset_times_relative_to_clap(
+        save_arr[:, 0], clap_dict[participant_name])
+    save_arr = save_arr[mask]
 
     save_fp = original_dir / 'motion' / \
-        'preprocessed' / f'{participant_name}.txt'
+        'preprocessed' / f'{participant_name}.npy'
     save_fp.parent.mkdir(exist_ok=True, parents=True)
-    save_df.to_csv(save_fp, index=None, sep=' ', mode='w')
+    np.save(save_fp, save_arr)
+
+
+def load_preprocessed_motion(original_dir, participant_name):
+    """
+    Load the preprocessed motion array (memory-mapped) of a participant.
+    Falls back to the legacy space-separated .txt output when no .npy exists.
+    """
+    motion_dir = original_dir / 'motion' / 'preprocessed'
+    npy_fp = motion_dir / f'{participant_name}.npy'
+    if npy_fp.exists():
+        return np.load(npy_fp, mmap_mode='r')
+
+    import pandas as pd
+
+    motion_df = pd.read_csv(motion_dir / f'{participant_name}.txt', sep=r'\s+', engine='c', header=0)
+    return motion_df[MOTION_COLUMNS].to_numpy(dtype=np.float64)
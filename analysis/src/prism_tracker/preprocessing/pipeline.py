@@ -0,0 +1,135 @@
+import pathlib
+import pickle as pkl
+from typing import List, Optional
+
+import numpy as np
+
+from .. import config
+from . import params
+from .annotation import lookup_times_and_labels
+from .audio import get_audio_examples_from_log_mel, get_audio_log_mel, preprocess_audio
+from .feature_extraction import (
+    align_examples, build_audio_only_model, build_dataset, build_motion_only_model, compute_embeddings,
+    get_normalization_params, label_examples, normalize_motion,
+)
+from .manifest import Manifest, digest, params_digest
+from .motion import get_motion_examples, load_preprocessed_motion, preprocess_motion
+
+PRETRAINED_MODEL_FILES = ['audio_model.h5', 'motion_model.h5', 'motion_norm_params.pkl']
+DATASET_VERSION = 2  # the layout of the feature pkl; 2 added 'segments'
+
+
+class PretrainedModels:
+    """
+    The pretrained audio and motion models, loaded on first use so that up-to-date builds do not load them at all.
+    With a quantization (see preprocessing/encoders.py), the exported TFLite encoders are used instead of Keras.
+    """
+
+    def __init__(self, quantization: Optional[str] = None):
+        self.quantization = quantization
+        self.audio_model = None
+        self.motion_model = None
+
+    @property
+    def model_files(self) -> List[str]:
+        if self.quantization is None:
+            return PRETRAINED_MODEL_FILES
+        return [f'audio_model.{self.quantization}.tflite', f'motion_model.{self.quantization}.tflite',
+                'motion_norm_params.pkl']
+
+    def load(self):
+        if self.audio_model is None:
+            if self.quantization is None:
+                self.audio_model = build_audio_only_model()
+                self.motion_model = build_motion_only_model()
+            else:
+                from .encoders import build_audio_tflite_model, build_motion_tflite_model
+                self.audio_model = build_audio_tflite_model(self.quantization)
+                self.motion_model = build_motion_tflite_model(self.quantization)
+        return self.audio_model, self.motion_model
+
+    def digest(self, manifest: Manifest) -> str:
+        model_dir = config.datadrive / 'pretrained_models'
+        return digest([manifest.file_digest(model_dir / name) for name in self.model_files])
+
+
+def build_participant(pid, dataset_dir, preprocessed_dir, cache_dir, manifest, annotations, class_dict, clap_dict,
+                      models, half=False):
+    """
+    Bring the feature pkl of a participant up to date, recomputing only the stages whose inputs changed.
+    The stages are the resampled audio, the cleaned IMU, the log-mel spectrogram, the embeddings and the labels.
+    Each stage is keyed by the hashes of its inputs and parameters, including the keys of the stages it depends on.
+    The annotations are a Catalog (see catalog.py) or the dict of load_annotations_dict().
+    Returns the names of the stages that were recomputed.
+    """
+    dataset_dir = pathlib.Path(dataset_dir)
+    preprocessed_dir = pathlib.Path(preprocessed_dir)
+    cache_dir = pathlib.Path(cache_dir)
+    rebuilt = []
+
+    clap_ms = clap_dict[pid]
+    preprocessing_params = params_digest(params)
+
+    # resampled audio
+    audio_path = dataset_dir / 'audio' / 'preprocessed' / f'{pid}.wav'
+    audio_key = digest('audio', manifest.file_digest(dataset_dir / 'audio' / 'raw' / f'{pid}.wav'), clap_ms,
+                       params.SAMPLE_RATE)
+    if not manifest.is_fresh('audio', pid, audio_key, [audio_path]):
+        preprocess_audio(pid, dataset_dir, clap_dict)
+        manifest.record('audio', pid, audio_key)
+        rebuilt.append('audio')
+
+    # cleaned IMU
+    motion_path = dataset_dir / 'motion' / 'preprocessed' / f'{pid}.npy'
+    motion_key = digest('motion', manifest.file_digest(dataset_dir / 'motion' / 'raw' / f'{pid}.txt'), clap_ms)
+    if not manifest.is_fresh('motion', pid, motion_key, [motion_path]):
+        preprocess_motion(pid, dataset_dir, clap_dict)
+        manifest.record('motion', pid, motion_key)
+        rebuilt.append('motion')
+
+    # log-mel spectrogram
+    log_mel_path = cache_dir / 'log_mel' / f'{pid}.npy'
+    log_mel_key = digest('log_mel', audio_key, preprocessing_params)
+    if not manifest.is_fresh('log_mel', pid, log_mel_key, [log_mel_path]):
+        log_mel_path.parent.mkdir(exist_ok=True, parents=True)
+        np.save(log_mel_path, get_audio_log_mel(audio_path))
+        manifest.record('log_mel', pid, log_mel_key)
+        rebuilt.append('log_mel')
+
+    # embeddings of every aligned example (independent of the annotations)
+    embeddings_path = cache_dir / 'embeddings' / f'{pid}.npz'
+    embeddings_key = digest('embeddings', log_mel_key, motion_key, preprocessing_params, models.digest(manifest))
+    if not manifest.is_fresh('embeddings', pid, embeddings_key, [embeddings_path]):
+        audio_examples = get_audio_examples_from_log_mel(np.load(log_mel_path))
+        motion_arr = load_preprocessed_motion(dataset_dir, pid)
+        imu_examples = get_motion_examples(normalize_motion(motion_arr[:, 1:], get_normalization_params()))
+
+        audio_indices, imu_indices, relative_times, motion_times = align_examples(
+            audio_examples.shape[0], imu_examples.shape[0], motion_arr[:, 0])
+        audio_model, motion_model = models.load()
+        audio_feat, imu_feat = compute_embeddings(
+            audio_examples[audio_indices], imu_examples[imu_indices], audio_model, motion_model)
+
+        embeddings_path.parent.mkdir(exist_ok=True, parents=True)
+        np.savez(embeddings_path, audio=audio_feat, imu=imu_feat,
+                 relative_times=np.array(relative_times), motion_times=np.array(motion_times))
+        manifest.record('embeddings', pid, embeddings_key)
+        rebuilt.append('embeddings')
+
+    # labels, and the final feature pkl
+    pkl_path = preprocessed_dir / f'{pid}.pkl'
+    times, tasks = lookup_times_and_labels(annotations, pid, half)
+    labels_key = digest('labels', DATASET_VERSION, embeddings_key, list(map(float, times)), tasks, class_dict, half)
+    if not manifest.is_fresh('labels', pid, labels_key, [pkl_path]):
+        embeddings = np.load(embeddings_path)
+        labels, keep = label_examples(embeddings['motion_times'], times, tasks, class_dict)
+        dataset = build_dataset(embeddings['audio'][keep], embeddings['imu'][keep], labels,
+                                embeddings['relative_times'][keep].tolist())
+
+        preprocessed_dir.mkdir(exist_ok=True, parents=True)
+        with open(pkl_path, 'wb') as f:
+            pkl.dump(dataset, f)
+        manifest.record('labels', pid, labels_key)
+        rebuilt.append('labels')
+
+    return rebuilt
@@ -0,0 +1,151 @@
+"""
+Run-length encoded label timelines.
+
+A timeline of frame labels is stored as segments of consecutive equal labels: an integer id per segment (an index into
+`names`), its start frame and its length. Segment-level work (transition counts, durations, oracle transition times)
+then costs the number of segments rather than the number of frames.
+"""
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class Segments:
+    def __init__(self, ids, starts, lengths, names: List[str]):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f'Segments({len(self)} segments, {self.num_frames} frames)'
+
+    @property
+    def num_frames(self) -> int:
+        return int(self.starts[-1] + self.lengths[-1]) if len(self) > 0 else 0
+
+    @property
+    def labels(self) -> List[str]:
+        """
+        The name of each segment.
+        """
+        return [self.names[i] for i in self.ids]
+
+    @classmethod
+    def from_labels(cls, labels: List[str], names: Optional[List[str]] = None) -> 'Segments':
+        """
+        Encode frame labels. The ids index `names`, or the labels in order of first appearance if None.
+        """
+        if names is None:
+            names = list(dict.fromkeys(labels))
+        name_ids = {name: i for i, name in enumerate(names)}
+        frame_ids = np.array([name_ids[label] for label in labels], dtype=np.int32)
+        return cls.from_ids(frame_ids, names)
+
+    @classmethod
+    def from_ids(cls, frame_ids: np.ndarray, names: List[str]) -> 'Segments':
+        """
+        Encode frame ids (indices into `names`).
+        """
+        frame_ids = np.asarray(frame_ids)
+        if len(frame_ids) == 0:
+            return cls([], [], [], names)
+        starts = np.concatenate([[0], np.nonzero(frame_ids[1:] != frame_ids[:-1])[0] + 1])
+        lengths = np.diff(np.append(starts, len(frame_ids)))
+        return cls(frame_ids[starts], starts, lengths, names)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Segments':
+        return cls(data['ids'], data['starts'], data['lengths'], data['names'])
+
+    def to_dict(self) -> Dict:
+        """
+        A plain dict to be stored in the feature pkl (see from_dict()).
+        """
+        return {'names': self.names, 'ids': self.ids, 'starts': self.starts, 'lengths': self.lengths}
+
+    def to_ids(self) -> np.ndarray:
+        return np.repeat(self.ids, self.lengths)
+
+    def to_labels(self) -> List[str]:
+        return [self.names[i] for i in self.to_ids()]
+
+    def remap(self, names: List[str]) -> 'Segments':
+        """
+        Re-index the segments by another list of names, e.g., the steps of a procedure.
+        """
+        name_ids = {name: i for i, name in enumerate(names)}
+        mapping = np.array([name_ids.get(name, -1) for name in self.names], dtype=np.int32)
+        ids = mapping[self.ids] if len(self) > 0 else self.ids
+        if np.any(ids < 0):
+            missing = sorted({self.names[i] for i in self.ids[ids < 0]})
+            raise ValueError(f'{missing} are not in {names}')
+        return Segments(ids, self.starts, self.lengths, names).merge_adjacent()
+
+    def merge_adjacent(self) -> 'Segments':
+        """
+        Merge consecutive segments with the same id.
+        """
+        if len(self) == 0:
+            return self
+        keep = np.concatenate([[True], self.ids[1:] != self.ids[:-1]])
+        starts = self.starts[keep]
+        lengths = np.diff(np.append(starts, self.num_frames))
+        return Segments(self.ids[keep], starts, lengths, self.names)
+
+    def drop(self, names: Iterable[str]) -> 'Segments':
+        """
+        Remove the frames of the given names, as if they were filtered out of the frame labels.
+        """
+        names = set(names)
+        dropped = np.isin(self.ids, [i for i, name in enumerate(self.names) if name in names])
+        lengths = self.lengths[~dropped]
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        return Segments(self.ids[~dropped], starts, lengths, self.names).merge_adjacent()
+
+    def absorb(self, name: str) -> 'Segments':
+        """
+        Relabel the segments of `name` with the previous segment (see overwrite_other_labels()).
+        """
+        if name not in self.names:
+            return self
+        is_absorbed = self.ids == self.names.index(name)
+        if len(self) > 0 and is_absorbed[0]:
+            raise ValueError(f'the first segment cannot be {name}')
+        # the index of the last segment that is kept, at or before each segment
+        previous = np.maximum.accumulate(np.where(is_absorbed, 0, np.arange(len(self))))
+        return Segments(self.ids[previous], self.starts, self.lengths, self.names).merge_adjacent()
+
+    def transition_times(self) -> Dict[int, List[int]]:
+        """
+        The start frames of the segments of each id.
+        """
+        times: Dict[int, List[int]] = {}
+        for i, start in zip(self.ids.tolist(), self.starts.tolist()):
+            times.setdefault(i, []).append(start)
+        return times
+
+    @staticmethod
+    def concatenate(segments_list: List['Segments']) -> 'Segments':
+        """
+        Concatenate timelines that share the same names.
+        """
+        if len(segments_list) == 0:
+            raise ValueError('nothing to concatenate')
+        offsets = np.cumsum([0] + [segments.num_frames for segments in segments_list[:-1]])
+        return Segments(np.concatenate([segments.ids for segments in segments_list]),
+                        np.concatenate([segments.starts + offset for segments, offset in zip(segments_list, offsets)]),
+                        np.concatenate([segments.lengths for segments in segments_list]),
+                        segments_list[0].names).merge_adjacent()
+
+
+def load_segments(data: Dict) -> Segments:
+    """
+    Get the segments of a loaded feature pkl, encoding its labels if it predates the segments.
+    """
+    if 'segments' in data:
+        return Segments.from_dict(data['segments'])
+    return Segments.from_labels(data['labels'])
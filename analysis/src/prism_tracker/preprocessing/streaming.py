@@ -0,0 +1,174 @@
+import collections
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+
+from .. import instrumentation
+from . import params
+from .audio import mel_features
+from .feature_extraction import normalize_motion
+
+IMU_SAMPLE_RATE = 50  # Hz, the rate assumed when aligning audio and IMU examples in align_examples()
+
+# the band edges used by get_audio_examples()
+AUDIO_LOWER_EDGE_HERTZ = 10
+AUDIO_UPPER_EDGE_HERTZ = params.SAMPLE_RATE // 2
+
+
+class RingBuffer:
+    """
+    A fixed-capacity buffer of rows that keeps the most recent rows, preallocated once.
+    """
+
+    def __init__(self, capacity: int, row_shape: Tuple[int, ...] = (), dtype=np.float64):
+        self.capacity = capacity
+        self.data = np.zeros((capacity,) + row_shape, dtype=dtype)
+        self.total = 0  # number of rows ever appended
+
+    def append(self, rows: np.ndarray):
+        num_rows = len(rows)
+        rows = rows[-self.capacity:]  # older rows would be overwritten anyway
+        start = (self.total + num_rows - len(rows)) % self.capacity
+        end = start + len(rows)
+        if end <= self.capacity:
+            self.data[start:end] = rows
+        else:
+            split = self.capacity - start
+            self.data[start:] = rows[:split]
+            self.data[:end - self.capacity] = rows[split:]
+        self.total += num_rows
+
+    def get(self, start: int, stop: int) -> np.ndarray:
+        """
+        Return the rows [start, stop) counted from the first row ever appended.
+        """
+        if start < self.total - self.capacity or stop > self.total:
+            raise IndexError(f'rows [{start}, {stop}) are not in the buffer (holding [{self.total - self.capacity}, '
+                             f'{self.total}))')
+        indices = np.arange(start, stop) % self.capacity
+        return self.data[indices]
+
+
+class FeatureFrame:
+    def __init__(self, index: int, relative_time: float, audio: np.ndarray, imu: np.ndarray):
+        self.index = index
+        self.relative_time = relative_time  # ms, the end of the audio example as in create_feature_pkl()
+        self.audio = audio  # (96, 64) log-mel example
+        self.imu = imu  # (100, 3) normalized IMU window
+        self.features: Optional[np.ndarray] = None  # [IMU embedding, audio embedding] if encoders are given
+
+    def __repr__(self):
+        return f'frame{self.index}@{self.relative_time}'
+
+
+class StreamingFeatureExtractor:
+    def __init__(self, norm_params, audio_model=None, motion_model=None, max_skew_seconds: float = 5.0):
+        """
+        An incremental version of get_audio_examples(), get_motion_examples() and align_examples().
+        Audio and IMU chunks can be pushed in any sizes and any interleaving; only the new STFT frames are computed,
+        and one aligned frame is emitted every EXAMPLE_HOP_SECONDS of audio once the matching IMU window arrived.
+
+        Args:
+        * norm_params (Dict): the motion normalization parameters (see get_normalization_params()).
+        * audio_model, motion_model (Optional): the pretrained encoders; if given, each frame carries the concatenated
+          [IMU, audio] embeddings as in load_imu_and_audio_data(), ready for the classifier.
+        * max_skew_seconds (float): how far the IMU stream may run ahead of the audio stream; the audio examples
+          whose IMU window is older are dropped, and counted in num_dropped_frames.
+        """
+        self.norm_params = norm_params
+        self.audio_model = audio_model
+        self.motion_model = motion_model
+
+        # STFT, computed exactly as in mel_features.log_mel_spectrogram()
+        self.window_length = int(params.SAMPLE_RATE * params.STFT_WINDOW_LENGTH_SECONDS)
+        self.hop_length = int(params.SAMPLE_RATE * params.STFT_HOP_LENGTH_SECONDS)
+        window_length_samples = params.SAMPLE_RATE * params.STFT_WINDOW_LENGTH_SECONDS
+        self.fft_length = 2 ** int(np.ceil(np.log(window_length_samples) / np.log(2.0)))
+        self.mel_matrix = mel_features.spectrogram_to_mel_matrix(
+            num_mel_bins=params.NUM_MEL_BINS, num_spectrogram_bins=self.fft_length // 2 + 1,
+            audio_sample_rate=params.SAMPLE_RATE,
+            lower_edge_hertz=AUDIO_LOWER_EDGE_HERTZ, upper_edge_hertz=AUDIO_UPPER_EDGE_HERTZ)
+
+        # examples, framed exactly as in vggish_input.log_mel_to_examples()
+        features_sample_rate = 1.0 / params.STFT_HOP_LENGTH_SECONDS
+        self.example_window_length = int(round(params.EXAMPLE_WINDOW_SECONDS * features_sample_rate))
+        self.example_hop_length = int(round(params.EXAMPLE_HOP_SECONDS * features_sample_rate))
+
+        # audio samples not yet consumed by a full STFT hop
+        self.audio_tail = np.zeros(0, dtype=np.float64)
+        self.log_mel = RingBuffer(self.example_window_length, (params.NUM_MEL_BINS,))
+        self.imu = RingBuffer(params.WINDOW_LENGTH_IMU + int(max_skew_seconds * IMU_SAMPLE_RATE), (3,))
+
+        self.pending: Deque[Tuple[int, np.ndarray]] = collections.deque()  # audio examples waiting for IMU
+        self.num_audio_examples = 0
+        self.num_dropped_frames = 0  # audio examples whose IMU window was overwritten (see max_skew_seconds)
+
+    def push_audio(self, samples: np.ndarray) -> List[FeatureFrame]:
+        """
+        Push mono audio samples at SAMPLE_RATE (int16, or float in [-1, 1]) and return the frames completed.
+        """
+        samples = np.asarray(samples)
+        if samples.dtype == np.int16:
+            samples = samples / 32768.0
+        self.audio_tail = np.concatenate([self.audio_tail, samples.astype(np.float64)])
+
+        if len(self.audio_tail) >= self.window_length:
+            num_frames = 1 + (len(self.audio_tail) - self.window_length) // self.hop_length
+            consumed = num_frames * self.hop_length
+            signal = self.audio_tail[:consumed - self.hop_length + self.window_length]
+
+            with instrumentation.timer('streaming.log_mel'):
+                spectrogram = mel_features.stft_magnitude(
+                    signal, fft_length=self.fft_length, hop_length=self.hop_length, window_length=self.window_length)
+                log_mel = np.log(np.dot(spectrogram, self.mel_matrix) + params.LOG_OFFSET)
+            self.audio_tail = self.audio_tail[consumed:]
+
+            for row in log_mel:
+                self.log_mel.append(row[np.newaxis])
+                num_log_mel = self.log_mel.total
+                if num_log_mel >= self.example_window_length and \
+                        (num_log_mel - self.example_window_length) % self.example_hop_length == 0:
+                    example = self.log_mel.get(num_log_mel - self.example_window_length, num_log_mel)
+                    self.pending.append((self.num_audio_examples, example))
+                    self.num_audio_examples += 1
+
+        return self._emit()
+
+    def push_motion(self, acc: np.ndarray) -> List[FeatureFrame]:
+        """
+        Push IMU samples at 50Hz, as rows of (acc.x, acc.y, acc.z) in the preprocessed units, and return the frames
+        completed.
+        """
+        acc = np.asarray(acc, dtype=np.float64).reshape(-1, 3)
+        self.imu.append(normalize_motion(acc, self.norm_params))
+        return self._emit()
+
+    def _emit(self) -> List[FeatureFrame]:
+        frames = []
+        while len(self.pending) > 0:
+            i, example = self.pending[0]
+            end_audio_sec = params.EXAMPLE_WINDOW_SECONDS + params.EXAMPLE_HOP_SECONDS * i
+            imu_sample_num = IMU_SAMPLE_RATE * end_audio_sec
+            imu_example_index = int((imu_sample_num - params.WINDOW_LENGTH_IMU) / params.HOP_LENGTH_IMU)
+            start = imu_example_index * params.HOP_LENGTH_IMU
+
+            if start + params.WINDOW_LENGTH_IMU > self.imu.total:
+                break  # wait for the IMU to catch up
+            self.pending.popleft()
+            if start < self.imu.total - self.imu.capacity:  # the IMU stream is more than the allowed skew ahead
+                self.num_dropped_frames += 1
+                instrumentation.count('streaming.dropped_frames')
+                continue
+
+            imu = self.imu.get(start, start + params.WINDOW_LENGTH_IMU)
+            frames.append(FeatureFrame(i, end_audio_sec * 1000, example, imu))
+
+        if len(frames) > 0 and self.audio_model is not None and self.motion_model is not None:
+            with instrumentation.timer('streaming.embeddings'):
+                audio_feat = np.array(self.audio_model([np.stack([frame.audio for frame in frames])]))
+                imu_feat = np.array(self.motion_model([np.stack([frame.imu for frame in frames])]))
+            instrumentation.count('streaming.frames', len(frames))
+            for frame, features in zip(frames, np.hstack((imu_feat, audio_feat))):
+                frame.features = features
+
+        return frames
@@ -1,14 +1,17 @@
+import abc
+import copy
 import functools
 import pathlib
 import pickle
-from typing import Union
+from typing import Callable, Dict, Hashable, List, Optional, Union
 
 import numpy as np
 import numpy.typing as npt
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import confusion_matrix
 
-from ..config import datadrive
+from .. import config
+
+NUM_TREES = 100  # the default size of RandomForestClassifier
+TREES_PER_GROUP = 10  # the trees trained on each participant for a TreeBank
 
 
 @functools.lru_cache(maxsize=None)
@@ -17,30 +20,211 @@ def load_pickle(pickle_path: Union[str, pathlib.Path]):
         return pickle.load(pickle_fp)
 
 
-def train_classifier(X: npt.ArrayLike, y: npt.ArrayLike, num_classes: int, model_hash: str = None):
+class ObservationModel(abc.ABC):
+    """
+    The interface of the per-frame observation models used by the tracker: the probability of each step given the
+    features of a frame. A backend that does not implement predict_proba() cannot be instantiated.
+    """
+    classes_: np.ndarray
+
+    @abc.abstractmethod
+    def predict_proba(self, X: npt.ArrayLike) -> np.ndarray:
+        """
+        Score a batch of frames with shape (num_frames, num_features) into probabilities (num_frames, num_classes).
+        """
+
+    def predict_one(self, x: npt.ArrayLike) -> np.ndarray:
+        """
+        Score a single frame with shape (num_features,).
+        """
+        return self.predict_proba(np.asarray(x)[np.newaxis])[0]
+
+    def predict(self, X: npt.ArrayLike) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class SklearnObservationModel(ObservationModel):
+    def __init__(self, estimator):
+        """
+        Any fitted scikit-learn classifier.
+        """
+        self.estimator = estimator
+        self.classes_ = estimator.classes_
+
+    def predict_proba(self, X: npt.ArrayLike) -> np.ndarray:
+        return self.estimator.predict_proba(X)
+
+
+class TreeEnsembleModel(ObservationModel):
+    def __init__(self, forest):
+        """
+        A fitted RandomForestClassifier (or ExtraTreesClassifier) compiled into flat arrays.
+        The probabilities are identical to forest.predict_proba(): the features are compared in float32 as in
+        scikit-learn, and the trees are summed in the same order.
+        It avoids the per-call overhead of scikit-learn, so single frames and small batches (as in streaming) are
+        much faster; for whole recordings, the Cython traversal of scikit-learn is faster.
+
+        Args:
+        * forest: a fitted single-output forest classifier.
+        """
+        self.classes_ = forest.classes_
+        self.num_trees = len(forest.estimators_)
+        num_classes = len(self.classes_)
+
+        children, features, thresholds, values, roots = [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left < 0
+
+            # children[2 * node] is the left child and children[2 * node + 1] the right one
+            children.append(np.stack([tree.children_left, tree.children_right], axis=1).ravel() + offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+
+            value = tree.value[:, 0, :num_classes].astype(np.float64)
+            total = value.sum(axis=1, keepdims=True)
+            if not np.allclose(total[is_leaf], 1.0):  # scikit-learn < 1.4 stores counts and normalizes at prediction
+                total[total == 0.0] = 1.0
+                value = value / total
+            values.append(value)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        self.children = np.concatenate(children).astype(np.intp)
+        self.features = np.concatenate(features).astype(np.intp)
+        self.thresholds = np.concatenate(thresholds)
+        self.values = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.is_leaf = np.concatenate([estimator.tree_.children_left < 0 for estimator in forest.estimators_])
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """
+        Find the leaf of every tree for a batch of frames. All (frame, tree) pairs descend one level at a time, and
+        the pairs that reached a leaf are dropped.
+
+        Returns:
+        * leaves (np.ndarray): the node indices with shape (num_frames, num_trees).
+        """
+        num_frames, num_features = X.shape
+        nodes = np.tile(self.roots, num_frames)
+        feature_offsets = np.repeat(np.arange(num_frames) * num_features, self.num_trees)
+        X = X.ravel()
+
+        active = np.nonzero(~self.is_leaf[nodes])[0]
+        while len(active) > 0:
+            active_nodes = nodes[active]
+            go_right = X[feature_offsets[active] + self.features[active_nodes]] > self.thresholds[active_nodes]
+            active_nodes = self.children[2 * active_nodes + go_right]
+            nodes[active] = active_nodes
+            active = active[~self.is_leaf[active_nodes]]
+        return nodes.reshape(num_frames, self.num_trees)
+
+    def predict_proba(self, X: npt.ArrayLike) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        # summing over the tree axis adds the trees one after another, in the same order as scikit-learn
+        return self.values[self.leaves(X)].sum(axis=1) / self.num_trees
+
+    def predict_one(self, x: npt.ArrayLike) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        nodes = self.roots.copy()
+        active = np.nonzero(~self.is_leaf[nodes])[0]
+        while len(active) > 0:
+            active_nodes = nodes[active]
+            go_right = x[self.features[active_nodes]] > self.thresholds[active_nodes]
+            active_nodes = self.children[2 * active_nodes + go_right]
+            nodes[active] = active_nodes
+            active = active[~self.is_leaf[active_nodes]]
+        return self.values[nodes].sum(axis=0) / self.num_trees
+
+
+# backend name -> function that wraps a fitted scikit-learn classifier into an ObservationModel
+OBSERVATION_BACKENDS: Dict[str, Callable[..., ObservationModel]] = {
+    'sklearn': SklearnObservationModel,
+    'compiled': TreeEnsembleModel,
+}
+
+
+def as_observation_model(clf, backend: str = 'sklearn') -> ObservationModel:
+    """
+    Wrap a fitted classifier into the observation model of the given backend (see OBSERVATION_BACKENDS).
+    """
+    if isinstance(clf, ObservationModel):
+        return clf
+    if backend not in OBSERVATION_BACKENDS:
+        raise ValueError(f'unknown observation backend {backend}; choose from {sorted(OBSERVATION_BACKENDS)}')
+    return OBSERVATION_BACKENDS[backend](clf)
+
+
+def train_classifier(X: npt.ArrayLike, y: npt.ArrayLike, num_classes: int, model_hash: str = None,
+                     backend: str = None, num_trees: int = NUM_TREES, random_state: Optional[int] = None):
+    """
+    Train (or load the cached) random forest on the frames. If a backend is given, the forest is returned as the
+    ObservationModel of that backend; otherwise the scikit-learn classifier itself is returned.
+    The model hash must identify num_trees and random_state as well as the training data.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
     # add dummy data for classes not appeared
     for class_id in range(num_classes):
         if class_id not in y:
             X = np.vstack((X, np.zeros((1, X.shape[1]))))
             y = y + [class_id]
 
-    model_cache_dir = datadrive / 'model_caches'
+    model_cache_dir = config.datadrive / 'model_caches'
     if model_cache_dir.exists() and model_hash is not None:
         model_cache_path = model_cache_dir / f'{model_hash}.pkl'
         if model_cache_path.exists():  # use cached models
-            return load_pickle(model_cache_path)
+            clf = load_pickle(model_cache_path)
+            return clf if backend is None else as_observation_model(clf, backend)
 
-    clf = RandomForestClassifier()
+    clf = RandomForestClassifier(n_estimators=num_trees, random_state=random_state)
     clf.fit(X, y)
 
     if model_cache_dir.exists() and model_hash is not None:
         with open(model_cache_path, 'wb') as model_fp:
             pickle.dump(clf, model_fp)
 
-    return clf
+    return clf if backend is None else as_observation_model(clf, backend)
+
+
+class TreeBank:
+    def __init__(self, groups: Dict[Hashable, object]):
+        """
+        Groups of trees trained once per participant, from which the forest of any set of participants is assembled
+        without training. Each group is a random forest fitted on the frames of one participant only (its bootstrap
+        samples are drawn within that participant), so the forest of a leave-one-out fold is the union of the groups
+        of its training participants, and training the folds costs O(N) instead of O(N^2) forests.
+
+        Args:
+        * groups (Dict[Hashable, forest]): a forest fitted by train_classifier() with the same num_classes for each
+          participant (e.g., its pickle file).
+        """
+        self.groups = groups
+        classes = [group.classes_ for group in groups.values()]
+        if any(not np.array_equal(classes[0], other) for other in classes[1:]):
+            raise ValueError('the groups of a tree bank must be trained on the same classes')
+
+    def assemble(self, keys: List[Hashable], backend: str = None):
+        """
+        Build the forest of the groups of the given participants, in the given order.
+        Its probabilities are the mean over all of its trees, as if it had been trained at once.
+
+        Returns:
+        * clf: a RandomForestClassifier, or the ObservationModel of `backend` if given.
+        """
+        if len(keys) == 0:
+            raise ValueError('a forest needs at least one group')
+        clf = copy.copy(self.groups[keys[0]])  # shares the fitted attributes and the trees of the groups
+        clf.estimators_ = [estimator for key in keys for estimator in self.groups[key].estimators_]
+        clf.n_estimators = len(clf.estimators_)
+        return clf if backend is None else as_observation_model(clf, backend)
 
 
 def obtain_confusion_probabilities(clf, X: npt.ArrayLike, y: npt.ArrayLike, num_classes: int = None):
+    from sklearn.metrics import confusion_matrix
+
     labels = None if num_classes is None else range(num_classes)
     cm = confusion_matrix(y, clf.predict(X), labels=labels).astype(np.float64)
     cm /= cm.sum(axis=1, keepdims=True)
@@ -1,36 +1,46 @@
 import functools
 import hashlib
-import itertools
 import multiprocessing
 import os
 import pathlib
 import pickle
 import warnings
-from typing import Dict, List, Optional, Tuple, Union
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 import numpy.typing as npt
-from sklearn.model_selection import LeaveOneOut, train_test_split
 
+from .. import instrumentation
+from ..preprocessing.segments import Segments, load_segments
 from ..tracker.collections import Graph
+from ..tracker.decimation import DecimatedTracker
 from ..tracker.viterbi import ViterbiTracker
-from .classifier import obtain_confusion_probabilities, train_classifier
+from . import workqueue
+from .classifier import TREES_PER_GROUP, TreeBank, obtain_confusion_probabilities, train_classifier
 
+FramePredictions = List[List[List[int]]]  # per test file, per time frame: the labels of all of the past frames
+DelayedPredictions = Dict[int, List[List[int]]]  # per delay, per test file: the labels committed in real time
 
-def load_imu_and_audio_data(pickle_files: List[Union[str, pathlib.Path]],
-                            steps: List[str]) -> Tuple[npt.NDArray, List[int]]:
+
+def load_imu_and_audio_data(pickle_files: List[Union[str, pathlib.Path]], steps: List[str],
+                            return_segments: bool = False
+                            ) -> Union[Tuple[npt.NDArray, List[int]], Tuple[npt.NDArray, List[int], Segments]]:
     """
     This function loads IMU and audio data from a set of pickle files and converts the labels into numerical values based on their index in a list of steps.
 
     Args:
     * pickle_files (List[Union[str, pathlib.Path]]): a list of paths to the pickle files containing IMU and audio data.
     * steps (List[str]): a list of strings representing the different steps in the procedure.
+    * return_segments (bool): whether to also return the label segments of y.
 
     Returns:
     * X (npt.NDArray): a 2D numpy array containing the frame-based time-series IMU and audio data.
     * y (List[int]): a list of integers representing the index of the step for each time frame.
+    * segments (Segments): the segments of y, with step indices as ids (only if return_segments is True).
     """
     X, y = None, []
+    segments_list = []
 
     for pickle_file in pickle_files:
         with open(pickle_file, 'rb') as fp:
@@ -52,13 +62,59 @@ def load_imu_and_audio_data(pickle_files: List[Union[str, pathlib.Path]],
         labels = list(map(lambda l: steps.index(l), labels))
         y += labels
 
+        if return_segments:
+            segments_list.append(load_segments(data).drop(['Other']).remap(steps))
+
+    if return_segments:
+        return X, y, Segments.concatenate(segments_list)
     return X, y
 
 
+def commit_delayed(frame_steps: Iterable[List[int]], num_frames: int, delays: List[int]) -> Dict[int, List[int]]:
+    """
+    This function emulates real-time detection for several delays in one pass: at each time frame, the label of the
+    frame `delay` frames ago is committed from the current best path, and the rest of the path is committed at the
+    last frame (the same streams as simulate_realtime_prediction() in the notebook).
+
+    Args:
+    * frame_steps (Iterable[List[int]]): the best path at each time frame, covering at least the last max(delays) + 1
+      frames (e.g., the steps returned by ViterbiTracker with history_window=max(delays) + 1).
+    * num_frames (int): the number of time frames.
+    * delays (List[int]): the delays in time frames.
+
+    Returns:
+    * committed (Dict[int, List[int]]): the committed labels for each delay.
+    """
+    committed: Dict[int, List[int]] = {delay: [] for delay in delays}
+    for time, path in enumerate(frame_steps):
+        first_frame = time + 1 - len(path)  # the frame of path[0]
+        for delay in delays:
+            if time + 1 < delay:
+                continue
+            if time == num_frames - 1:
+                committed[delay] += path[len(committed[delay]) - first_frame:]
+            elif delay > 0 and time >= delay:
+                committed[delay].append(path[-delay - 1])
+    return committed
+
+
+def build_tracker(graph: Graph, start_step_indices: Optional[List[int]] = None, history_window: Optional[int] = None,
+                  decimation: int = 1) -> ViterbiTracker:
+    """
+    This function builds the tracker used for evaluation: a ViterbiTracker, or a DecimatedTracker that decodes blocks
+    of `decimation` frames.
+    """
+    if decimation == 1:
+        return ViterbiTracker(graph, start_step_indices=start_step_indices, history_window=history_window)
+    return DecimatedTracker(graph, decimation, start_step_indices=start_step_indices, history_window=history_window)
+
+
 def obtain_predictions(train_files: List[Union[str, pathlib.Path]], val_files: List[Union[str, pathlib.Path]],
                        test_files: List[Union[str, pathlib.Path]], graph: Graph, steps: List[str],
-                       start_step_indices: Optional[List[int]] = None, oracle_step_indices: Optional[List[int]] = None
-                       ) -> Tuple[List[List[List[int]]], List[List[List[int]]], List[List[List[int]]]]:
+                       start_step_indices: Optional[List[int]] = None, oracle_step_indices: Optional[List[int]] = None,
+                       delays: Optional[List[int]] = None, decimation: int = 1, tree_bank: Optional[TreeBank] = None
+                       ) -> Union[Tuple[FramePredictions, FramePredictions, FramePredictions],
+                                  Tuple[DelayedPredictions, DelayedPredictions, DelayedPredictions]]:
     """
     This function obtains predictions for a set of test files given a set of training files and validation files, using the Viterbi algorithm to track predicted steps.
 
@@ -70,46 +126,61 @@ def obtain_predictions(train_files: List[Union[str, pathlib.Path]], val_files: L
     * steps (List[str]): a list of strings representing the steps in the process.
     * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
     * oracle_step_indices (Optional[List[int]]): a list of integers representing the indices of the steps we can provide oracle information.
+    * delays (Optional[List[int]]): if given, the real-time delays to evaluate in one decoding pass (see
+      commit_delayed()).
+    * decimation (int): the number of frames pooled into each decoded block (see tracker/decimation.py).
+    * tree_bank (Optional[TreeBank]): if given, the classifier is assembled from the groups of the training files
+      (see train_tree_bank()) instead of being trained.
 
     Returns:
     * y_true_all (List[List[List[int]]]): a list of true labels, calculated for all of the past frames at each time frame of each test file.
     * y_pred_raw_all (List[List[List[int]]]): a list of predicted labels (without Viterbi correction) labels, calculated for all of the past frames at each time frame of each test file.
     * y_pred_viterbi_all (List[List[List[int]]]): a list of predicted labels (with Viterbi correction labels, calculated for all of the past frames at each time frame of each test file.
+    If delays are given, each of them is instead a dict from the delay to the committed labels of each test file.
     """
     warnings.filterwarnings('ignore')
 
-    X_train, y_train = load_imu_and_audio_data(train_files, steps)
-    train_hash = hashlib.md5(','.join(sorted(map(str, train_files))).encode('utf-8')).hexdigest()
-    clf = train_classifier(X_train, y_train, num_classes=len(steps), model_hash=train_hash)
-
-    X_val, y_val = load_imu_and_audio_data(val_files, steps)
-    cm_val = obtain_confusion_probabilities(clf, X_val, y_val, num_classes=len(steps))
-
-    viterbi = ViterbiTracker(graph, start_step_indices=start_step_indices)
+    if tree_bank is not None:
+        with instrumentation.timer('evaluation.assemble_classifier'):
+            clf = tree_bank.assemble(list(map(str, train_files)))
+    else:
+        with instrumentation.timer('evaluation.load_data'):
+            X_train, y_train = load_imu_and_audio_data(train_files, steps)
+        train_hash = hashlib.md5(','.join(sorted(map(str, train_files))).encode('utf-8')).hexdigest()
+        with instrumentation.timer('evaluation.train_classifier'):
+            clf = train_classifier(X_train, y_train, num_classes=len(steps), model_hash=train_hash)
+
+    with instrumentation.timer('evaluation.load_data'):
+        X_val, y_val = load_imu_and_audio_data(val_files, steps)
+    with instrumentation.timer('evaluation.confusion_matrix'):
+        cm_val = obtain_confusion_probabilities(clf, X_val, y_val, num_classes=len(steps))
+
+    if delays is not None:
+        return obtain_delayed_predictions(clf, cm_val, test_files, graph, steps, delays, start_step_indices,
+                                          oracle_step_indices, decimation)
+
+    viterbi = build_tracker(graph, start_step_indices, decimation=decimation)
     y_true_all, y_pred_raw_all, y_pred_viterbi_all = [], [], []
 
     for test_file in test_files:  # predict per data
-        X, y = load_imu_and_audio_data([test_file], steps)
+        with instrumentation.timer('evaluation.load_data'):
+            X, y, segments = load_imu_and_audio_data([test_file], steps, return_segments=True)
 
-        inputs = clf.predict_proba(X)  # times x labels
+        with instrumentation.timer('evaluation.predict_proba'):
+            inputs = clf.predict_proba(X)  # times x labels
         pred_raw = inputs.argmax(axis=1)
 
-        oracle: Dict[int, List[int]] = {}  # {step_index: [transition_time, ...]}
-        if oracle_step_indices is not None:
-            for index in oracle_step_indices:
-                acc_time = 0
-                for key, group in itertools.groupby(y):
-                    if key == index:
-                        oracle[index] = oracle.get(index, []) + [acc_time]
-                    acc_time += len(list(group))
+        oracle = get_oracle(segments, oracle_step_indices)
 
         y_true, y_pred_raw, y_pred_viterbi = [], [], []
-        for pred_prob, pred_steps in viterbi.predict(inputs.T, cm_val, oracle=oracle):
-            pred_steps_with_others = pred_steps
+        with instrumentation.timer('evaluation.track'):
+            for pred_prob, pred_steps in viterbi.predict(inputs.T, cm_val, oracle=oracle):
+                pred_steps_with_others = pred_steps
 
-            y_true.append(y[:len(pred_steps_with_others)])
-            y_pred_raw.append(list(pred_raw[:len(pred_steps_with_others)]))
-            y_pred_viterbi.append(list(pred_steps_with_others))
+                y_true.append(y[:len(pred_steps_with_others)])
+                y_pred_raw.append(list(pred_raw[:len(pred_steps_with_others)]))
+                y_pred_viterbi.append(list(pred_steps_with_others))
+        instrumentation.count('evaluation.frames', len(y))
 
         y_true_all.append(y_true)
         y_pred_raw_all.append(y_pred_raw)
@@ -118,9 +189,114 @@ def obtain_predictions(train_files: List[Union[str, pathlib.Path]], val_files: L
     return y_true_all, y_pred_raw_all, y_pred_viterbi_all
 
 
+def get_oracle(segments: Segments, oracle_step_indices: Optional[List[int]]) -> Dict[int, List[int]]:
+    """
+    This function collects the transition time frames of the oracle steps from the label segments of a test file.
+    """
+    oracle: Dict[int, List[int]] = {}  # {step_index: [transition_time, ...]}
+    if oracle_step_indices is not None:
+        transition_times = segments.transition_times()
+        for index in oracle_step_indices:
+            if index in transition_times:
+                oracle[index] = transition_times[index]
+    return oracle
+
+
+def obtain_delayed_predictions(clf, cm_val: List[List[float]], test_files: List[Union[str, pathlib.Path]],
+                               graph: Graph, steps: List[str], delays: List[int],
+                               start_step_indices: Optional[List[int]] = None,
+                               oracle_step_indices: Optional[List[int]] = None, decimation: int = 1
+                               ) -> Tuple[DelayedPredictions, DelayedPredictions, DelayedPredictions]:
+    """
+    This function decodes each test file once and commits the labels for every delay from the same backpointer
+    history, keeping only the last max(delays) + 1 frames of the best path.
+
+    Returns:
+    * y_true_all, y_pred_raw_all, y_pred_viterbi_all (Dict[int, List[List[int]]]): the committed labels for each delay
+      and test file.
+    """
+    viterbi = build_tracker(graph, start_step_indices, history_window=max(delays) + 1, decimation=decimation)
+    y_true_all: DelayedPredictions = {delay: [] for delay in delays}
+    y_pred_raw_all: DelayedPredictions = {delay: [] for delay in delays}
+    y_pred_viterbi_all: DelayedPredictions = {delay: [] for delay in delays}
+
+    for test_file in test_files:  # predict per data
+        with instrumentation.timer('evaluation.load_data'):
+            X, y, segments = load_imu_and_audio_data([test_file], steps, return_segments=True)
+
+        with instrumentation.timer('evaluation.predict_proba'):
+            inputs = clf.predict_proba(X)  # times x labels
+        pred_raw = inputs.argmax(axis=1)
+        oracle = get_oracle(segments, oracle_step_indices)
+
+        frame_steps = (pred_steps for _, pred_steps in viterbi.predict(inputs.T, cm_val, oracle=oracle))
+        with instrumentation.timer('evaluation.track'):
+            y_pred_viterbi = commit_delayed(frame_steps, len(y), delays)
+        instrumentation.count('evaluation.frames', len(y))
+
+        for delay in delays:
+            # the true and raw labels of a frame never change, so only the lengths of the committed streams matter
+            num_committed = len(y_pred_viterbi[delay])
+            y_true_all[delay].append(list(y[:num_committed]))
+            y_pred_raw_all[delay].append(list(pred_raw[:num_committed]))
+            y_pred_viterbi_all[delay].append(y_pred_viterbi[delay])
+
+    return y_true_all, y_pred_raw_all, y_pred_viterbi_all
+
+
+def train_tree_group(pickle_file: Union[str, pathlib.Path], steps: List[str], num_trees: int = TREES_PER_GROUP):
+    """
+    This function trains (or loads the cached) group of trees of one participant for a TreeBank. The seed of the group
+    only depends on the file name, so the group is the same whichever cohort it is part of.
+    """
+    X, y = load_imu_and_audio_data([pickle_file], steps)
+    name = os.path.basename(pickle_file)
+    model_hash = hashlib.md5(f'tree_bank,{pickle_file},{num_trees}'.encode('utf-8')).hexdigest()
+    return train_classifier(X, y, num_classes=len(steps), model_hash=model_hash, num_trees=num_trees,
+                            random_state=zlib.crc32(name.encode('utf-8')))
+
+
+def train_tree_bank(pickle_files: List[Union[str, pathlib.Path]], steps: List[str],
+                    num_trees: int = TREES_PER_GROUP, num_processes: int = 12) -> TreeBank:
+    """
+    This function trains the groups of trees of every participant once, so that the classifier of each fold of
+    perform_loo() is assembled from them.
+
+    Args:
+    * pickle_files (List[Union[str, pathlib.Path]]): a list of the paths to the pickle files, one per participant.
+    * steps (List[str]): a list of strings representing the steps in the process.
+    * num_trees (int): the number of trees trained on each participant.
+    * num_processes (int): the number of processes to use for multiprocessing.
+
+    Returns:
+    * tree_bank (TreeBank): the groups of trees, keyed by the paths of the pickle files as strings.
+    """
+    with multiprocessing.Pool(num_processes) as pool:
+        groups = pool.map(functools.partial(train_tree_group, steps=steps, num_trees=num_trees), pickle_files)
+    return TreeBank({str(pickle_file): group for pickle_file, group in zip(pickle_files, groups)})
+
+
+def profile_fold(prediction_func, train_files: List[Union[str, pathlib.Path]],
+                 val_files: List[Union[str, pathlib.Path]], test_files: List[Union[str, pathlib.Path]]) -> Tuple:
+    """
+    This function runs one fold of perform_loo() with its own recorder, since the recorder of the parent process is not
+    shared with the workers.
+
+    Returns:
+    * result (Tuple): the return value of `prediction_func`.
+    * summary (Dict): the instrumentation summary of the fold (see Recorder.summary()).
+    """
+    with instrumentation.recording() as recorder:
+        result = prediction_func(train_files, val_files, test_files)
+    return result, recorder.summary()
+
+
 def perform_loo(graph: Graph, pickle_files: List[Union[str, pathlib.Path]], steps: List[str],
                 start_step_indices: Optional[List[int]] = None, oracle_step_indices: Optional[List[int]] = None,
-                num_processes: int = 12) -> Tuple[List[List[List[int]]], List[List[List[int]]], List[List[List[int]]]]:
+                num_processes: int = 12, delays: Optional[List[int]] = None, decimation: int = 1,
+                trees_per_participant: Optional[int] = None, queue_path: Optional[Union[str, pathlib.Path]] = None
+                ) -> Union[Tuple[FramePredictions, FramePredictions, FramePredictions],
+                           Tuple[DelayedPredictions, DelayedPredictions, DelayedPredictions]]:
     """
     This function performs a leave-one-out evaluation of with a provided set of input data.
 
@@ -131,16 +307,37 @@ def perform_loo(graph: Graph, pickle_files: List[Union[str, pathlib.Path]], step
     * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
     * oracle_step_indices (Optional[List[int]]): a list of integers representing the indices of the steps we can provide oracle information.
     * num_processes (int): the number of processes to use for multiprocessing.
+    * delays (Optional[List[int]]): if given, the real-time delays to evaluate in one decoding pass (see
+      commit_delayed()).
+    * decimation (int): the number of frames pooled into each decoded block (see tracker/decimation.py).
+    * trees_per_participant (Optional[int]): if given, a group of this many trees is trained once per participant
+      (see train_tree_bank()), and the classifier of each fold is assembled from the groups of its training
+      participants instead of being trained from scratch.
+    * queue_path (Optional[Union[str, pathlib.Path]]): if given, the folds are submitted to this work queue (see
+      scripts/workqueue.py) and run by its workers on any node, in addition to `num_processes` local ones.
 
     Returns:
     * y_true_all (List[List[List[int]]]): a list of true labels, calculated for all of the past frames at each time frame of each test file.
     * y_pred_raw_all (List[List[List[int]]]): a list of predicted labels (without Viterbi correction) labels, calculated for all of the past frames at each time frame of each test file.
     * y_pred_viterbi_all (List[List[List[int]]]): a list of predicted labels (with Viterbi correction labels, calculated for all of the past frames at each time frame of each test file.
+    If delays are given, each of them is instead a dict from the delay to the committed labels of each test file.
+    When instrumentation is enabled, the summary of each fold is added to the recorder (see Recorder.add_fold()).
     """
-    y_true_all, y_pred_raw_all, y_pred_viterbi_all = [], [], []
+    from sklearn.model_selection import LeaveOneOut, train_test_split
+
+    if delays is None:
+        y_true_all, y_pred_raw_all, y_pred_viterbi_all = [], [], []
+    else:
+        y_true_all, y_pred_raw_all, y_pred_viterbi_all = [{delay: [] for delay in delays} for _ in range(3)]
+
+    tree_bank = None
+    if trees_per_participant is not None:
+        with instrumentation.timer('evaluation.train_tree_bank'):
+            tree_bank = train_tree_bank(pickle_files, steps, trees_per_participant, max(num_processes, 1))
 
     prediction_func = functools.partial(obtain_predictions, graph=graph, steps=steps,
-                                        start_step_indices=start_step_indices, oracle_step_indices=oracle_step_indices)
+                                        start_step_indices=start_step_indices, oracle_step_indices=oracle_step_indices,
+                                        delays=delays, decimation=decimation, tree_bank=tree_bank)
     args = []
 
     shuffler = np.random.RandomState(0)
@@ -157,10 +354,31 @@ def perform_loo(graph: Graph, pickle_files: List[Union[str, pathlib.Path]], step
         if len(test_files) > 0:
             args.append((train_files, val_files, test_files))
 
-    pool = multiprocessing.Pool(num_processes)
-    for y_true, y_pred_raw, y_pred_viterbi in pool.starmap(prediction_func, args):
-        y_true_all += y_true
-        y_pred_raw_all += y_pred_raw
-        y_pred_viterbi_all += y_pred_viterbi
+    recorder = instrumentation.recorder
+    fold_func = prediction_func if recorder is None else functools.partial(profile_fold, prediction_func)
+    if queue_path is not None:
+        fold_results = workqueue.run_tasks(queue_path, fold_func, args, num_processes)
+    else:
+        fold_results = multiprocessing.Pool(num_processes).starmap(fold_func, args)
+
+    if recorder is None:
+        results = fold_results
+    else:
+        results = []
+        for (train_files, val_files, test_files), (result, summary) in zip(args, fold_results):
+            recorder.add_fold({'test_files': [str(path) for path in test_files], 'num_train_files': len(train_files),
+                               'num_val_files': len(val_files)}, summary)
+            results.append(result)
+
+    for y_true, y_pred_raw, y_pred_viterbi in results:
+        if delays is None:
+            y_true_all += y_true
+            y_pred_raw_all += y_pred_raw
+            y_pred_viterbi_all += y_pred_viterbi
+        else:
+            for delay in delays:
+                y_true_all[delay] += y_true[delay]
+                y_pred_raw_all[delay] += y_pred_raw[delay]
+                y_pred_viterbi_all[delay] += y_pred_viterbi[delay]
 
     return y_true_all, y_pred_raw_all, y_pred_viterbi_all
@@ -1,11 +1,143 @@
-import itertools
 import pathlib
 import pickle
-from typing import List, Union
+from typing import List, Optional, Set, Union
 
 import numpy as np
 
+from ..preprocessing.segments import Segments, load_segments
 from ..tracker.collections import Graph, Step
+from ..tracker.tables import TransitionTables
+
+
+class GraphBuilder:
+    def __init__(self, steps: List[str]):
+        """
+        Accumulates the statistics of build_graph() one session at a time: an integer matrix of transition counts,
+        and the running mean and variance of the duration of each step (Welford's algorithm).
+
+        Args:
+        * steps (List[str]): a list of strings representing the steps in the process.
+        """
+        self.steps = steps
+        self.step_ids = {step: i for i, step in enumerate(steps)}
+
+        self.transition_counts = np.zeros((len(steps), len(steps)), dtype=np.int64)
+        self.num_runs = np.zeros(len(steps), dtype=np.int64)
+        self.mean_times = np.zeros(len(steps))
+        self.m2_times = np.zeros(len(steps))  # sum of squared differences from the mean
+
+        self.changed_step_indices: Set[int] = set()  # the steps whose statistics changed since update_tables()
+
+    def add_labels(self, labels: List[str]) -> Set[int]:
+        """
+        This method absorbs the frame labels of one session in O(len(labels)).
+
+        Args:
+        * labels (List[str]): the label of each frame of the session.
+
+        Returns:
+        * step_indices (Set[int]): the indices of the steps whose statistics changed.
+        """
+        return self.add_segments(Segments.from_labels(labels, self.steps))
+
+    def add_segments(self, segments: Segments) -> Set[int]:
+        """
+        This method absorbs the label segments of one session in O(number of segments).
+
+        Args:
+        * segments (Segments): the label segments of the session.
+
+        Returns:
+        * step_indices (Set[int]): the indices of the steps whose statistics changed.
+        """
+        segments = segments.remap(self.steps)
+        run_step_ids = np.concatenate([[self.step_ids['begin']], segments.ids, [self.step_ids['end']]])
+        run_lengths = np.concatenate([[1], segments.lengths, [1]])
+        return self.add_runs(run_step_ids, run_lengths)
+
+    def add_runs(self, run_step_ids: np.ndarray, run_lengths: np.ndarray) -> Set[int]:
+        """
+        This method absorbs the consecutive runs of one session, including its 'begin' and 'end' runs.
+
+        Args:
+        * run_step_ids (np.ndarray): the step index of each run.
+        * run_lengths (np.ndarray): the number of frames of each run.
+
+        Returns:
+        * step_indices (Set[int]): the indices of the steps whose statistics changed.
+        """
+        run_step_ids = np.asarray(run_step_ids, dtype=np.int64)
+        run_lengths = np.asarray(run_lengths, dtype=np.float64)
+        np.add.at(self.transition_counts, (run_step_ids[:-1], run_step_ids[1:]), 1)
+
+        # merge the mean and variance of the session into the running ones (the parallel form of Welford's algorithm)
+        num_steps = len(self.steps)
+        num_runs = np.bincount(run_step_ids, minlength=num_steps)
+        observed = num_runs > 0
+        with np.errstate(invalid='ignore'):
+            mean_times = np.bincount(run_step_ids, weights=run_lengths, minlength=num_steps) / num_runs
+        m2_times = np.bincount(run_step_ids, weights=(run_lengths - mean_times[run_step_ids]) ** 2, minlength=num_steps)
+
+        total_runs = self.num_runs + num_runs
+        delta = np.where(observed, mean_times - self.mean_times, 0.0)
+        with np.errstate(invalid='ignore'):
+            self.mean_times = np.where(observed, self.mean_times + delta * num_runs / total_runs, self.mean_times)
+            self.m2_times = np.where(
+                observed, self.m2_times + m2_times + delta ** 2 * self.num_runs * num_runs / total_runs, self.m2_times)
+        self.num_runs = total_runs
+
+        step_indices = set(np.nonzero(observed)[0].tolist())
+        self.changed_step_indices |= step_indices
+        return step_indices
+
+    def add_pickle(self, pickle_file: Union[str, pathlib.Path]) -> Set[int]:
+        """
+        This method absorbs the session stored in a pickle file (see add_segments()).
+        """
+        with open(pickle_file, 'rb') as pickle_fp:
+            pickle_data = pickle.load(pickle_fp)
+        return self.add_segments(load_segments(pickle_data))
+
+    def build(self) -> Graph:
+        """
+        This method builds a graph object from the statistics accumulated so far.
+
+        Returns:
+        * graph (Graph): a graph object with a list of step objects and a dictionary containing transition
+          probabilities.
+        """
+        with np.errstate(invalid='ignore'):
+            mean_times = np.where(self.num_runs > 0, self.mean_times, np.nan)
+            std_times = np.sqrt(np.where(self.num_runs > 0, self.m2_times / self.num_runs, np.nan))
+
+        step_list = []
+        for i in range(len(self.steps)):
+            step_list.append(Step(i, mean_time=mean_times[i], std_time=std_times[i]))
+
+        edge_dict = {}
+        for s in step_list:
+            edge_dict[s] = {}
+            total = np.sum(self.transition_counts[s.index])
+            for next_step_index in np.nonzero(self.transition_counts[s.index])[0]:
+                edge_dict[s][step_list[next_step_index]] = self.transition_counts[s.index][next_step_index] / total
+
+        return Graph(steps=step_list, edges=edge_dict)
+
+    def update_tables(self, tables: TransitionTables, graph: Optional[Graph] = None) -> Graph:
+        """
+        This method rebuilds only the rows of the tracker tables whose steps changed since the last call.
+
+        Args:
+        * tables (TransitionTables): the tables compiled from a graph of this builder.
+        * graph (Optional[Graph]): the graph built from the current statistics; built here if None.
+
+        Returns:
+        * graph (Graph): the graph matching the updated tables.
+        """
+        graph = self.build() if graph is None else graph
+        tables.update_steps(graph, sorted(self.changed_step_indices))
+        self.changed_step_indices = set()
+        return graph
 
 
 def build_graph(pickle_files: List[Union[str, pathlib.Path]], steps: List[str]) -> Graph:
@@ -20,32 +152,7 @@ def build_graph(pickle_files: List[Union[str, pathlib.Path]], steps: List[str])
     Returns:
     * graph (Graph): a graph object with a list of step objects and a dictionary containing transition probabilities.
     """
-    transition_graph = np.zeros((len(steps), len(steps)))
-    time_dict = {k: [] for k in steps}
-
+    builder = GraphBuilder(steps)
     for pickle_file in pickle_files:
-        with open(pickle_file, 'rb') as pickle_fp:
-            pickle_data = pickle.load(pickle_fp)
-
-        pickle_data['labels'] = ['begin'] + pickle_data['labels'] + ['end']
-        prev_step = None
-
-        for curr_step, group in itertools.groupby(pickle_data['labels']):
-            if prev_step is not None:
-                transition_graph[steps.index(prev_step)][steps.index(curr_step)] += 1
-
-            time_dict[curr_step].append(len(list(group)))
-            prev_step = curr_step
-
-    step_list = []
-    for i, k in enumerate(steps):
-        step_list.append(Step(i, mean_time=np.mean(time_dict[k]), std_time=np.std(time_dict[k])))
-
-    edge_dict = {}
-    for s in step_list:
-        edge_dict[s] = {}
-        total = np.sum(transition_graph[s.index])
-        for next_step_index in np.nonzero(transition_graph[s.index])[0]:
-            edge_dict[s][step_list[next_step_index]] = transition_graph[s.index][next_step_index] / total
-
-    return Graph(steps=step_list, edges=edge_dict)
+        builder.add_pickle(pickle_file)
+    return builder.build()
@@ -1,13 +1,12 @@
-from typing import List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-import matplotlib.axes
-from sklearn.metrics import (
-    ConfusionMatrixDisplay, accuracy_score, confusion_matrix, f1_score, precision_score, recall_score,
-)
+if TYPE_CHECKING:
+    import matplotlib.axes
 
 
 def frame_level_metrics(y_true_series: List[int], y_pred_series: List[int], num_classes: int,
-                        ax: Optional[matplotlib.axes.Axes] = None, verbose: bool = False) -> Tuple[float, float]:
+                        ax: Optional['matplotlib.axes.Axes'] = None,
+                        verbose: bool = False) -> Tuple[float, float]:
     """
     This function computes time frame-level metrics for a given set of true and predicted labels.
     The metrics include accuracy, recall, precision, and F1 score for all classes combined, which are returned as a tuple.
@@ -24,6 +23,10 @@ def frame_level_metrics(y_true_series: List[int], y_pred_series: List[int], num_
     * all_accuracy (float): a float value of the overall accuracy score.
     * all_f1 (float): a float value of the overall macro F1 score.
     """
+    from sklearn.metrics import (
+        ConfusionMatrixDisplay, accuracy_score, confusion_matrix, f1_score, precision_score, recall_score,
+    )
+
     y_true_all, y_pred_all = [], []
 
     for y_true, y_pred in zip(y_true_series, y_pred_series):
@@ -57,3 +60,21 @@ def frame_level_metrics(y_true_series: List[int], y_pred_series: List[int], num_
         print('Overall macro F1:', all_f1)
 
     return all_accuracy, all_f1
+
+
+def delayed_metrics(y_true_all: Dict[int, List[List[int]]], y_pred_all: Dict[int, List[List[int]]],
+                    num_classes: int) -> Dict[int, Tuple[float, float]]:
+    """
+    This function computes the frame-level metrics for each real-time delay, e.g., the output of
+    perform_loo(..., delays=[...]), to draw the trade-off between latency and accuracy.
+
+    Args:
+    * y_true_all (Dict[int, List[List[int]]]): the true labels of each test file for each delay.
+    * y_pred_all (Dict[int, List[List[int]]]): the predicted labels of each test file for each delay.
+    * num_classes (int): the number of classes, i.e., the number of steps in a procedure.
+
+    Returns:
+    * metrics (Dict[int, Tuple[float, float]]): the overall accuracy and macro F1 score for each delay.
+    """
+    return {delay: frame_level_metrics(y_true_all[delay], y_pred_all[delay], num_classes=num_classes)
+            for delay in y_true_all}
@@ -0,0 +1,380 @@
+"""
+A work queue in a SQLite file, to spread the folds of perform_loo() (or any picklable tasks) over several machines.
+
+Usage:
+    $ python -m prism_tracker.scripts.workqueue /shared/sweep.sqlite            # on every node, as often as wanted
+    $ python -m prism_tracker.scripts.workqueue /shared/sweep.sqlite --status
+
+The queue lives in a file on a directory shared by every node (the file system must support POSIX locks, as most NFS
+setups do). The submitter adds tasks with submit() (e.g., perform_loo(..., queue_path=...)), and any number of workers
+on any node claim them. A claim is a transaction, so a task is only ever running on one worker at a time; the worker
+renews its lease while the task runs, and the task of a worker that crashed is claimed again once its lease expires.
+The function of the tasks is pickled once next to the queue (in `<queue>.blobs/`, named by the hash of its content),
+and each task only stores its hash and its own arguments, so objects shared by every task (e.g., the graph and the
+tree bank of perform_loo()) are written once and unpickled once per worker.
+Results are pickled next to the queue (in `<queue>.results/`) with an atomic rename, and only the first result of a
+task is kept, so a task that ran twice (e.g., a worker that was only slow) is harmless. Leases use wall-clock time,
+so the clocks of the nodes must be synchronized to well within the lease.
+"""
+import argparse
+import contextlib
+import functools
+import hashlib
+import multiprocessing
+import os
+import pathlib
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+LEASE_SECONDS = 300.0
+MAX_ATTEMPTS = 3  # the claims of a task before it is marked as failed
+POLL_SECONDS = 1.0
+BLOB_CACHE_SIZE = 4  # the functions kept unpickled by each worker
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, running, done or failed
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    submitted REAL NOT NULL,
+    finished REAL
+)
+"""
+
+Task = Tuple[Callable, tuple]  # a function and its positional arguments
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def write_atomically(path: pathlib.Path, data: bytes):
+    temporary = path.with_name(f'{path.name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}')
+    with open(temporary, 'wb') as fp:
+        fp.write(data)
+    os.replace(temporary, path)  # atomic: readers see no file or a whole one
+
+
+@functools.lru_cache(maxsize=BLOB_CACHE_SIZE)
+def load_blob(path: str) -> Any:
+    """
+    Unpickle a blob of a queue. Blobs are named by the hash of their content and never change, so they are cached.
+    """
+    with open(path, 'rb') as fp:
+        return pickle.load(fp)
+
+
+class WorkQueue:
+    def __init__(self, path: Union[str, pathlib.Path], lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        """
+        Opens (or creates) the queue file. Every call opens its own connection, so an instance can be used from
+        threads and forked processes.
+
+        Args:
+        * path (Union[str, pathlib.Path]): the SQLite file, on a directory shared by every node.
+        * lease_seconds (float): how long a claimed task stays with its worker without a heartbeat.
+        * max_attempts (int): the claims of a task before it is marked as failed.
+        """
+        self.path = pathlib.Path(path)
+        self.results_dir = self.path.with_name(self.path.name + '.results')
+        self.blobs_dir = self.path.with_name(self.path.name + '.blobs')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        with self.__transaction__() as connection:
+            connection.execute(SCHEMA)
+
+    @contextlib.contextmanager
+    def __transaction__(self) -> Iterator[sqlite3.Connection]:
+        """
+        A connection in a write transaction: BEGIN IMMEDIATE takes the lock of the file before anything is read, so
+        two workers never choose the same task.
+        """
+        connection = sqlite3.connect(str(self.path), timeout=60.0, isolation_level=None)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def __result_path__(self, task_id: str) -> pathlib.Path:
+        return self.results_dir / f'{task_id}.pkl'
+
+    def store(self, obj: Any) -> str:
+        """
+        Pickle an object into the blobs of the queue, unless a blob with the same content exists.
+
+        Returns:
+        * key (str): the hash of the pickled object, to load it with load().
+        """
+        data = pickle.dumps(obj, protocol=4)
+        key = hashlib.sha1(data).hexdigest()
+        path = self.blobs_dir / f'{key}.pkl'
+        if not path.exists():
+            write_atomically(path, data)
+        return key
+
+    def load(self, key: str) -> Any:
+        return load_blob(str(self.blobs_dir / f'{key}.pkl'))
+
+    def submit(self, tasks: List[Task]) -> List[str]:
+        """
+        Add tasks to the queue. Each distinct function is stored once as a blob (see store()), and a task row only
+        holds its hash and the arguments. The id of a task is the hash of both, so a task that is already in the queue
+        (e.g., after restarting a sweep) is kept as it is, with its result if any.
+
+        Returns:
+        * task_ids (List[str]): the id of each task.
+        """
+        ids, rows, keys = [], [], {}
+        now = time.time()
+        for func, args in tasks:
+            if id(func) not in keys:
+                keys[id(func)] = (func, self.store(func))  # keeps func alive, so its id is not reused
+            payload = pickle.dumps((keys[id(func)][1], args), protocol=4)
+            ids.append(hashlib.sha1(payload).hexdigest())
+            rows.append((ids[-1], payload, now))
+        with self.__transaction__() as connection:
+            connection.executemany('INSERT OR IGNORE INTO tasks (id, payload, submitted) VALUES (?, ?, ?)', rows)
+        return ids
+
+    def claim(self, worker: str) -> Optional[Tuple[str, Task]]:
+        """
+        Claim the oldest pending task, or a running task whose lease expired. Tasks whose lease expired after
+        max_attempts claims are marked as failed instead.
+
+        Returns:
+        * task (Optional[Tuple[str, Task]]): the id and the task, or None if no task can be claimed now.
+        """
+        with self.__transaction__() as connection:
+            now = time.time()
+            connection.execute("UPDATE tasks SET status = 'failed', error = 'the lease expired', finished = ? "
+                               "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                               (now, now, self.max_attempts))
+            row = connection.execute("SELECT id, payload FROM tasks "
+                                     "WHERE status = 'pending' OR (status = 'running' AND lease_until < ?) "
+                                     "ORDER BY submitted, id LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?", (worker, now + self.lease_seconds, row[0]))
+        if row is None:
+            return None
+        key, args = pickle.loads(row[1])
+        return row[0], (self.load(key), args)
+
+    def heartbeat(self, task_id: str, worker: str) -> bool:
+        """
+        Renew the lease of a running task.
+
+        Returns:
+        * owned (bool): whether the worker still holds the task; if not, its lease expired and it may be running
+          elsewhere.
+        """
+        with self.__transaction__() as connection:
+            cursor = connection.execute("UPDATE tasks SET lease_until = ? "
+                                        "WHERE id = ? AND worker = ? AND status = 'running'",
+                                        (time.time() + self.lease_seconds, task_id, worker))
+        return cursor.rowcount > 0
+
+    def complete(self, task_id: str, result: Any) -> bool:
+        """
+        Store the result of a task, unless it already has one. Any worker that ran the task may complete it, even
+        after losing its lease, since every run of a task gives the same result.
+
+        Returns:
+        * stored (bool): whether this result was kept.
+        """
+        with self.__transaction__() as connection:
+            status, = connection.execute('SELECT status FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        if status == 'done':
+            return False
+
+        write_atomically(self.__result_path__(task_id), pickle.dumps(result, protocol=4))
+
+        with self.__transaction__() as connection:
+            cursor = connection.execute("UPDATE tasks SET status = 'done', error = NULL, finished = ? "
+                                        "WHERE id = ? AND status != 'done'", (time.time(), task_id))
+        return cursor.rowcount > 0
+
+    def fail(self, task_id: str, worker: str, error: str):
+        """
+        Give back a task whose function raised. It is claimed again until it has been tried max_attempts times.
+        """
+        with self.__transaction__() as connection:
+            connection.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                               "error = ?, worker = NULL, lease_until = NULL, finished = ? "
+                               "WHERE id = ? AND worker = ? AND status = 'running'",
+                               (self.max_attempts, error, time.time(), task_id, worker))
+
+    def retry_failed(self):
+        """
+        Put the failed tasks back in the queue, e.g., after fixing what made them fail.
+        """
+        with self.__transaction__() as connection:
+            connection.execute("UPDATE tasks SET status = 'pending', attempts = 0, worker = NULL, lease_until = NULL "
+                               "WHERE status = 'failed'")
+
+    def status(self) -> Dict[str, int]:
+        """
+        Returns:
+        * counts (Dict[str, int]): the number of tasks in each status.
+        """
+        with self.__transaction__() as connection:
+            return dict(connection.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def num_unfinished(self, task_ids: Optional[List[str]] = None) -> int:
+        """
+        The number of the given tasks (or of all tasks) that are still pending or running.
+        """
+        with self.__transaction__() as connection:
+            if task_ids is None:
+                return connection.execute("SELECT COUNT(*) FROM tasks "
+                                          "WHERE status IN ('pending', 'running')").fetchone()[0]
+            statuses = dict(connection.execute(f"SELECT id, status FROM tasks WHERE id IN "
+                                               f"({', '.join('?' * len(task_ids))})", task_ids).fetchall())
+        return sum(statuses.get(task_id) in ('pending', 'running') for task_id in task_ids)
+
+    def results(self, task_ids: List[str], timeout: Optional[float] = None,
+                poll_seconds: float = POLL_SECONDS) -> List[Any]:
+        """
+        Wait for the results of the given tasks.
+
+        Raises:
+        * RuntimeError: if a task failed.
+        * TimeoutError: if the tasks did not finish within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.num_unfinished(task_ids) > 0:
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f'{self.num_unfinished(task_ids)} tasks of {self.path} did not finish in time')
+            time.sleep(poll_seconds)
+
+        with self.__transaction__() as connection:
+            failed = connection.execute(f"SELECT id, error FROM tasks WHERE status = 'failed' AND id IN "
+                                        f"({', '.join('?' * len(task_ids))})", task_ids).fetchall()
+        if len(failed) > 0:
+            raise RuntimeError(f'{len(failed)} tasks of {self.path} failed; the first one with:\n{failed[0][1]}')
+
+        results = []
+        for task_id in task_ids:
+            with open(self.__result_path__(task_id), 'rb') as fp:
+                results.append(pickle.load(fp))
+        return results
+
+
+def run_task(queue: WorkQueue, worker: str, task_id: str, task: Task):
+    """
+    Run a claimed task while renewing its lease from a thread, then store its result (or give it back on error).
+    """
+    stop = threading.Event()
+
+    def renew_lease():
+        while not stop.wait(queue.lease_seconds / 3):
+            if not queue.heartbeat(task_id, worker):
+                return
+
+    renewing = threading.Thread(target=renew_lease, daemon=True)
+    renewing.start()
+    try:
+        func, args = task
+        result = func(*args)
+    except Exception:
+        queue.fail(task_id, worker, traceback.format_exc())
+        return
+    finally:
+        stop.set()
+        renewing.join()
+    queue.complete(task_id, result)
+
+
+def run_worker(path: Union[str, pathlib.Path], worker: Optional[str] = None, wait: bool = False,
+               lease_seconds: float = LEASE_SECONDS, poll_seconds: float = POLL_SECONDS) -> int:
+    """
+    Claim and run tasks until the queue is finished.
+
+    Args:
+    * path (Union[str, pathlib.Path]): the queue file.
+    * worker (Optional[str]): the name of the worker in the queue; defaults to host:pid:thread.
+    * wait (bool): keep waiting for new tasks when the queue is finished.
+
+    Returns:
+    * num_tasks (int): the number of tasks this worker ran.
+    """
+    queue = WorkQueue(path, lease_seconds=lease_seconds)
+    worker = default_worker_id() if worker is None else worker
+    num_tasks = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is not None:
+            run_task(queue, worker, *claimed)
+            num_tasks += 1
+        elif wait or queue.num_unfinished() > 0:  # a running task may still come back if its worker died
+            time.sleep(poll_seconds)
+        else:
+            return num_tasks
+
+
+def run_tasks(path: Union[str, pathlib.Path], func: Callable, args: List[tuple], num_processes: int = 0,
+              timeout: Optional[float] = None) -> List[Any]:
+    """
+    Submit func(*a) for each a in args to the queue, and wait for their results in order, like Pool.starmap().
+    Workers started on other nodes with `python -m prism_tracker.scripts.workqueue <path>` share the work, and
+    `num_processes` local workers are started too (with none, the tasks only run on the other workers).
+    """
+    queue = WorkQueue(path)
+    task_ids = queue.submit([(func, tuple(a)) for a in args])
+    workers = [multiprocessing.Process(target=run_worker, args=(path,)) for _ in range(num_processes)]
+    for process in workers:
+        process.start()
+    try:
+        return queue.results(task_ids, timeout)
+    finally:
+        for process in workers:
+            process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queue', type=pathlib.Path, help='the SQLite file of the queue')
+    parser.add_argument('--processes', type=int, default=1, help='the workers to run on this node')
+    parser.add_argument('--wait', action='store_true', help='keep waiting for new tasks when the queue is finished')
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS, help='seconds without heartbeat before a task '
+                                                                           'is claimed again')
+    parser.add_argument('--status', action='store_true', help='print the number of tasks in each status and exit')
+    parser.add_argument('--retry-failed', action='store_true', help='put the failed tasks back in the queue')
+    args = parser.parse_args()
+
+    if args.status or args.retry_failed:
+        queue = WorkQueue(args.queue, lease_seconds=args.lease)
+        if args.retry_failed:
+            queue.retry_failed()
+        print(queue.status())
+        return
+
+    workers = [multiprocessing.Process(target=run_worker, args=(args.queue, None, args.wait, args.lease))
+               for _ in range(args.processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
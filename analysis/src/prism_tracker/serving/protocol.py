@@ -0,0 +1,78 @@
+"""
+Framing of the SensorLogger socket stream.
+
+Every packet is a 5-byte little-endian header (type: uint8, payload length: uint32) followed by the payload.
+
+Client -> server:
+* HELLO: the utf-8 device or session id.
+* AUDIO: mono 16kHz PCM samples as little-endian int16.
+* MOTION: 50Hz IMU samples as little-endian float32 rows of (acc.x, acc.y, acc.z), in the preprocessed units.
+* END: no payload; the server flushes the remaining steps and closes the connection.
+
+Server -> client:
+* STEP: one tracking result per feature frame, packed as STEP_FORMAT.
+"""
+import asyncio
+import struct
+from typing import Tuple
+
+import numpy as np
+
+HEADER_FORMAT = '<BI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_PAYLOAD_SIZE = 1 << 22
+
+HELLO = 0x01
+AUDIO = 0x02
+MOTION = 0x03
+END = 0x04
+STEP = 0x10
+
+# frame index, step index, log-probability of the best path, relative time of the frame (ms)
+STEP_FORMAT = '<iidd'
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_packet(packet_type: int, payload: bytes = b'') -> bytes:
+    return struct.pack(HEADER_FORMAT, packet_type, len(payload)) + payload
+
+
+async def read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """
+    Read one packet. Raises asyncio.IncompleteReadError when the stream ends.
+    """
+    packet_type, length = struct.unpack(HEADER_FORMAT, await reader.readexactly(HEADER_SIZE))
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f'payload of {length} bytes exceeds {MAX_PAYLOAD_SIZE} bytes')
+    return packet_type, await reader.readexactly(length)
+
+
+def encode_audio(samples: np.ndarray) -> bytes:
+    return encode_packet(AUDIO, np.asarray(samples, dtype='<i2').tobytes())
+
+
+def decode_audio(payload: bytes) -> np.ndarray:
+    if len(payload) % 2 != 0:
+        raise ProtocolError(f'audio payload of {len(payload)} bytes is not made of int16 samples')
+    return np.frombuffer(payload, dtype='<i2').astype(np.int16)
+
+
+def encode_motion(acc: np.ndarray) -> bytes:
+    return encode_packet(MOTION, np.asarray(acc, dtype='<f4').tobytes())
+
+
+def decode_motion(payload: bytes) -> np.ndarray:
+    if len(payload) % 12 != 0:
+        raise ProtocolError(f'motion payload of {len(payload)} bytes is not made of (x, y, z) float32 rows')
+    return np.frombuffer(payload, dtype='<f4').reshape(-1, 3).astype(np.float64)
+
+
+def encode_step(frame_index: int, step_index: int, probability: float, relative_time: float) -> bytes:
+    return encode_packet(STEP, struct.pack(STEP_FORMAT, frame_index, step_index, probability, relative_time))
+
+
+def decode_step(payload: bytes) -> Tuple[int, int, float, float]:
+    return struct.unpack(STEP_FORMAT, payload)
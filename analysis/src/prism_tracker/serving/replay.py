@@ -0,0 +1,185 @@
+"""
+A stand-in for the SensorLogger client that replays recorded sessions to the ingestion server.
+
+Usage:
+    $ python -m prism_tracker.serving.replay --dataset path/to/dataset --participants P1 P2 --sessions 32
+
+The preprocessed audio (.wav) and motion (.npy) of each participant are streamed in chunks, either in real time or
+as fast as the server accepts them. The end-to-end latency of a frame is measured from the moment its last audio
+sample was sent until its step arrives.
+
+With --check-malformed, sessions that send malformed packets (a header with an oversize payload length, or audio
+that is not made of int16 samples) are replayed first, and the run fails unless the server closes each connection.
+"""
+import argparse
+import asyncio
+import json
+import pathlib
+import struct
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from ..preprocessing import params
+from ..preprocessing.motion import load_preprocessed_motion
+from ..preprocessing.streaming import IMU_SAMPLE_RATE
+from . import protocol
+
+
+def load_session(dataset_dir, participant_name):
+    """
+    Load the preprocessed audio samples (int16) and motion rows (acc.x, acc.y, acc.z) of a participant.
+    """
+    from scipy.io import wavfile
+
+    dataset_dir = pathlib.Path(dataset_dir)
+    _, audio = wavfile.read(dataset_dir / 'audio' / 'preprocessed' / f'{participant_name}.wav')
+    motion = np.asarray(load_preprocessed_motion(dataset_dir, participant_name)[:, 1:])
+    return audio, motion
+
+
+async def replay(host: str, port: int, session_id: str, audio: np.ndarray, motion: np.ndarray,
+                 chunk_seconds: float = 0.1, realtime: bool = False) -> Dict:
+    """
+    Replay one session and collect its steps.
+
+    Returns:
+    * result (Dict): the steps received, the per-frame latencies (s) and the wall-clock duration (s).
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    audio_chunk = int(chunk_seconds * params.SAMPLE_RATE)
+    motion_chunk = int(chunk_seconds * IMU_SAMPLE_RATE)
+    sent_at: List[float] = []  # the time each chunk of audio finished sending
+    steps, latencies = [], []
+
+    async def send():
+        writer.write(protocol.encode_packet(protocol.HELLO, session_id.encode('utf-8')))
+        start = time.perf_counter()
+        for chunk_index, audio_start in enumerate(range(0, len(audio), audio_chunk)):
+            motion_start = chunk_index * motion_chunk
+            writer.write(protocol.encode_motion(motion[motion_start:motion_start + motion_chunk]))
+            writer.write(protocol.encode_audio(audio[audio_start:audio_start + audio_chunk]))
+            await writer.drain()
+            sent_at.append(time.perf_counter())
+            if realtime:
+                await asyncio.sleep(max(0.0, start + (chunk_index + 1) * chunk_seconds - time.perf_counter()))
+        writer.write(protocol.encode_packet(protocol.END))
+        await writer.drain()
+
+    async def receive():
+        while True:
+            try:
+                packet_type, payload = await protocol.read_packet(reader)
+            except asyncio.IncompleteReadError:
+                return
+            if packet_type != protocol.STEP:
+                continue
+
+            received_at = time.perf_counter()
+            frame_index, step_index, probability, relative_time = protocol.decode_step(payload)
+            steps.append(step_index)
+            # the chunk that carried the last audio sample of the frame
+            chunk_index = min(int(np.ceil(relative_time / 1000 / chunk_seconds)) - 1, len(sent_at) - 1)
+            latencies.append(received_at - sent_at[chunk_index])
+
+    start = time.perf_counter()
+    await asyncio.gather(send(), receive())
+    duration = time.perf_counter() - start
+    writer.close()
+    return {'session_id': session_id, 'steps': steps, 'latencies': latencies, 'duration': duration}
+
+
+async def replay_malformed(host: str, port: int, packet: bytes, timeout: float = 5.0) -> bool:
+    """
+    Send a HELLO, then a malformed packet (see MALFORMED_PACKETS).
+
+    Returns:
+    * closed (bool): whether the server closed the connection within `timeout` seconds.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(protocol.encode_packet(protocol.HELLO, b'malformed'))
+    writer.write(packet)
+    await writer.drain()
+    try:
+        while len(await asyncio.wait_for(reader.read(1 << 16), timeout)) > 0:
+            pass
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        writer.close()
+
+
+# name -> a packet the server must reject by closing the connection
+MALFORMED_PACKETS = {
+    'oversize header': struct.pack(protocol.HEADER_FORMAT, protocol.AUDIO, protocol.MAX_PAYLOAD_SIZE + 1),
+    'odd audio payload': protocol.encode_packet(protocol.AUDIO, b'\x00\x01\x02'),
+}
+
+
+async def benchmark(host: str, port: int, sessions: List[Dict], chunk_seconds: float = 0.1,
+                    realtime: bool = False) -> Dict:
+    """
+    Replay several sessions concurrently and summarize latency and throughput.
+
+    Args:
+    * sessions (List[Dict]): sessions with 'session_id', 'audio' and 'motion' (see load_session()).
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        replay(host, port, session['session_id'], session['audio'], session['motion'], chunk_seconds, realtime)
+        for session in sessions])
+    duration = time.perf_counter() - start
+
+    latencies = np.concatenate([result['latencies'] for result in results])
+    num_frames = len(latencies)
+    audio_seconds = sum(len(session['audio']) for session in sessions) / params.SAMPLE_RATE
+    return {
+        'sessions': len(sessions),
+        'frames': num_frames,
+        'duration_s': duration,
+        'frames_per_s': num_frames / duration,
+        'realtime_factor': audio_seconds / duration,
+        'latency_ms': {
+            'mean': float(np.mean(latencies) * 1000) if num_frames > 0 else None,
+            'p50': float(np.percentile(latencies, 50) * 1000) if num_frames > 0 else None,
+            'p95': float(np.percentile(latencies, 95) * 1000) if num_frames > 0 else None,
+            'p99': float(np.percentile(latencies, 99) * 1000) if num_frames > 0 else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--dataset', required=True, help='a task dataset directory with preprocessed audio/motion')
+    parser.add_argument('--participants', nargs='+', required=True)
+    parser.add_argument('--sessions', type=int, default=1, help='concurrent sessions, cycling over participants')
+    parser.add_argument('--chunk-seconds', type=float, default=0.1)
+    parser.add_argument('--realtime', action='store_true', help='pace the replay at the recording speed')
+    parser.add_argument('--check-malformed', action='store_true',
+                        help='fail unless the server closes a connection that sends an oversize packet header')
+    args = parser.parse_args()
+
+    if args.check_malformed:
+        for name, packet in MALFORMED_PACKETS.items():
+            if not asyncio.run(replay_malformed(args.host, args.port, packet)):
+                print(f'the server did not close the connection after a packet with an {name}')
+                sys.exit(1)
+
+    recordings = {name: load_session(args.dataset, name) for name in args.participants}
+    sessions = []
+    for i in range(args.sessions):
+        name = args.participants[i % len(args.participants)]
+        audio, motion = recordings[name]
+        sessions.append({'session_id': f'{name}-{i}', 'audio': audio, 'motion': motion})
+
+    summary = asyncio.run(benchmark(args.host, args.port, sessions, args.chunk_seconds, args.realtime))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Asyncio ingestion server for the SensorLogger socket stream.
+
+Usage:
+    $ python -m prism_tracker.serving.server --model tracking_model.pkl --port 8765
+
+Each connection gets its own streaming feature extractor and tracker. Feature extraction, classification and tracking
+run in an executor so that the event loop only moves bytes. Every connection reads packets into a bounded queue: when
+the pipeline falls behind, the reader stops reading and TCP flow control slows the device down.
+
+With several --model files, the procedure is not known in advance: the candidate procedures are tracked together on
+the same features (see MultiGraphTracker), and the steps of the most likely one are reported.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import pathlib
+import pickle
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .. import instrumentation
+from ..preprocessing.streaming import FeatureFrame, StreamingFeatureExtractor
+from ..scripts.classifier import OBSERVATION_BACKENDS, ObservationModel, as_observation_model
+from ..tracker.collections import Graph
+from ..tracker.multigraph import MultiGraphTracker
+from ..tracker.tables import TransitionTables
+from ..tracker.viterbi import ViterbiTracker
+from . import protocol
+
+# frame index, step index, log-probability of the best path, relative time of the frame (ms)
+StepResult = Tuple[int, int, float, float]
+
+
+class TrackingPipeline:
+    def __init__(self, extractor: StreamingFeatureExtractor, classifier: ObservationModel,
+                 confusion_matrix: List[List[float]], tracker: ViterbiTracker):
+        """
+        The CPU-side work of one connection: streaming features -> classifier -> Viterbi tracker.
+        Not thread-safe; the server runs at most one call per connection at a time.
+        """
+        self.extractor = extractor
+        self.classifier = classifier
+        self.confusion_matrix = confusion_matrix
+        self.tracker = tracker
+        self.initialized = False
+
+    def push_audio(self, samples: np.ndarray) -> List[StepResult]:
+        return self._track(self.extractor.push_audio(samples))
+
+    def push_motion(self, acc: np.ndarray) -> List[StepResult]:
+        return self._track(self.extractor.push_motion(acc))
+
+    def _track(self, frames: List[FeatureFrame]) -> List[StepResult]:
+        if len(frames) == 0:
+            return []
+
+        with instrumentation.timer('serving.predict_proba'):
+            if len(frames) == 1:
+                observations = self.classifier.predict_one(frames[0].features)[np.newaxis]
+            else:
+                observations = self.classifier.predict_proba(np.stack([frame.features for frame in frames]))
+        results = []
+        for frame, observation in zip(frames, observations):
+            if not self.initialized:
+                prob, steps = self.tracker.initialize(observation, self.confusion_matrix)
+                self.initialized = True
+            else:
+                prob, steps = self.tracker.forward(observation, self.confusion_matrix)
+            results.append((frame.index, steps[-1], float(prob), frame.relative_time))
+        return results
+
+
+class MultiTrackingPipeline(TrackingPipeline):
+    def __init__(self, extractor: StreamingFeatureExtractor, classifiers: Dict[str, ObservationModel],
+                 tracker: MultiGraphTracker):
+        """
+        A TrackingPipeline for a session whose procedure is unknown: the features are extracted once and fanned out
+        to the classifier of every candidate procedure that the tracker has not pruned yet.
+        The results report the steps of the most likely procedure, whose name is kept in `procedure`.
+        """
+        super().__init__(extractor, None, None, tracker)
+        self.classifiers = classifiers
+        self.procedure: Optional[str] = None
+
+    def _track(self, frames: List[FeatureFrame]) -> List[StepResult]:
+        if len(frames) == 0:
+            return []
+
+        features = np.stack([frame.features for frame in frames])
+        results = []
+        for i, frame in enumerate(frames):
+            # the classifiers of the procedures pruned at the previous frame are skipped
+            with instrumentation.timer('serving.predict_proba'):
+                observations = {name: self.classifiers[name].predict_one(features[i]) for name in self.tracker.active}
+            if not self.initialized:
+                self.procedure, prob, steps = self.tracker.initialize(observations)
+                self.initialized = True
+            else:
+                self.procedure, prob, steps = self.tracker.forward(observations)
+            results.append((frame.index, steps[-1], float(prob), frame.relative_time))
+        return results
+
+
+class PipelineFactory:
+    def __init__(self, norm_params, audio_model, motion_model, classifier, confusion_matrix: List[List[float]],
+                 graph: Graph, start_step_indices: Optional[List[int]] = None, backend: str = 'compiled'):
+        """
+        The models shared by every connection.
+        The classifier is wrapped into the observation model of `backend` (see OBSERVATION_BACKENDS).
+        """
+        self.norm_params = norm_params
+        self.audio_model = audio_model
+        self.motion_model = motion_model
+        self.classifier = as_observation_model(classifier, backend)
+        self.confusion_matrix = confusion_matrix
+        self.graph = graph
+        self.start_step_indices = start_step_indices
+        self.tables = TransitionTables(graph)
+
+    def create(self) -> TrackingPipeline:
+        extractor = StreamingFeatureExtractor(self.norm_params, self.audio_model, self.motion_model)
+        # only the current step is reported, so the tracker does not need to keep the history
+        tracker = ViterbiTracker(self.graph, start_step_indices=self.start_step_indices, tables=self.tables,
+                                 history_window=1)
+        return TrackingPipeline(extractor, self.classifier, self.confusion_matrix, tracker)
+
+
+class MultiPipelineFactory:
+    def __init__(self, norm_params, audio_model, motion_model, models: Dict[str, dict], backend: str = 'compiled'):
+        """
+        The models shared by every connection when the procedure is unknown.
+
+        Args:
+        * models (Dict[str, dict]): the tracking model of each candidate procedure, with the keys of
+          load_tracking_model().
+        """
+        self.norm_params = norm_params
+        self.audio_model = audio_model
+        self.motion_model = motion_model
+        self.classifiers = {name: as_observation_model(model['classifier'], backend) for name, model in models.items()}
+        self.confusion_matrices = {name: model['confusion_matrix'] for name, model in models.items()}
+        self.graphs = {name: model['graph'] for name, model in models.items()}
+        self.start_step_indices = {name: model['start_step_indices'] for name, model in models.items()
+                                   if model.get('start_step_indices') is not None}
+        self.tables = {name: TransitionTables(graph) for name, graph in self.graphs.items()}
+
+    def create(self) -> MultiTrackingPipeline:
+        extractor = StreamingFeatureExtractor(self.norm_params, self.audio_model, self.motion_model)
+        tracker = MultiGraphTracker(self.graphs, self.confusion_matrices, self.start_step_indices, history_window=1,
+                                    tables=self.tables)
+        return MultiTrackingPipeline(extractor, self.classifiers, tracker)
+
+
+class IngestionServer:
+    def __init__(self, factory: Union[PipelineFactory, MultiPipelineFactory],
+                 executor: Optional[concurrent.futures.Executor] = None,
+                 max_pending_packets: int = 64):
+        """
+        Args:
+        * factory (Union[PipelineFactory, MultiPipelineFactory]): creates the per-connection pipelines.
+        * executor (Optional[Executor]): runs the CPU-heavy stages; defaults to a thread pool.
+        * max_pending_packets (int): the number of packets buffered per connection before reading pauses.
+        """
+        self.factory = factory
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor()
+        self.max_pending_packets = max_pending_packets
+        self.num_connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.max_pending_packets)
+        self.num_connections += 1
+
+        async def read_packets():
+            try:
+                while True:
+                    packet_type, payload = await protocol.read_packet(reader)
+                    await queue.put((packet_type, payload))  # blocks when the pipeline falls behind
+                    if packet_type == protocol.END:
+                        return
+            except (asyncio.IncompleteReadError, ConnectionError):
+                await queue.put((protocol.END, b''))
+            except protocol.ProtocolError as e:  # raised again by the consumer, which closes the connection
+                await queue.put((None, e))
+
+        reading = asyncio.create_task(read_packets())
+        try:
+            pipeline = await loop.run_in_executor(self.executor, self.factory.create)
+            while True:
+                packet_type, payload = await queue.get()
+                if packet_type is None:
+                    raise payload
+                elif packet_type == protocol.END:
+                    break
+                elif packet_type == protocol.AUDIO:
+                    results = await loop.run_in_executor(
+                        self.executor, pipeline.push_audio, protocol.decode_audio(payload))
+                elif packet_type == protocol.MOTION:
+                    results = await loop.run_in_executor(
+                        self.executor, pipeline.push_motion, protocol.decode_motion(payload))
+                else:  # HELLO and unknown packets carry nothing to track
+                    continue
+
+                for result in results:
+                    writer.write(protocol.encode_step(*result))
+                await writer.drain()
+        except (protocol.ProtocolError, ConnectionError) as e:
+            print(f'closing connection: {e}')
+        finally:
+            reading.cancel()
+            self.num_connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host: str = '0.0.0.0', port: int = 8765) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def load_tracking_model(path):
+    """
+    Load a pickle with the 'classifier', 'confusion_matrix', 'graph' and optional 'start_step_indices' to serve.
+    """
+    with open(path, 'rb') as fp:
+        return pickle.load(fp)
+
+
+def main():
+    from ..preprocessing.encoders import QUANTIZATIONS
+    from ..preprocessing.feature_extraction import get_normalization_params
+    from ..preprocessing.pipeline import PretrainedModels
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', nargs='+', required=True,
+                        help='a pickle saved for load_tracking_model(); several candidate procedures are tracked at '
+                             'once if more are given, by file name')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='executor threads')
+    parser.add_argument('--backend', choices=sorted(OBSERVATION_BACKENDS), default='compiled',
+                        help='the observation model backend')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default=None,
+                        help='use the TFLite encoders exported with this quantization instead of Keras')
+    args = parser.parse_args()
+
+    models = {pathlib.Path(path).stem: load_tracking_model(path) for path in args.model}
+    audio_model, motion_model = PretrainedModels(args.quantization).load()
+    if len(models) > 1:
+        factory = MultiPipelineFactory(get_normalization_params(), audio_model, motion_model, models, args.backend)
+    else:
+        model, = models.values()
+        factory = PipelineFactory(get_normalization_params(), audio_model, motion_model,
+                                  model['classifier'], model['confusion_matrix'], model['graph'],
+                                  model.get('start_step_indices'), args.backend)
+    server = IngestionServer(factory, concurrent.futures.ThreadPoolExecutor(args.workers))
+
+    async def run():
+        async with await server.serve(args.host, args.port) as tcp_server:
+            print(f'serving on {args.host}:{args.port}')
+            await tcp_server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Frame-decimated tracking.
+
+Step durations span minutes while the features hop every 0.21 s, so consecutive frames mostly repeat the same evidence
+for the duration model. DecimatedTracker pools blocks of `factor` frames into one observation (the product of their
+likelihoods, i.e., the sum of their log-likelihoods) and runs the Viterbi recursion once per block, on a graph whose
+durations are rescaled to blocks. The path of blocks is expanded back to frames, and each step change is moved to
+the frame that best splits the observations around it (see expand_path()).
+"""
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .. import instrumentation
+from . import lattice
+from .collections import Graph, Step
+from .params import MAX_TIME
+from .tables import TransitionTables
+from .viterbi import ViterbiTracker
+
+LOG_LIKELIHOOD_FLOOR = -1e6  # keeps impossible frames comparable when placing a step change
+
+
+def decimate_graph(graph: Graph, factor: int) -> Graph:
+    """
+    Rescale the step durations of a graph from frames to blocks of `factor` frames. The edges are unchanged.
+    """
+    steps = {step: Step(step.index, step.mean_time / factor, step.std_time / factor) for step in graph.steps}
+    edges = {steps[step]: {steps[dest_step]: prob for dest_step, prob in dest_steps.items()}
+             for step, dest_steps in graph.edges.items()}
+    return Graph([steps[step] for step in graph.steps], edges)
+
+
+def expand_path(block_path: List[int], factor: int, frame_log_likelihoods: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Expand a path of blocks to frames. Each step change is moved to the frame that maximizes the log-likelihoods of
+    the two blocks around it, keeping at least one frame on each side, so the steps change at frame resolution.
+
+    Args:
+    * block_path (List[int]): the step index of each block.
+    * factor (int): the number of frames per block.
+    * frame_log_likelihoods (Optional[np.ndarray]): the log-likelihoods of the frames of the blocks with shape
+      (num_frames, num_states), where the last block may be partial; the blocks are only repeated if None.
+
+    Returns:
+    * path (np.ndarray): the step index of each frame.
+    """
+    block_path = np.asarray(block_path, dtype=np.intp)
+    path = np.repeat(block_path, factor)
+    if frame_log_likelihoods is None or factor == 1:
+        return path
+    path = path[:len(frame_log_likelihoods)]
+
+    lower = 0
+    for block in np.nonzero(block_path[1:] != block_path[:-1])[0] + 1:
+        before, after = block_path[block - 1], block_path[block]
+        start, end = max((block - 1) * factor, lower), min((block + 1) * factor, len(path))
+        window = np.maximum(frame_log_likelihoods[start:end], LOG_LIKELIHOOD_FLOOR)
+
+        # gains[i]: the log-likelihood gained by the frames start..start+i-1 staying on `before`
+        gains = np.cumsum(window[:-1, before] - window[:-1, after])
+        candidates = np.flatnonzero(gains == gains.max()) + start + 1
+        split = int(candidates[np.argmin(np.abs(candidates - block * factor))])  # ties go to the block boundary
+
+        path[start:split] = before
+        path[split:end] = after
+        lower = split
+    return path
+
+
+class DecimatedTracker(ViterbiTracker):
+    def __init__(self, graph: Graph, factor: int, start_step_indices: Optional[List[int]] = None,
+                 history_window: Optional[int] = None, max_time: int = MAX_TIME):
+        """
+        A ViterbiTracker that decodes one block of `factor` frames at a time. It takes and returns frames like
+        ViterbiTracker; the frames of the block in progress take the last decoded step until the block is complete.
+        Snapshots cover the decoded blocks only.
+
+        Args:
+        * graph (Graph): a graph object built using build_graph(), with durations in frames.
+        * factor (int): the number of frames per block.
+        * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
+        * history_window (Optional[int]): the number of past frames returned as the history of the best entry; all
+          frames if None.
+        * max_time (int): the number of frames that the duration model covers.
+        """
+        if factor < 1:
+            raise ValueError(f'the decimation factor must be positive, not {factor}')
+
+        block_window = None if history_window is None else -(-history_window // factor) + 1
+        tables = TransitionTables(decimate_graph(graph, factor), max_time=-(-max_time // factor))
+        super().__init__(graph, start_step_indices, tables=tables, history_window=block_window)
+        self.factor = factor
+        self.frame_history_window = history_window
+        self.__reset_frames__(0)
+        self.flushed = False
+
+        # the past frames from frame `first_stored`, to place the step changes: the log-likelihoods of the decoded
+        # frames, and the observations of the block in progress (they are converted at once when it is decoded)
+        self.max_stored = None if block_window is None else (block_window + 1) * factor
+        self.frames = np.empty((0, self.tables.num_states))
+        self.first_stored = 0
+        self.num_stored = 0
+
+    def __reset_frames__(self, num_input_frames: int):
+        self.num_input_frames = num_input_frames
+        self.num_pending = 0
+        self.block_confusion_matrix: Optional[List[List[float]]] = None
+        self.block_next_step: Optional[int] = None
+        self.block_prohibited_steps: Optional[set] = None
+
+        # the best entry of the last decoded block, expanded to frames
+        self.block_probability = -np.inf
+        self.decoded_path: List[int] = []
+
+    def __store__(self, observation: List[float]):
+        if self.num_stored == len(self.frames):
+            if self.max_stored is not None and self.num_stored >= 2 * self.max_stored:
+                # drop the frames that are out of the window
+                dropped = self.num_stored - self.max_stored
+                self.frames[:self.max_stored] = self.frames[dropped:self.num_stored]
+                self.first_stored += dropped
+                self.num_stored = self.max_stored
+            else:
+                capacity = max(2 * self.num_stored, 64)
+                if self.max_stored is not None:
+                    capacity = min(capacity, 2 * self.max_stored)
+                stored = np.empty((capacity, self.tables.num_states))
+                stored[:self.num_stored] = self.frames[:self.num_stored]
+                self.frames = stored
+        self.frames[self.num_stored] = np.asarray(observation, dtype=np.float64)[:self.tables.num_states]
+        self.num_stored += 1
+
+    def __block_log_likelihoods__(self) -> np.ndarray:
+        """
+        This method computes the log-likelihoods of the frames of the block in progress.
+        """
+        observations = self.frames[self.num_stored - self.num_pending:self.num_stored]
+        return self.__log_likelihoods__(observations, self.block_confusion_matrix)
+
+    def __push__(self, observation: List[float], confusion_matrix: List[List[float]],
+                 oracle_next_step: Optional[int] = None,
+                 oracle_prohibited_steps: Optional[List[int]] = None) -> Tuple[float, List[int]]:
+        """
+        This method adds a frame to the current block, decodes the block once it is complete, and returns the best
+        entry at frame resolution.
+        """
+        self.__store__(observation)
+        self.block_confusion_matrix = confusion_matrix
+        self.num_pending += 1
+        self.num_input_frames += 1
+
+        # a step can be entered in a block if the oracle allows it at any of its frames
+        if self.block_next_step is None:
+            self.block_next_step = oracle_next_step
+        prohibited_steps = set(oracle_prohibited_steps or [])
+        self.block_prohibited_steps = prohibited_steps if self.block_prohibited_steps is None \
+            else self.block_prohibited_steps & prohibited_steps
+
+        if self.num_pending == self.factor:
+            self.__decode_block__()
+        return self.__get_frame_entry__()
+
+    def __decode_block__(self):
+        frame_log_likelihoods = self.__block_log_likelihoods__()
+        self.frames[self.num_stored - self.num_pending:self.num_stored] = frame_log_likelihoods
+
+        # pooling the frames multiplies their likelihoods
+        block_log_likelihoods = frame_log_likelihoods.sum(axis=0)
+        if self.num_frames == 0:
+            self.__initialize__(block_log_likelihoods)
+        else:
+            self.__advance__(block_log_likelihoods, self.block_next_step,
+                             sorted(self.block_prohibited_steps - {self.block_next_step}))
+        self.block_probability, block_path = self.__get_best_entry__()
+
+        first_frame = (self.num_frames - len(block_path)) * self.factor
+        frame_log_likelihoods = None
+        if first_frame >= self.first_stored:
+            frame_log_likelihoods = self.frames[first_frame - self.first_stored:self.num_stored]
+        path = expand_path(block_path, self.factor, frame_log_likelihoods)
+        self.decoded_path = path[:self.num_input_frames - first_frame].tolist()
+
+        self.num_pending = 0
+        self.block_next_step, self.block_prohibited_steps = None, None
+
+    def __get_frame_entry__(self) -> Tuple[float, List[int]]:
+        if self.num_frames == 0:  # the first block is not complete yet: only the pooled observations are known
+            block_log_likelihoods = self.__block_log_likelihoods__().sum(axis=0)
+            scores, _, alive = lattice.initial_state(self.tables, block_log_likelihoods[np.newaxis], self.start_mask)
+            step_index = int(lattice.best_steps(scores[0], alive[0]))
+            if step_index < 0:
+                raise ValueError('No hypothesis is left at the current frame')
+            probability, path = float(scores[0, step_index]), [step_index] * self.num_pending
+        else:
+            probability = self.block_probability
+            path = self.decoded_path + self.decoded_path[-1:] * self.num_pending
+
+        if self.frame_history_window is not None:
+            path = path[-self.frame_history_window:]
+        return probability, path
+
+    def initialize(self, observation: List[float], confusion_matrix: List[List[float]]) -> Tuple[float, List[int]]:
+        """
+        This method starts tracking from the initial frame (see ViterbiTracker.initialize()).
+        """
+        self.num_frames = 0
+        self.flushed = False
+        self.backpointers.clear()
+        self.path, self.path_start = [], 0
+        self.__reset_frames__(0)
+        self.first_stored, self.num_stored = 0, 0
+        return self.__push__(observation, confusion_matrix)
+
+    def forward(self, observation: List[float], confusion_matrix: List[List[float]],
+                oracle_next_step: Optional[int] = None,
+                oracle_prohibited_steps: Optional[List[int]] = None) -> Tuple[float, List[int]]:
+        """
+        This method adds a frame (see ViterbiTracker.forward()); the lattice advances once every `factor` frames.
+        """
+        if self.num_input_frames == 0:
+            raise ValueError('You must call initialize() first')
+        if self.flushed:
+            raise ValueError('The session was flushed; call initialize() to start another one')
+
+        start = perf_counter() if instrumentation.recorder is not None else None
+        entry = self.__push__(observation, confusion_matrix, oracle_next_step, oracle_prohibited_steps)
+        if start is not None:
+            self.__record_frame__(start)
+        return entry
+
+    def flush(self) -> Tuple[float, List[int]]:
+        """
+        This method decodes the incomplete last block at the end of a session, so that its frames are tracked too.
+
+        Returns:
+        * probability (float): a float value of the probability of the best entry.
+        * steps (List[int]): a list of integers representing the step indices in the best entry's history.
+        """
+        if self.num_pending > 0:
+            self.__decode_block__()
+        self.flushed = True
+        return self.__get_frame_entry__()
+
+    def predict(self, observations: List[List[float]], confusion_matrix: List[List[float]],
+                oracle: Optional[Dict[int, List[int]]] = None) -> Iterator[Tuple[float, List[int]]]:
+        """
+        This function tracks a complete session (see ViterbiTracker.predict()); the last block is flushed at the
+        last frame.
+        """
+        num_frames = len(observations[0])
+        for time, entry in enumerate(super().predict(observations, confusion_matrix, oracle)):
+            yield self.flush() if time == num_frames - 1 else entry
+
+    def restore(self, data: bytes):
+        """
+        This method restores the decoded blocks saved by snapshot(); the history then starts at frame resolution
+        without moving the step changes.
+        """
+        super().restore(data)
+        self.__reset_frames__(self.num_frames * self.factor)
+        self.first_stored, self.num_stored = self.num_input_frames, 0
+        if self.num_frames > 0:
+            self.block_probability, block_path = self.__get_best_entry__()
+            self.decoded_path = expand_path(block_path, self.factor).tolist()
@@ -0,0 +1,93 @@
+"""
+Vectorized Viterbi recursions over a batch of hypothesis rows.
+
+A row holds, for every step, the log-probability of the best path ending on that step (`scores`), the number of frames
+spent on the step along that path (`durations`) and whether such a path exists at all (`alive`). All arrays have shape
+(batch, num_states). The recursions reproduce ViterbiTracker.forward(): a step keeps only its best incoming
+hypothesis, and ties go to the source step with the largest index.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .tables import TransitionTables
+
+
+def initial_state(tables: TransitionTables, log_likelihoods: np.ndarray,
+                  start_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Initialize rows from the log-likelihoods of the first frame.
+
+    Args:
+    * tables (TransitionTables): the compiled graph.
+    * log_likelihoods (np.ndarray): the confusion-weighted log-likelihoods with shape (batch, num_states).
+    * start_mask (Optional[np.ndarray]): the steps a session may start on; all steps if None.
+
+    Returns:
+    * scores, durations, alive (np.ndarray): the initial rows.
+    """
+    scores = np.where(tables.exists, log_likelihoods, -np.inf)
+    if start_mask is not None:
+        scores = np.where(start_mask, scores, -np.inf)
+    durations = np.zeros(scores.shape, dtype=np.int32)
+    alive = np.broadcast_to(tables.exists, scores.shape).copy()
+    return scores, durations, alive
+
+
+def advance(tables: TransitionTables, scores: np.ndarray, durations: np.ndarray, alive: np.ndarray,
+            log_likelihoods: np.ndarray, stay_allowed: Optional[np.ndarray] = None,
+            move_allowed: Optional[np.ndarray] = None
+            ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Advance rows by one frame.
+
+    Args:
+    * tables (TransitionTables): the compiled graph.
+    * scores, durations, alive (np.ndarray): the current rows.
+    * log_likelihoods (np.ndarray): the confusion-weighted log-likelihoods of the new frame.
+    * stay_allowed (Optional[np.ndarray]): the steps that may be stayed on (broadcast to the rows); all if None.
+    * move_allowed (Optional[np.ndarray]): the steps that may be entered from another step; all if None.
+
+    Returns:
+    * scores, durations, alive (np.ndarray): the new rows.
+    * backpointers (np.ndarray): the source step of the best hypothesis on each step.
+    """
+    num_states = scores.shape[-1]
+    packed = tables.materialize(durations)  # one state of the tables for the whole frame
+    log_stay, log_escape, valid = packed.lookup(durations)
+    valid = valid & alive
+
+    # candidates[b, i, j]: the best path on step i followed by a transition to step j (the diagonal holds the stays)
+    candidate_valid = valid[:, :, np.newaxis] & packed.edge_mask
+    if move_allowed is not None:
+        candidate_valid &= np.asarray(move_allowed)[..., np.newaxis, :]
+    with np.errstate(invalid='ignore'):
+        candidates = np.where(candidate_valid, (scores + log_escape)[:, :, np.newaxis] + packed.log_edges, -np.inf)
+
+    diagonal = np.arange(num_states)
+    stay_valid = valid if stay_allowed is None else valid & stay_allowed
+    candidate_valid[:, diagonal, diagonal] = stay_valid
+    with np.errstate(invalid='ignore'):
+        candidates[:, diagonal, diagonal] = np.where(stay_valid, scores + log_stay, -np.inf)
+
+    best = candidates.max(axis=1)
+    is_best = candidate_valid & (candidates == best[:, np.newaxis, :])
+    backpointers = num_states - 1 - np.argmax(is_best[:, ::-1, :], axis=1)
+
+    next_alive = candidate_valid.any(axis=1)
+    next_scores = np.where(next_alive, best + log_likelihoods, -np.inf)
+    stayed = backpointers == diagonal
+    # every duration beyond the horizon of a step has the same transitions, so the durations saturate at max_time
+    next_durations = np.where(stayed & next_alive, np.minimum(durations + 1, tables.max_time - 1), 0).astype(np.int32)
+
+    return next_scores, next_durations, next_alive, backpointers
+
+
+def best_steps(scores: np.ndarray, alive: np.ndarray) -> np.ndarray:
+    """
+    Select the step of the best hypothesis of each row (the first one among ties), or -1 if no hypothesis is left.
+    """
+    masked = np.where(alive, scores, -np.inf)
+    best = masked.max(axis=-1, keepdims=True)
+    steps = np.argmax(alive & (masked == best), axis=-1)
+    return np.where(alive.any(axis=-1), steps, -1)
@@ -0,0 +1,257 @@
+"""
+Concurrent tracking of several candidate procedures over the same session.
+
+When the procedure being performed is unknown, every candidate graph is tracked on the same frames. The tables of the
+graphs are padded to the same number of steps and stacked (see StackedTables), so that the rows of the lattice (one
+per procedure) advance together in one call of lattice.advance(): the Python and NumPy overhead of a frame is paid
+once, and the cost grows much more slowly than running one ViterbiTracker per procedure. A procedure whose best path
+falls more than `beam` (in log-probability) behind the best procedure is pruned, so its classifier does not need to
+run anymore either.
+"""
+import collections
+from time import perf_counter
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .. import instrumentation
+from . import lattice
+from .collections import Graph
+from .tables import TransitionTables
+
+PRUNING_BEAM = 50.0  # the log-probability gap to the best procedure beyond which a procedure is dropped
+
+
+class StackedTables:
+    def __init__(self, tables: List[TransitionTables], num_states: Optional[int] = None):
+        """
+        The transition tables of several graphs padded to the same number of steps and stacked along the first axis,
+        so that lattice.py advances one row per graph. The padded steps do not exist and have no transitions.
+
+        Args:
+        * tables (List[TransitionTables]): the compiled graphs, with the same max_time.
+        * num_states (Optional[int]): the number of steps to pad to; the largest number of steps if None.
+        """
+        if len({table.max_time for table in tables}) > 1:
+            raise ValueError('the stacked tables must have the same max_time')
+        self.tables = tables
+        self.max_time = tables[0].max_time
+        self.num_states = max(table.num_states for table in tables) if num_states is None else num_states
+
+        packed = [table.packed for table in tables]  # one state of each table
+
+        def stack(arrays: List[np.ndarray], fill, square: bool = False) -> np.ndarray:
+            padded = []
+            for table, array in zip(tables, arrays):
+                pad = [(0, self.num_states - table.num_states)] * (2 if square else 1) + [(0, 0)] * (array.ndim - 1)
+                padded.append(np.pad(array, pad[:array.ndim], constant_values=fill))
+            return np.stack(padded)
+
+        # the duration models are materialized up to the longest horizon, which stands for all the longer durations
+        self.num_durations = max(int(state.horizons.max()) for state in packed)
+        dense = [table.dense(self.num_durations, state) for table, state in zip(tables, packed)]
+
+        self.exists = stack([table.exists for table in tables], False)
+        self.log_stay = stack([log_stay for log_stay, _, _ in dense], -np.inf)
+        self.log_escape = stack([log_escape for _, log_escape, _ in dense], -np.inf)
+        self.valid = stack([valid for _, _, valid in dense], False)
+        self.log_edges = stack([state.log_edges for state in packed], -np.inf, square=True)
+        self.edge_mask = stack([state.edge_mask for state in packed], False, square=True)
+
+    def materialize(self, durations: np.ndarray) -> 'StackedTables':
+        """
+        The stacked tables are dense and never change, so they cover every duration (see
+        TransitionTables.materialize()).
+        """
+        return self
+
+    def lookup(self, durations: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Look up the duration model of every step of every graph (see TransitionTables.lookup()).
+
+        Args:
+        * durations (np.ndarray): the number of frames spent on each step so far, with shape (num_graphs, num_states).
+        """
+        rows = np.arange(len(self.tables))[:, np.newaxis]
+        steps = np.arange(self.num_states)[np.newaxis]
+        times = np.minimum(durations, self.num_durations - 1)
+        return self.log_stay[rows, steps, times], self.log_escape[rows, steps, times], self.valid[rows, steps, times]
+
+    def confusion_weights(self, confusion_matrices: List[List[List[float]]]) -> np.ndarray:
+        """
+        Stack the confusion weights of each graph (see TransitionTables.confusion_weights()) with shape
+        (num_graphs, num_states, num_states).
+        """
+        weights = np.zeros((len(self.tables), self.num_states, self.num_states))
+        for i, (table, confusion_matrix) in enumerate(zip(self.tables, confusion_matrices)):
+            weights[i, :table.num_states, :table.num_states] = table.confusion_weights(confusion_matrix)
+        return weights
+
+    def log_likelihoods(self, observations: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Compute the confusion-weighted log-likelihoods of one frame of each graph, with shape (num_graphs, num_states)
+        (see TransitionTables.log_likelihoods()).
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_likelihoods = np.log(np.einsum('gij,gj->gi', weights, observations))
+        return np.where(np.isnan(log_likelihoods), -np.inf, log_likelihoods)
+
+
+class MultiGraphTracker:
+    def __init__(self, graphs: Dict[str, Graph], confusion_matrices: Dict[str, List[List[float]]],
+                 start_step_indices: Optional[Dict[str, List[int]]] = None, beam: float = PRUNING_BEAM,
+                 history_window: Optional[int] = None, tables: Optional[Dict[str, TransitionTables]] = None):
+        """
+        Tracks the same session on several candidate procedures at once and reports the most likely one.
+
+        Args:
+        * graphs (Dict[str, Graph]): the candidate procedures by name, e.g., {'cooking': ..., 'latte_making': ...}.
+        * confusion_matrices (Dict[str, List[List[float]]]): the confusion matrix of the classifier of each procedure.
+        * start_step_indices (Optional[Dict[str, List[int]]]): the indices of the starting steps of each procedure.
+        * beam (float): the log-probability gap to the best procedure beyond which a procedure is pruned.
+        * history_window (Optional[int]): the number of past frames returned as the history of the best entry; all
+          frames if None.
+        * tables (Optional[Dict[str, TransitionTables]]): the compiled transition tables of the graphs, to share them
+          between trackers.
+        """
+        self.names = list(graphs)
+        tables = tables or {}
+        self.all_tables = {name: tables[name] if name in tables else TransitionTables(graphs[name])
+                           for name in self.names}
+        self.num_states = max(tables.num_states for tables in self.all_tables.values())
+        self.confusion_matrices = confusion_matrices
+        self.start_step_indices = start_step_indices or {}
+        self.beam = beam
+        self.history_window = history_window
+
+        max_backpointers = None if history_window is None else max(history_window - 1, 0)
+        self.backpointers: Deque[np.ndarray] = collections.deque(maxlen=max_backpointers)
+        self.num_frames = 0
+        self.__select__(self.names)
+
+    def __select__(self, names: List[str]):
+        """
+        This method restricts the stacked rows to the given procedures (in their current order).
+        """
+        if self.num_frames > 0:
+            rows = [self.active.index(name) for name in names]
+            self.scores, self.durations, self.alive = self.scores[rows], self.durations[rows], self.alive[rows]
+            backpointers = [backpointer[rows] for backpointer in self.backpointers]
+            self.backpointers.clear()
+            self.backpointers.extend(backpointers)
+
+        self.active = list(names)
+        self.tables = StackedTables([self.all_tables[name] for name in names], self.num_states)
+        self.weights = self.tables.confusion_weights([self.confusion_matrices[name] for name in names])
+        self.start_mask = np.zeros((len(names), self.tables.num_states), dtype=bool)
+        for i, name in enumerate(names):
+            start_step_indices = self.start_step_indices.get(name)
+            if start_step_indices is None:
+                self.start_mask[i, :self.all_tables[name].num_states] = True
+            else:
+                self.start_mask[i, start_step_indices] = True
+
+    def __log_likelihoods__(self, observations: Dict[str, List[float]]) -> np.ndarray:
+        stacked = np.zeros((len(self.active), self.tables.num_states))
+        for i, name in enumerate(self.active):
+            num_states = self.all_tables[name].num_states
+            observation = np.asarray(observations[name], dtype=np.float64)[:num_states]
+            stacked[i, :len(observation)] = observation
+        return self.tables.log_likelihoods(stacked, self.weights)
+
+    def __prune__(self):
+        """
+        This method drops the procedures without any hypothesis left or whose best path is more than `beam` behind.
+        """
+        best = np.where(self.alive, self.scores, -np.inf).max(axis=1)
+        if not np.isfinite(best).any():
+            raise ValueError('No hypothesis is left at the current frame')
+        keep = np.isfinite(best) & (best >= best.max() - self.beam)
+        if not keep.all():
+            self.__select__([name for name, kept in zip(self.active, keep) if kept])
+
+    def __backtrack__(self, row: int, step_index: int) -> List[int]:
+        path = [step_index]
+        for backpointer in reversed(self.backpointers):
+            step_index = int(backpointer[row, step_index])
+            path.append(step_index)
+        return path[::-1]
+
+    def __get_best_entry__(self) -> Tuple[str, float, List[int]]:
+        steps = lattice.best_steps(self.scores, self.alive)
+        best = np.where(steps >= 0, self.scores[np.arange(len(steps)), np.maximum(steps, 0)], -np.inf)
+        row = int(np.argmax(best))
+        return self.active[row], float(best[row]), self.__backtrack__(row, int(steps[row]))
+
+    @property
+    def procedure_probabilities(self) -> Dict[str, float]:
+        """
+        The probability of each candidate procedure, from the best path of each (the pruned ones have 0).
+        """
+        probabilities = {name: 0.0 for name in self.names}
+        if self.num_frames == 0:
+            return probabilities
+        best = np.where(self.alive, self.scores, -np.inf).max(axis=1)
+        weights = np.exp(best - best.max())
+        for name, weight in zip(self.active, weights / weights.sum()):
+            probabilities[name] = float(weight)
+        return probabilities
+
+    def initialize(self, observations: Dict[str, List[float]]) -> Tuple[str, float, List[int]]:
+        """
+        This method starts tracking every candidate procedure from the initial frame.
+
+        Args:
+        * observations (Dict[str, List[float]]): the observation probabilities of each step of each procedure
+          at the initial frame, from the classifier of the procedure.
+
+        Returns:
+        * procedure (str): the name of the most likely procedure.
+        * probability (float): a float value of the probability of its best entry.
+        * steps (List[int]): a list of integers representing the step indices in the best entry's history.
+        """
+        self.num_frames = 0
+        self.backpointers.clear()
+        self.__select__(self.names)
+
+        self.scores, self.durations, self.alive = lattice.initial_state(
+            self.tables, self.__log_likelihoods__(observations), self.start_mask)
+        self.num_frames = 1
+        self.__prune__()
+        return self.__get_best_entry__()
+
+    def forward(self, observations: Dict[str, List[float]]) -> Tuple[str, float, List[int]]:
+        """
+        This method advances every remaining procedure by one frame (see initialize()). Only the procedures in
+        `active` need observations, so the classifiers of the pruned ones can be skipped.
+        """
+        if self.num_frames == 0:
+            raise ValueError('You must call initialize() first')
+
+        start = perf_counter() if instrumentation.recorder is not None else None
+        self.scores, self.durations, self.alive, backpointers = lattice.advance(
+            self.tables, self.scores, self.durations, self.alive, self.__log_likelihoods__(observations))
+        self.backpointers.append(backpointers.astype(np.int16))
+        self.num_frames += 1
+        self.__prune__()
+        entry = self.__get_best_entry__()
+        if start is not None:
+            instrumentation.observe('multigraph.forward', perf_counter() - start)
+            instrumentation.observe('multigraph.live_hypotheses', int(self.alive.sum()), instrumentation.COUNT_EDGES)
+            instrumentation.observe('multigraph.active_procedures', len(self.active), instrumentation.COUNT_EDGES)
+        return entry
+
+    def predict(self, observations: Dict[str, List[List[float]]]) -> Iterator[Tuple[str, float, List[int]]]:
+        """
+        This function tracks a complete session (see ViterbiTracker.predict()).
+
+        Args:
+        * observations (Dict[str, List[List[float]]]): the observation probabilities of each procedure with
+          dimensions representing the steps and time frames.
+        """
+        observations = {name: np.asarray(observation) for name, observation in observations.items()}
+        num_frames = min(observation.shape[1] for observation in observations.values())
+
+        yield self.initialize({name: observation[:, 0] for name, observation in observations.items()})
+        for time in range(1, num_frames):
+            yield self.forward({name: observations[name][:, time] for name in self.active})
@@ -1 +1 @@
-MAX_TIME = 500  # maximum number of frames that the tracker algorithm is capable
+MAX_TIME = 500  # maximum number of frames that the tracker algorithm is capable; caps the horizon of each step
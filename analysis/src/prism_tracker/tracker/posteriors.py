@@ -0,0 +1,254 @@
+"""
+Forward-backward posteriors over the explicit-duration lattice.
+
+The hidden state of a frame is a step and the number of frames spent on it so far, with the transitions of
+TransitionTables: a step is stayed on with log_stay[step, duration], or left with log_escape[step, duration] to a next
+step chosen with log_edges. Beyond the horizon of a step its transitions no longer depend on the duration, so the
+durations past the longest horizon are summed into the last one. ViterbiTracker keeps the best duration of each
+step; here all durations are summed over, which gives the posterior probability of each step at each frame given the
+observations.
+
+The recursions run on probabilities normalized at every frame, with the normalizers kept in log space, which is the
+log-space computation without an exp/log per state. Each recursion costs O(num_states * num_durations +
+num_states^2) per frame, like ViterbiTracker.forward(). Whole sessions keep the forward variables only every
+`checkpoint_interval` frames and recompute the others during the backward pass, so memory does not grow with
+num_frames * max_time; the three passes take under twice the time of tracking the session.
+"""
+import collections
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+
+from .tables import TransitionTables
+
+
+class DurationLattice:
+    def __init__(self, tables: TransitionTables, start_mask: Optional[np.ndarray] = None):
+        """
+        The forward and backward recursions over (step, duration) states with shape (num_states, num_durations).
+
+        Args:
+        * tables (TransitionTables): the compiled graph.
+        * start_mask (Optional[np.ndarray]): the steps a session may start on; all steps if None.
+        """
+        self.tables = tables
+        self.start_mask = tables.exists if start_mask is None else tables.exists & start_mask
+
+        # every step is left with a constant probability beyond its horizon, so the last duration stands for all the
+        # longer ones and is stayed on
+        packed = tables.packed  # one state of the tables
+        self.num_durations = int(packed.horizons.max())
+        log_stay, log_escape, valid = tables.dense(self.num_durations, packed)
+        self.stay = np.where(valid, np.exp(log_stay), 0.0)
+        self.escape = np.where(valid, np.exp(log_escape), 0.0)
+        self.edges = np.exp(packed.log_edges)
+
+    @staticmethod
+    def likelihoods(log_likelihoods: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scale the likelihoods of frames with shape (..., num_states).
+
+        Returns:
+        * likelihoods (np.ndarray): the likelihoods of each frame divided by its largest one.
+        * log_scales (np.ndarray): the log of the largest likelihood of each frame.
+        """
+        log_scales = np.max(log_likelihoods, axis=-1)
+        if not np.all(np.isfinite(log_scales)):
+            raise ValueError('No step can explain the current frame')
+        return np.exp(log_likelihoods - log_scales[..., np.newaxis]), log_scales
+
+    @staticmethod
+    def normalize(alpha: np.ndarray, log_scale: float) -> Tuple[np.ndarray, float]:
+        total = alpha.sum()
+        if not total > 0:
+            raise ValueError('No hypothesis is left at the current frame')
+        alpha /= total
+        return alpha, log_scale + float(np.log(total))
+
+    def initial(self, likelihoods: np.ndarray, log_scale: float = 0.0) -> Tuple[np.ndarray, float]:
+        """
+        The forward variables of the first frame (see forward()).
+        """
+        alpha = np.zeros((self.tables.num_states, self.num_durations))
+        alpha[:, 0] = np.where(self.start_mask, likelihoods, 0.0)
+        return self.normalize(alpha, log_scale)
+
+    def forward(self, alpha: np.ndarray, likelihoods: np.ndarray, log_scale: float = 0.0) -> Tuple[np.ndarray, float]:
+        """
+        Advance the forward variables by one frame.
+
+        Args:
+        * alpha (np.ndarray): the forward variables of the previous frame.
+        * likelihoods, log_scale: the scaled likelihoods of the new frame (see likelihoods()).
+
+        Returns:
+        * alpha (np.ndarray): the probability of each state given the observations so far.
+        * log_probability (float): the log-probability of the new observation given the previous ones.
+        """
+        # the last duration loops on itself, and with a single duration it is also the first one
+        next_alpha = np.zeros_like(alpha)
+        np.multiply(alpha[:, :-1], self.stay[:, :-1], out=next_alpha[:, 1:])
+        next_alpha[:, -1] += alpha[:, -1] * self.stay[:, -1]
+        next_alpha[:, 0] += np.einsum('ij,ij->i', alpha, self.escape) @ self.edges
+        next_alpha *= likelihoods[:, np.newaxis]
+        return self.normalize(next_alpha, log_scale)
+
+    def backward(self, beta: np.ndarray, next_likelihoods: np.ndarray) -> np.ndarray:
+        """
+        Move the backward variables (the probability of the following observations given each state, up to a scale)
+        one frame earlier, given the scaled likelihoods of the next frame.
+        """
+        weighted_beta = beta * next_likelihoods[:, np.newaxis]
+        previous_beta = self.escape * (self.edges @ weighted_beta[:, 0])[:, np.newaxis]
+        previous_beta[:, :-1] += self.stay[:, :-1] * weighted_beta[:, 1:]
+        previous_beta[:, -1] += self.stay[:, -1] * weighted_beta[:, -1]
+        peak = previous_beta.max()
+        if peak > 0:
+            previous_beta /= peak
+        return previous_beta
+
+    def initial_beta(self) -> np.ndarray:
+        return np.ones((self.tables.num_states, self.num_durations))
+
+    @staticmethod
+    def step_posterior(alpha: np.ndarray, beta: np.ndarray) -> np.ndarray:
+        """
+        The posterior probability of each step, summed over its durations.
+        """
+        posterior = (alpha * beta).sum(axis=1)
+        total = posterior.sum()
+        if not total > 0:
+            raise ValueError('No hypothesis is left at the current frame')
+        return posterior / total
+
+
+def step_posteriors(tables: TransitionTables, log_likelihoods: np.ndarray, start_mask: Optional[np.ndarray] = None,
+                    checkpoint_interval: int = 64) -> np.ndarray:
+    """
+    This function computes the posterior probability of each step at each frame of a whole session.
+
+    Args:
+    * tables (TransitionTables): the compiled graph.
+    * log_likelihoods (np.ndarray): the confusion-weighted log-likelihoods with shape (num_frames, num_states).
+    * start_mask (Optional[np.ndarray]): the steps a session may start on; all steps if None.
+    * checkpoint_interval (int): the number of frames between the stored forward variables.
+
+    Returns:
+    * posteriors (np.ndarray): the posteriors with shape (num_frames, num_states); each row sums to 1.
+    """
+    lattice = DurationLattice(tables, start_mask)
+    likelihoods, _ = lattice.likelihoods(np.asarray(log_likelihoods))
+    num_frames = len(likelihoods)
+
+    checkpoints = []
+    alpha, _ = lattice.initial(likelihoods[0])
+    for time in range(num_frames):
+        if time > 0:
+            alpha, _ = lattice.forward(alpha, likelihoods[time])
+        if time % checkpoint_interval == 0:
+            checkpoints.append(alpha)
+
+    posteriors = np.empty((num_frames, tables.num_states))
+    beta = lattice.initial_beta()
+    for start in reversed(range(0, num_frames, checkpoint_interval)):
+        alphas = [checkpoints[start // checkpoint_interval]]
+        for time in range(start + 1, min(start + checkpoint_interval, num_frames)):
+            alphas.append(lattice.forward(alphas[-1], likelihoods[time])[0])
+
+        for time in reversed(range(start, start + len(alphas))):
+            posteriors[time] = lattice.step_posterior(alphas[time - start], beta)
+            if time > 0:
+                beta = lattice.backward(beta, likelihoods[time])
+    return posteriors
+
+
+class FixedLagSmoother:
+    def __init__(self, tables: TransitionTables, lag: int, start_step_indices: Optional[List[int]] = None):
+        """
+        Streaming step posteriors: each frame is reported `lag` frames later, given the observations up to then.
+        Each frame costs one forward step and `lag` backward steps.
+
+        Args:
+        * tables (TransitionTables): the compiled graph, e.g., the tables of a ViterbiTracker.
+        * lag (int): the number of future frames used for each posterior; 0 gives the filtered posteriors.
+        * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
+        """
+        start_mask = None
+        if start_step_indices is not None:
+            start_mask = np.zeros(tables.num_states, dtype=bool)
+            start_mask[start_step_indices] = True
+        self.lattice = DurationLattice(tables, start_mask)
+        self.tables = tables
+        self.lag = lag
+
+        self.confusion_matrix: Optional[List[List[float]]] = None
+        self.weights: Optional[np.ndarray] = None
+
+        # the forward variables of the last frame, and those (and the scaled likelihoods) of the frames not reported yet
+        self.alpha: Optional[np.ndarray] = None
+        self.log_evidence = 0.0  # the log-probability of the observations so far
+        self.alphas: Deque[np.ndarray] = collections.deque()
+        self.likelihoods: Deque[np.ndarray] = collections.deque()
+        self.num_frames = 0
+
+    def __likelihoods__(self, observation: List[float],
+                        confusion_matrix: List[List[float]]) -> Tuple[np.ndarray, float]:
+        if confusion_matrix is not self.confusion_matrix:
+            self.confusion_matrix = confusion_matrix
+            self.weights = self.tables.confusion_weights(confusion_matrix)
+        likelihoods, log_scale = self.lattice.likelihoods(self.tables.log_likelihoods(observation, self.weights))
+        return likelihoods, float(log_scale)
+
+    def __smooth__(self) -> Tuple[int, np.ndarray]:
+        """
+        This method reports the oldest pending frame given all of the pending frames.
+        """
+        beta = self.lattice.initial_beta()
+        for likelihoods in list(self.likelihoods)[:0:-1]:
+            beta = self.lattice.backward(beta, likelihoods)
+        frame = self.num_frames - len(self.alphas)
+        posterior = self.lattice.step_posterior(self.alphas.popleft(), beta)
+        self.likelihoods.popleft()
+        return frame, posterior
+
+    def initialize(self, observation: List[float], confusion_matrix: List[List[float]]
+                   ) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        This method starts a session from its first frame.
+
+        Returns:
+        * frame (int), posterior (np.ndarray): the index of the reported frame and the posterior of each step, or None
+          until `lag` frames have followed the first one.
+        """
+        likelihoods, log_scale = self.__likelihoods__(observation, confusion_matrix)
+        self.alphas.clear()
+        self.likelihoods.clear()
+        self.alpha, self.log_evidence = self.lattice.initial(likelihoods, log_scale)
+        self.alphas.append(self.alpha)
+        self.likelihoods.append(likelihoods)
+        self.num_frames = 1
+        return self.__smooth__() if self.lag == 0 else None
+
+    def forward(self, observation: List[float], confusion_matrix: List[List[float]]
+                ) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        This method adds a frame and reports the frame `lag` frames before it (see initialize()).
+        """
+        if self.num_frames == 0:
+            raise ValueError('You must call initialize() first')
+        likelihoods, log_scale = self.__likelihoods__(observation, confusion_matrix)
+        self.alpha, log_probability = self.lattice.forward(self.alpha, likelihoods, log_scale)
+        self.log_evidence += log_probability
+        self.alphas.append(self.alpha)
+        self.likelihoods.append(likelihoods)
+        self.num_frames += 1
+        return self.__smooth__() if len(self.alphas) > self.lag else None
+
+    def flush(self) -> List[Tuple[int, np.ndarray]]:
+        """
+        This method reports the remaining frames at the end of a session, given the frames that followed them.
+        """
+        reported = []
+        while len(self.alphas) > 0:
+            reported.append(self.__smooth__())
+        return reported
@@ -0,0 +1,199 @@
+from time import perf_counter
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .. import instrumentation
+from . import lattice
+from .snapshot import TrackerState, decode_state, encode_state
+from .tables import TransitionTables
+
+
+class SessionManager:
+    def __init__(self, tables: TransitionTables, confusion_matrix: List[List[float]], capacity: int = 256,
+                 window: int = 64, start_step_indices: Optional[List[int]] = None,
+                 on_evict: Optional[Callable[[Hashable], None]] = None):
+        """
+        Tracks many concurrent sessions over one shared compiled graph.
+        The state of every session lives in preallocated arrays, and step() advances all sessions that have a pending
+        frame in one vectorized update. Memory is bounded by `capacity`: opening a session when all slots are taken
+        evicts the least recently updated one.
+
+        Args:
+        * tables (TransitionTables): the compiled graph shared by the sessions.
+        * confusion_matrix (List[List[float]]): a matrix containing the confusion probabilities between each step in a
+          procedure.
+        * capacity (int): the maximum number of sessions held at once.
+        * window (int): the number of past frames whose backpointers are kept per session (see path()).
+        * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
+        * on_evict (Optional[Callable]): called with the id of every session evicted to make room.
+        """
+        self.tables = tables
+        self.weights = tables.confusion_weights(confusion_matrix)
+        self.capacity = capacity
+        self.window = window
+
+        self.start_mask = None
+        if start_step_indices is not None:
+            self.start_mask = np.zeros(tables.num_states, dtype=bool)
+            self.start_mask[start_step_indices] = True
+
+        num_states = tables.num_states
+        self.scores = np.full((capacity, num_states), -np.inf)
+        self.durations = np.zeros((capacity, num_states), dtype=np.int32)
+        self.alive = np.zeros((capacity, num_states), dtype=bool)
+        self.backpointers = np.zeros((capacity, window, num_states), dtype=np.int16)
+        self.num_frames = np.zeros(capacity, dtype=np.int64)
+        self.last_update = np.zeros(capacity, dtype=np.int64)
+
+        self.pending_log_likelihoods = np.zeros((capacity, num_states))
+        self.has_pending = np.zeros(capacity, dtype=bool)
+
+        self.slots: Dict[Hashable, int] = {}
+        self.session_ids: List[Optional[Hashable]] = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.on_evict = on_evict
+        self.clock = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, session_id: Hashable):
+        return session_id in self.slots
+
+    def open(self, session_id: Hashable) -> int:
+        """
+        Open a session (if not open yet) and return its slot, evicting the least recently updated session when full.
+        """
+        if session_id in self.slots:
+            return self.slots[session_id]
+
+        if len(self.free_slots) == 0:
+            occupied = np.array(list(self.slots.values()))
+            lru_slot = int(occupied[np.argmin(self.last_update[occupied])])
+            lru_session_id = self.session_ids[lru_slot]
+            self.close(lru_session_id)
+            if self.on_evict is not None:
+                self.on_evict(lru_session_id)
+
+        slot = self.free_slots.pop()
+        self.slots[session_id] = slot
+        self.session_ids[slot] = session_id
+        self.num_frames[slot] = 0
+        self.alive[slot] = False
+        self.has_pending[slot] = False
+        self.last_update[slot] = self.clock
+        return slot
+
+    def close(self, session_id: Hashable):
+        slot = self.slots.pop(session_id)
+        self.session_ids[slot] = None
+        self.has_pending[slot] = False
+        self.free_slots.append(slot)
+
+    def evict_idle(self, max_idle_steps: int) -> List[Hashable]:
+        """
+        Close the sessions that were not updated during the last `max_idle_steps` calls of step().
+        """
+        idle = [session_id for session_id, slot in self.slots.items()
+                if self.clock - self.last_update[slot] > max_idle_steps]
+        for session_id in idle:
+            self.close(session_id)
+        return idle
+
+    def push(self, session_id: Hashable, observation: List[float]):
+        """
+        Queue the observation probabilities of the next frame of a session, opening the session if needed.
+        A session has at most one pending frame; call step() before pushing the following one.
+        """
+        slot = self.open(session_id)
+        if self.has_pending[slot]:
+            raise ValueError(f'session {session_id} already has a pending frame; call step() first')
+        self.pending_log_likelihoods[slot] = self.tables.log_likelihoods(observation, self.weights)
+        self.has_pending[slot] = True
+
+    def step(self) -> Dict[Hashable, Tuple[float, int]]:
+        """
+        Advance every session that has a pending frame.
+
+        Returns:
+        * results (Dict[Hashable, Tuple[float, int]]): the probability and the step index of the best hypothesis of
+          each advanced session (-1 if no hypothesis is left).
+        """
+        self.clock += 1
+        rows = np.nonzero(self.has_pending)[0]
+        if len(rows) == 0:
+            return {}
+        start = perf_counter() if instrumentation.recorder is not None else None
+
+        first = self.num_frames[rows] == 0
+        log_likelihoods = self.pending_log_likelihoods[rows]
+
+        new_rows, old_rows = rows[first], rows[~first]
+        if len(new_rows) > 0:
+            scores, durations, alive = lattice.initial_state(self.tables, log_likelihoods[first], self.start_mask)
+            self.scores[new_rows], self.durations[new_rows], self.alive[new_rows] = scores, durations, alive
+            self.backpointers[new_rows, 0] = np.arange(self.tables.num_states)
+        if len(old_rows) > 0:
+            scores, durations, alive, backpointers = lattice.advance(
+                self.tables, self.scores[old_rows], self.durations[old_rows], self.alive[old_rows],
+                log_likelihoods[~first])
+            self.scores[old_rows], self.durations[old_rows], self.alive[old_rows] = scores, durations, alive
+            self.backpointers[old_rows, self.num_frames[old_rows] % self.window] = backpointers
+
+        self.num_frames[rows] += 1
+        self.last_update[rows] = self.clock
+        self.has_pending[rows] = False
+
+        steps = lattice.best_steps(self.scores[rows], self.alive[rows])
+        probabilities = np.where(steps >= 0, self.scores[rows, np.maximum(steps, 0)], -np.inf)
+        if start is not None:
+            instrumentation.observe('sessions.step', perf_counter() - start)
+            instrumentation.count('sessions.frames', len(rows))
+        return {self.session_ids[row]: (float(prob), int(step)) for row, prob, step in zip(rows, probabilities, steps)}
+
+    def path(self, session_id: Hashable, length: Optional[int] = None) -> List[int]:
+        """
+        Backtrack the step indices of the best path over the last `length` frames (at most `window`).
+        """
+        slot = self.slots[session_id]
+        num_frames = int(self.num_frames[slot])
+        length = min(num_frames, self.window if length is None else min(length, self.window))
+        if length == 0:
+            return []
+
+        step = int(lattice.best_steps(self.scores[slot], self.alive[slot]))
+        if step < 0:
+            return []
+        path = [step]
+        for frame in range(num_frames - 1, num_frames - length, -1):
+            step = int(self.backpointers[slot, frame % self.window, step])
+            path.append(step)
+        return path[::-1]
+
+    def snapshot(self, session_id: Hashable) -> bytes:
+        """
+        Serialize the state of a session, including its backpointer window (see snapshot.py).
+        """
+        slot = self.slots[session_id]
+        num_frames = int(self.num_frames[slot])
+        frames = np.arange(num_frames - min(max(num_frames - 1, 0), self.window - 1), num_frames)
+        return encode_state(TrackerState(self.scores[slot], self.durations[slot], self.alive[slot],
+                                         self.backpointers[slot, frames % self.window], num_frames,
+                                         self.tables.fingerprint))
+
+    def restore(self, session_id: Hashable, data: bytes):
+        """
+        Restore a session from a snapshot taken by this class or by ViterbiTracker.snapshot(), e.g., in another
+        process. Any state of the session in this manager is replaced.
+        """
+        state = decode_state(data, num_states=self.tables.num_states, fingerprint=self.tables.fingerprint)
+        slot = self.open(session_id)
+        self.scores[slot], self.durations[slot], self.alive[slot] = state.scores, state.durations, state.alive
+        self.num_frames[slot] = state.num_frames
+
+        backpointers = state.backpointers[max(len(state.backpointers) - (self.window - 1), 0):]
+        frames = np.arange(state.num_frames - len(backpointers), state.num_frames)
+        self.backpointers[slot, frames % self.window] = backpointers
+        self.has_pending[slot] = False
+        self.last_update[slot] = self.clock
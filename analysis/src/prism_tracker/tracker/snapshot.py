@@ -0,0 +1,95 @@
+"""
+A compact binary format for the state of a tracked session.
+
+Layout (little-endian):
+    header       magic (4s), version (H), num_states (H), num_frames (Q), num_backpointers (I), tables fingerprint (I)
+    scores       float64[num_states]
+    durations    int16[num_states]
+    alive        packed bits of bool[num_states]
+    backpointers int16[num_backpointers, num_states], oldest first; the last row belongs to the last frame
+
+A snapshot of a 30-step graph with a 64-frame backpointer window takes about 4 KB.
+"""
+import struct
+from typing import Optional
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'PRTS'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHQII')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class TrackerState:
+    def __init__(self, scores: np.ndarray, durations: np.ndarray, alive: np.ndarray, backpointers: np.ndarray,
+                 num_frames: int, fingerprint: int):
+        """
+        The state of one session.
+
+        Args:
+        * scores (np.ndarray): the log-probability of the best path ending on each step.
+        * durations (np.ndarray): the number of frames spent on each step along that path.
+        * alive (np.ndarray): whether such a path exists.
+        * backpointers (np.ndarray): the source steps of the last frames, with shape (num_backpointers, num_states);
+          any sequence of rows when encoding.
+        * num_frames (int): the number of frames tracked so far.
+        * fingerprint (int): the fingerprint of the transition tables the state was computed with.
+        """
+        self.scores = scores
+        self.durations = durations
+        self.alive = alive
+        self.backpointers = backpointers
+        self.num_frames = num_frames
+        self.fingerprint = fingerprint
+
+
+def encode_state(state: TrackerState) -> bytes:
+    num_states = len(state.scores)
+    return b''.join([
+        _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, num_states, state.num_frames, len(state.backpointers),
+                     state.fingerprint),
+        np.asarray(state.scores, dtype='<f8').tobytes(),
+        np.asarray(state.durations, dtype='<i2').tobytes(),
+        np.packbits(state.alive).tobytes(),
+    ] + [np.asarray(row, dtype='<i2').tobytes() for row in state.backpointers])
+
+
+def decode_state(data: bytes, num_states: Optional[int] = None, fingerprint: Optional[int] = None) -> TrackerState:
+    """
+    Decode a snapshot, checking that it matches the expected graph if `num_states`/`fingerprint` are given.
+    """
+    if len(data) < _HEADER.size:
+        raise SnapshotError('truncated snapshot header')
+    magic, version, snapshot_num_states, num_frames, num_backpointers, snapshot_fingerprint = \
+        _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError('not a tracker snapshot')
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f'unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})')
+    if num_states is not None and snapshot_num_states != num_states:
+        raise SnapshotError(f'snapshot has {snapshot_num_states} steps, but the graph has {num_states}')
+    if fingerprint is not None and snapshot_fingerprint != fingerprint:
+        raise SnapshotError('snapshot was taken with different transition tables')
+
+    num_states = snapshot_num_states
+    num_packed = (num_states + 7) // 8
+    expected_size = _HEADER.size + num_states * (8 + 2) + num_packed + num_backpointers * num_states * 2
+    if len(data) != expected_size:
+        raise SnapshotError(f'snapshot has {len(data)} bytes, expected {expected_size}')
+
+    offset = _HEADER.size
+    scores = np.frombuffer(data, dtype='<f8', count=num_states, offset=offset).copy()
+    offset += num_states * 8
+    durations = np.frombuffer(data, dtype='<i2', count=num_states, offset=offset).astype(np.int32)
+    offset += num_states * 2
+    alive = np.unpackbits(np.frombuffer(data, dtype=np.uint8, count=num_packed, offset=offset),
+                          count=num_states).astype(bool)
+    offset += num_packed
+    backpointers = np.frombuffer(data, dtype='<i2', count=num_backpointers * num_states, offset=offset) \
+        .reshape(num_backpointers, num_states).astype(np.int16)
+    return TrackerState(scores, durations, alive, backpointers, num_frames, snapshot_fingerprint)
@@ -0,0 +1,271 @@
+import threading
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .. import instrumentation
+from .collections import Graph, Step
+from .params import MAX_TIME
+
+MIN_STD_TIME = 1.0  # the smallest standard deviation of a step duration (frames), e.g., for steps seen only once
+HORIZON_SURVIVAL = 1e-6  # the probability of staying on a step beyond which its hazard is taken as constant
+MIN_MATERIALIZED = 32  # the durations computed at once when a step table grows
+
+
+def duration_rows(mean_times: np.ndarray, std_times: np.ndarray,
+                  length: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    This function computes the log-probability of staying on a step and of leaving it after each duration 0, ...,
+    length - 1, from a normal distribution of its duration (see TransitionTables).
+    The probabilities come from the log of the survival function, so they stay finite far in the tail.
+
+    Args:
+    * mean_times, std_times (np.ndarray): the distribution of each step with shape (num_steps,); a step without a
+      finite mean (never observed) has no transitions.
+    * length (int): the number of durations.
+
+    Returns:
+    * log_stay, log_escape (np.ndarray): the log-probabilities with shape (num_steps, length).
+    * valid (np.ndarray): whether any transition exists after each duration.
+    """
+    from scipy import stats
+
+    observed = np.isfinite(mean_times)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_survival = stats.norm.logsf(np.arange(length + 1), loc=mean_times[:, np.newaxis],
+                                        scale=std_times[:, np.newaxis])
+        log_stay = np.minimum(log_survival[:, 1:] - log_survival[:, :-1], 0.0)
+        log_escape = np.log(-np.expm1(log_stay))
+    valid = observed & (np.isfinite(log_stay) | np.isfinite(log_escape))
+    return np.where(valid, log_stay, -np.inf), np.where(valid, log_escape, -np.inf), valid
+
+
+class PackedRows:
+    def __init__(self, generation: int, mean_times: np.ndarray, std_times: np.ndarray, horizons: np.ndarray,
+                 lengths: np.ndarray, rows: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], log_edges: np.ndarray,
+                 edge_mask: np.ndarray):
+        """
+        One consistent state of the transition tables: the duration model of every step with its materialized rows,
+        concatenated so that one fancy index looks them all up, and the edges. Instances are never modified; the
+        tables swap in a new one when rows grow or steps change, so a frame that reads a single instance never mixes
+        two states, even while other threads update the tables.
+
+        Args:
+        * generation (int): counts the calls of update_steps(); growing the rows keeps it.
+        * mean_times, std_times, horizons (np.ndarray): the duration model of each step (see TransitionTables).
+        * lengths (np.ndarray): the number of durations materialized for each step.
+        * rows (List[Tuple[np.ndarray, np.ndarray, np.ndarray]]): log_stay, log_escape and valid of each step.
+        * log_edges, edge_mask (np.ndarray): the edges between steps.
+        """
+        self.generation = generation
+        self.mean_times = mean_times
+        self.std_times = std_times
+        self.horizons = horizons
+        self.lengths = lengths
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.intp)
+        self.rows = rows
+        self.log_stay, self.log_escape, self.valid = [
+            np.concatenate([row[i] for row in rows]) if len(rows) > 0 else np.zeros(0) for i in range(3)]
+        self.log_edges = log_edges
+        self.edge_mask = edge_mask
+
+    def grown(self, needed: np.ndarray) -> 'PackedRows':
+        """
+        A copy whose steps that need more durations than materialized are grown, at least doubling them.
+
+        Args:
+        * needed (np.ndarray): the number of durations needed for each step, at most its horizon.
+        """
+        lengths, rows = self.lengths.copy(), list(self.rows)
+        for step_index in np.nonzero(needed > self.lengths)[0]:
+            lengths[step_index] = min(max(needed[step_index], 2 * lengths[step_index]), self.horizons[step_index])
+            rows[step_index] = tuple(row[0] for row in duration_rows(
+                self.mean_times[step_index:step_index + 1], self.std_times[step_index:step_index + 1],
+                lengths[step_index]))
+        return PackedRows(self.generation, self.mean_times, self.std_times, self.horizons, lengths, rows,
+                          self.log_edges, self.edge_mask)
+
+    def lookup(self, durations: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Look up the materialized rows (see TransitionTables.lookup()); the durations must be covered.
+        """
+        index = self.offsets + np.minimum(durations, self.horizons - 1)
+        return self.log_stay[index], self.log_escape[index], self.valid[index]
+
+
+class TransitionTables:
+    def __init__(self, graph: Graph, max_time: int = MAX_TIME):
+        """
+        The transition tables of a graph compiled into arrays. They are static, so one instance can be shared by
+        any number of trackers and sessions.
+
+        The duration model of each step is computed lazily: the first durations are computed when a hypothesis
+        first needs them, and the table grows (doubling) up to the horizon of the step, the duration beyond which it
+        is stayed on with probability below HORIZON_SURVIVAL (at most max_time). Beyond its horizon, a step is left
+        with the constant probability of its last duration, so memory and time follow the actual step durations.
+        A standard deviation that is zero or undefined (e.g., a step seen once) is raised to MIN_STD_TIME, and a step
+        without a mean duration (never observed) has no transitions.
+        The state of the tables is held by one immutable PackedRows, replaced as a whole when rows grow or steps are
+        updated; a frame reads it once (see materialize()).
+
+        Args:
+        * graph (Graph): a graph object built using build_graph(), which represents transitions between the different
+          steps in a procedure.
+        * max_time (int): the largest horizon of a step; the durations of the hypotheses saturate there.
+        """
+        self.max_time = max_time
+        self.steps: List[Step] = sorted(graph.steps, key=lambda step: step.index)
+        self.num_states = max([step.index for step in graph.steps]) + 1
+        self.step_indices = np.array([step.index for step in self.steps])
+
+        self.exists = np.zeros(self.num_states, dtype=bool)
+        self.exists[self.step_indices] = True
+
+        # the duration model of each step: a normal distribution, and the length of its table (see lookup());
+        # (from_step_index, to_step_index) -> log-probability of the edge; self-loops are covered by the durations
+        empty = tuple(row[0] for row in duration_rows(np.array([np.nan]), np.array([np.nan]), 1))
+        self.packed = PackedRows(0, np.full(self.num_states, np.nan), np.full(self.num_states, np.nan),
+                                 np.ones(self.num_states, dtype=np.int64), np.ones(self.num_states, dtype=np.int64),
+                                 [empty] * self.num_states, np.full((self.num_states, self.num_states), -np.inf),
+                                 np.zeros((self.num_states, self.num_states), dtype=bool))
+        self.lock = threading.Lock()
+        self._fingerprint = None
+
+        self.update_steps(graph, [step.index for step in self.steps])
+
+    @property
+    def horizons(self) -> np.ndarray:
+        return self.packed.horizons
+
+    @property
+    def log_edges(self) -> np.ndarray:
+        return self.packed.log_edges
+
+    @property
+    def edge_mask(self) -> np.ndarray:
+        return self.packed.edge_mask
+
+    def update_steps(self, graph: Graph, step_indices: Iterable[int]):
+        """
+        Reset the duration model and rebuild the edge rows of the given steps from the graph, e.g., after its
+        statistics changed. The duration rows are computed again on demand.
+        """
+        from scipy import stats
+
+        instrumentation.count('tracker.table_rebuilds')
+        steps = {step.index: step for step in graph.steps}
+        step_indices = np.array(list(step_indices), dtype=np.int64)
+        mean_times = np.array([steps[step_index].mean_time for step_index in step_indices], dtype=np.float64)
+        std_times = np.array([steps[step_index].std_time for step_index in step_indices], dtype=np.float64)
+        std_times = np.where(np.isfinite(std_times), np.maximum(std_times, MIN_STD_TIME), MIN_STD_TIME)
+        horizons = stats.norm.isf(HORIZON_SURVIVAL, loc=mean_times, scale=std_times)
+        horizons = np.clip(np.ceil(np.where(np.isfinite(horizons), horizons, 1)), 1, self.max_time).astype(np.int64)
+        length = min(MIN_MATERIALIZED, int(horizons.max())) if len(step_indices) > 0 else 1
+        first_rows = duration_rows(mean_times, std_times, length)
+
+        with self.lock:
+            packed = self.packed
+            all_mean_times, all_std_times = packed.mean_times.copy(), packed.std_times.copy()
+            all_horizons, lengths, rows = packed.horizons.copy(), packed.lengths.copy(), list(packed.rows)
+            log_edges, edge_mask = packed.log_edges.copy(), packed.edge_mask.copy()
+            all_mean_times[step_indices], all_std_times[step_indices] = mean_times, std_times
+            all_horizons[step_indices] = horizons
+            for i, step_index in enumerate(step_indices):
+                lengths[step_index] = min(length, horizons[i])
+                rows[step_index] = tuple(row[i, :lengths[step_index]] for row in first_rows)
+
+                step = steps[step_index]
+                log_edges[step.index] = -np.inf
+                edge_mask[step.index] = False
+                for dest_step, dest_prob in graph.edges.get(step, {}).items():
+                    if dest_step.index == step.index:
+                        continue
+                    with np.errstate(divide='ignore'):
+                        log_edges[step.index, dest_step.index] = np.log(dest_prob)
+                    edge_mask[step.index, dest_step.index] = True
+            self.packed = PackedRows(packed.generation + 1, all_mean_times, all_std_times, all_horizons, lengths, rows,
+                                     log_edges, edge_mask)
+
+    def materialize(self, durations: np.ndarray, packed: Optional[PackedRows] = None) -> PackedRows:
+        """
+        Return a state of the tables whose rows cover the given durations, growing them if needed. The durations and
+        the edges of a frame must be read from the returned state only.
+
+        Args:
+        * durations (np.ndarray): the number of frames spent on each step so far, with shape (..., num_states).
+        * packed (Optional[PackedRows]): the state to cover the durations of; the current one if None. If the steps
+          were updated since, it is grown on its own and the current state is left as it is.
+        """
+        packed = self.packed if packed is None else packed
+        needed = np.minimum(durations, packed.horizons - 1).reshape(-1, self.num_states).max(axis=0, initial=-1) + 1
+        if np.all(needed <= packed.lengths):
+            return packed
+
+        with self.lock:
+            current = self.packed
+            base = current if current.generation == packed.generation else packed
+            if np.all(needed <= base.lengths):  # another thread grew them
+                return base
+            grown = base.grown(needed)
+            instrumentation.count('tracker.materialized_steps', int((needed > base.lengths).sum()))
+            if base is current:
+                self.packed = grown
+        return grown
+
+    @property
+    def fingerprint(self) -> int:
+        """
+        A checksum of the tables, so that a tracker snapshot is only restored into the graph it was taken with.
+        """
+        packed = self.packed
+        if self._fingerprint is None or self._fingerprint[0] != packed.generation:
+            fingerprint = zlib.crc32(np.array([self.num_states, self.max_time]).tobytes())
+            for table in (packed.mean_times, packed.std_times, packed.horizons, packed.log_edges, packed.edge_mask):
+                fingerprint = zlib.crc32(table.tobytes(), fingerprint)
+            self._fingerprint = (packed.generation, fingerprint)
+        return self._fingerprint[1]
+
+    def lookup(self, durations: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Look up the duration model of every step at the given durations, computing the missing durations first.
+
+        Args:
+        * durations (np.ndarray): the number of frames spent on each step so far, with shape (..., num_states).
+
+        Returns:
+        * log_stay (np.ndarray): the log-probability of staying on the step.
+        * log_escape (np.ndarray): the log-probability of leaving the step.
+        * valid (np.ndarray): whether the hypothesis has any transition at all.
+        """
+        return self.materialize(durations).lookup(durations)
+
+    def dense(self, num_durations: int, packed: Optional[PackedRows] = None
+              ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The duration model of every step at the durations 0, ..., num_durations - 1, with shape
+        (num_states, num_durations); the last duration stands for all the longer ones if it is beyond every horizon.
+        It is read from `packed` (see materialize()) if given.
+        """
+        durations = np.broadcast_to(np.arange(num_durations)[:, np.newaxis], (num_durations, self.num_states))
+        return tuple(table.T.copy() for table in self.materialize(durations, packed).lookup(durations))
+
+    def confusion_weights(self, confusion_matrix: List[List[float]]) -> np.ndarray:
+        """
+        Convert a confusion matrix into a (num_states, num_states) matrix W such that observation @ W.T gives the
+        confusion-weighted likelihood of each actual step (see ViterbiTracker.forward()).
+        """
+        weights = np.zeros((self.num_states, self.num_states))
+        for step in self.steps:
+            weights[step.index, self.step_indices] = np.asarray(confusion_matrix[step.index])[:len(self.steps)]
+        return weights
+
+    def log_likelihoods(self, observations: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Compute the confusion-weighted log-likelihoods of observations with shape (..., num_states).
+        The steps whose confusion probabilities are undefined (NaN, e.g., no validation frames) are impossible.
+        """
+        observations = np.asarray(observations, dtype=np.float64)[..., :self.num_states]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_likelihoods = np.log(observations @ weights.T)
+        return np.where(np.isnan(log_likelihoods), -np.inf, log_likelihoods)
@@ -1,58 +1,116 @@
-from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import collections
+from time import perf_counter
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
-from scipy import stats
 
-from .collections import Graph, HiddenState, HiddenTransition, ViterbiEntry
-from .params import MAX_TIME
+from .. import instrumentation
+from . import lattice
+from .collections import Graph, HiddenState, ViterbiEntry
+from .snapshot import TrackerState, decode_state, encode_state
+from .tables import TransitionTables
 
 
 class ViterbiTracker:
-    def __init__(self, graph: Graph, start_step_indices: Optional[List[int]] = None):
+    def __init__(self, graph: Graph, start_step_indices: Optional[List[int]] = None,
+                 tables: Optional[TransitionTables] = None, history_window: Optional[int] = None):
         """
         Args:
         * graph (Graph): a graph object built using build_graph(), which represents transitions between the different steps in a procedure.
         * start_step_indices (Optional[List[int]]): a list of integers representing the indices of the starting step.
+        * tables (Optional[TransitionTables]): the compiled transition tables of the graph, to share them between
+          trackers.
+        * history_window (Optional[int]): the number of past frames returned as the history of the best entry; all
+          frames if None.
         """
         self.start_step_indices = start_step_indices
-        self.curr_entries: Optional[Dict[int, ViterbiEntry]] = None
-
-        # use list-based matrix to accelerate
-        self.steps = sorted(graph.steps, key=lambda step: step.index)
-        max_step_index = max([step.index for step in graph.steps])
-
-        # (from_step_index, time_frame) -> List[transition]
-        self.transitions: List[List[List[HiddenTransition]]] = [[[] for time in range(MAX_TIME)]
-                                                                for _ in range(max_step_index + 1)]
-
-        for step in self.steps:
-            # cdf represents the (reversed) probability of staying on the step at the time
-            prob = 1 - stats.norm.cdf(range(MAX_TIME), loc=step.mean_time, scale=step.std_time)
-
-            for time in range(0, MAX_TIME - 1):
-                escape_prob = 1 - prob[time + 1] / prob[time]
-                if np.isnan(escape_prob):
-                    continue
-
-                # use log-probability to avoid underflow
-                self.transitions[step.index][time].append(HiddenTransition(step.index, np.log(1 - escape_prob)))
-                for dest_step, dest_prob in graph.edges.get(step, {}).items():
-                    self.transitions[step.index][time].append(
-                        HiddenTransition(dest_step.index, np.log(escape_prob * dest_prob)))
-
-    def __get_best_entry__(self, entries: Iterable[ViterbiEntry]) -> Tuple[float, List[int]]:
+        self.tables = TransitionTables(graph) if tables is None else tables
+        self.steps = self.tables.steps
+        self.history_window = history_window
+
+        self.start_mask = None
+        if start_step_indices is not None:
+            self.start_mask = np.zeros(self.tables.num_states, dtype=bool)
+            self.start_mask[start_step_indices] = True
+
+        self.confusion_matrix: Optional[List[List[float]]] = None
+        self.weights: Optional[np.ndarray] = None
+
+        # the lattice of the current frame (see lattice.py)
+        self.num_frames = 0
+        self.scores = np.full(self.tables.num_states, -np.inf)
+        self.durations = np.zeros(self.tables.num_states, dtype=np.int32)
+        self.alive = np.zeros(self.tables.num_states, dtype=bool)
+
+        # backpointers[-1] maps each step of the last frame to its step at the frame before
+        max_backpointers = None if history_window is None else max(history_window - 1, 0)
+        self.backpointers: Deque[np.ndarray] = collections.deque(maxlen=max_backpointers)
+
+        # the best path returned last time, starting at frame `path_start`
+        self.path: List[int] = []
+        self.path_start = 0
+
+    @property
+    def curr_entries(self) -> Optional[Dict[int, ViterbiEntry]]:
         """
-        This method selects the best entry from a list of ViterbiEntry based on probability.
-
-        Args:
-        * entries (Iterable[ViterbiEntry]): a list of ViterbiEntry to choose from.
+        The current entries in the form of ViterbiEntry (within the history window), for inspection.
+        """
+        if self.num_frames == 0:
+            return None
+
+        entries = {}
+        for step_index in np.nonzero(self.alive)[0]:
+            path = self.__backtrack__(int(step_index), cache=False)
+            history, time = [], 0
+            for i, path_step_index in enumerate(path):
+                time = time + 1 if i > 0 and path[i - 1] == path_step_index else 0
+                history.append(HiddenState(path_step_index, time))
+            entries[int(step_index)] = ViterbiEntry(float(self.scores[step_index]), history)
+        return entries
+
+    def __log_likelihoods__(self, observation: List[float], confusion_matrix: List[List[float]]) -> np.ndarray:
+        if confusion_matrix is not self.confusion_matrix:
+            self.confusion_matrix = confusion_matrix
+            self.weights = self.tables.confusion_weights(confusion_matrix)
+        return self.tables.log_likelihoods(observation, self.weights)
+
+    def __backtrack__(self, step_index: int, cache: bool = True) -> List[int]:
+        """
+        This method follows the backpointers from a step of the last frame.
+        The previous path is reused as soon as the backtracked path joins it, as its frames cannot change anymore.
+        """
+        last_frame = self.num_frames - 1
+        first_frame = last_frame - len(self.backpointers)
+
+        reversed_path = [step_index]
+        prefix: List[int] = []
+        for i in range(1, len(self.backpointers) + 1):
+            step_index = int(self.backpointers[-i][step_index])
+            frame = last_frame - i
+            path_frame = frame - self.path_start
+            if cache and 0 <= path_frame < len(self.path) and self.path[path_frame] == step_index:
+                prefix = self.path[max(first_frame - self.path_start, 0):path_frame]
+                reversed_path.append(step_index)
+                break
+            reversed_path.append(step_index)
+
+        path = prefix + reversed_path[::-1]
+        if cache:
+            self.path, self.path_start = path, first_frame
+        return path
+
+    def __get_best_entry__(self) -> Tuple[float, List[int]]:
+        """
+        This method selects the best entry of the current frame based on probability.
 
         Returns:
         * probability (float): a float value of the probability of the best entry.
         * steps (List[int]): a list of integers representing the step indices in the best entry's history.
         """
-        entries = sorted(entries, key=lambda entry: entry.probability, reverse=True)
-        return entries[0].probability, [state.step_index for state in entries[0].history]
+        step_index = int(lattice.best_steps(self.scores, self.alive))
+        if step_index < 0:
+            raise ValueError('No hypothesis is left at the current frame')
+        return float(self.scores[step_index]), self.__backtrack__(step_index)
 
     def initialize(self, observation: List[float], confusion_matrix: List[List[float]]) -> Tuple[float, List[int]]:
         """
@@ -66,17 +124,19 @@ class ViterbiTracker:
         * probability (float): a float value of the probability of the best entry.
         * steps (List[int]): a list of integers representing the step indices in the best entry's history.
         """
-        self.curr_entries = {}  # dict[step_index, entry]
-
         # initialize: we don't assume knowing which step to start
-        for current_step in self.steps:
-            acc_prob = 0.0
-            for observed_step, prob in zip(self.steps, confusion_matrix[current_step.index]):
-                if self.start_step_indices is None or current_step.index in self.start_step_indices:
-                    acc_prob += prob * observation[observed_step.index]
-            self.curr_entries[current_step.index] = ViterbiEntry(np.log(acc_prob), [HiddenState(current_step.index, 0)])
+        self.__initialize__(self.__log_likelihoods__(observation, confusion_matrix))
+        return self.__get_best_entry__()
 
-        return self.__get_best_entry__(self.curr_entries.values())
+    def __initialize__(self, log_likelihoods: np.ndarray):
+        """
+        This method starts the lattice from the confusion-weighted log-likelihoods of the first frame.
+        """
+        scores, durations, alive = lattice.initial_state(self.tables, log_likelihoods[np.newaxis], self.start_mask)
+        self.scores, self.durations, self.alive = scores[0], durations[0], alive[0]
+        self.num_frames = 1
+        self.backpointers.clear()
+        self.path, self.path_start = [], 0
 
     def forward(self, observation: List[float], confusion_matrix: List[List[float]],
                 oracle_next_step: Optional[int] = None, oracle_prohibited_steps: Optional[List[int]] = None) -> Tuple[float, List[int]]:
@@ -93,43 +153,44 @@ class ViterbiTracker:
         * probability (float): a float value of the probability of the best entry.
         * steps (List[int]): a list of integers representing the step indices in the best entry's history.
         """
-        if self.curr_entries is None:
+        if self.num_frames == 0:
             raise ValueError('You must call initialize() first')
 
-        next_entries: Dict[int, ViterbiEntry] = {}  # dict[step_index, entry]
-        observed_probs: Dict[int, float] = {}  # dict[step_index, prob]
-
-        for actual_step in self.steps:  # precalculate the influence of the confusion matrix
-            observed_probs[actual_step.index] = 0
-            for observed_step, prob in zip(self.steps, confusion_matrix[actual_step.index]):
-                observed_probs[actual_step.index] += prob * observation[observed_step.index]
-            observed_probs[actual_step.index] = np.log(observed_probs[actual_step.index])
-
-        for curr_state_index, curr_entry in self.curr_entries.items():
-            for transition in self.transitions[curr_state_index][curr_entry.last_state.time]:
-                if oracle_next_step is not None:
-                    if oracle_next_step == curr_state_index:  # too early to transit
-                        continue
-                    elif oracle_next_step != transition.next_step_index:  # the next step should be a different one
-                        continue
-                elif curr_state_index != transition.next_step_index and \
-                        transition.next_step_index in (oracle_prohibited_steps or []):  # cannot transit now
-                    continue
-
-                prob = curr_entry.probability + transition.probability + observed_probs[transition.next_step_index]
-                if transition.next_step_index in next_entries \
-                   and prob < next_entries[transition.next_step_index].probability:
-                    continue
-
-                if curr_state_index == transition.next_step_index:
-                    next_state = HiddenState(transition.next_step_index, curr_entry.last_state.time + 1)
-                else:
-                    next_state = HiddenState(transition.next_step_index, 0)
-
-                next_entries[transition.next_step_index] = ViterbiEntry(prob, curr_entry.history + [next_state])
-
-        self.curr_entries = next_entries
-        return self.__get_best_entry__(self.curr_entries.values())
+        start = perf_counter() if instrumentation.recorder is not None else None
+        self.__advance__(self.__log_likelihoods__(observation, confusion_matrix), oracle_next_step,
+                         oracle_prohibited_steps)
+        entry = self.__get_best_entry__()
+        if start is not None:
+            self.__record_frame__(start)
+        return entry
+
+    def __record_frame__(self, start: float):
+        """
+        This method records the latency of a frame since `start` and the number of live hypotheses.
+        """
+        instrumentation.observe('tracker.forward', perf_counter() - start)
+        instrumentation.observe('tracker.live_hypotheses', int(self.alive.sum()), instrumentation.COUNT_EDGES)
+
+    def __advance__(self, log_likelihoods: np.ndarray, oracle_next_step: Optional[int] = None,
+                    oracle_prohibited_steps: Optional[List[int]] = None):
+        """
+        This method advances the lattice by one frame given its confusion-weighted log-likelihoods.
+        """
+        stay_allowed, move_allowed = None, None
+        if oracle_next_step is not None:  # the only possible transition is to enter the next step from another step
+            stay_allowed = np.zeros(self.tables.num_states, dtype=bool)
+            move_allowed = np.zeros(self.tables.num_states, dtype=bool)
+            move_allowed[oracle_next_step] = True
+        elif oracle_prohibited_steps:  # cannot transit now
+            move_allowed = np.ones(self.tables.num_states, dtype=bool)
+            move_allowed[oracle_prohibited_steps] = False
+
+        scores, durations, alive, backpointers = lattice.advance(
+            self.tables, self.scores[np.newaxis], self.durations[np.newaxis], self.alive[np.newaxis],
+            log_likelihoods[np.newaxis], stay_allowed=stay_allowed, move_allowed=move_allowed)
+        self.scores, self.durations, self.alive = scores[0], durations[0], alive[0]
+        self.backpointers.append(backpointers[0].astype(np.int16))
+        self.num_frames += 1
 
     def predict(self, observations: List[List[float]], confusion_matrix: List[List[float]],
                 oracle: Optional[Dict[int, List[int]]] = None) -> Iterator[Tuple[float, List[int]]]:
@@ -146,12 +207,40 @@ class ViterbiTracker:
         * steps (List[int]): a list of integers representing the step indices in the best entry's history.
         """
         oracle = {} if oracle is None else oracle
+        observations = np.asarray(observations)
 
-        yield self.initialize([observation[0] for observation in observations], confusion_matrix)
+        yield self.initialize(observations[:, 0], confusion_matrix)
 
         # dp: basic viterbi algorithm
-        for time in range(1, len(observations[0])):
+        for time in range(1, observations.shape[1]):
             oracle_next_step = (list(filter(lambda step_index: time in oracle[step_index], oracle.keys())) + [None])[0]
             oracle_prohibited_steps = list(filter(lambda step_index: step_index != oracle_next_step, oracle.keys()))
-            yield self.forward([observation[time] for observation in observations], confusion_matrix,
+            yield self.forward(observations[:, time], confusion_matrix,
                                oracle_next_step=oracle_next_step, oracle_prohibited_steps=oracle_prohibited_steps)
+
+    def snapshot(self, window: Optional[int] = 64) -> bytes:
+        """
+        This method serializes the current state into a compact binary snapshot (see snapshot.py).
+
+        Args:
+        * window (Optional[int]): the number of past frames whose backpointers are kept; all retained ones if None.
+
+        Returns:
+        * data (bytes): the snapshot.
+        """
+        num_backpointers = len(self.backpointers) if window is None else min(len(self.backpointers), max(window - 1, 0))
+        backpointers = list(self.backpointers)[len(self.backpointers) - num_backpointers:]
+        return encode_state(TrackerState(self.scores, self.durations, self.alive, backpointers, self.num_frames,
+                                         self.tables.fingerprint))
+
+    def restore(self, data: bytes):
+        """
+        This method restores the state saved by snapshot(), e.g., in another process.
+        The history of the best entry then starts at the oldest frame of the snapshot window.
+        """
+        state = decode_state(data, num_states=self.tables.num_states, fingerprint=self.tables.fingerprint)
+        self.scores, self.durations, self.alive = state.scores, state.durations, state.alive
+        self.num_frames = state.num_frames
+        self.backpointers.clear()
+        self.backpointers.extend(state.backpointers)
+        self.path, self.path_start = [], 0